@@ -0,0 +1,118 @@
+"""Benchmarks cogs.member_index against full member-list scans on a synthetic guild.
+
+Run from the repository root:  python benchmarks/member_index_bench.py [member_count]
+"""
+import os
+import random
+import string
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import discord
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from cogs.member_index import GuildMemberIndex
+
+GUILD_ID = 1
+ROLE_COUNT = 50
+ADMIN_ROLE_IDS = [GUILD_ID + 1, GUILD_ID + 2]
+MOD_ROLE_IDS = [GUILD_ID + 3, GUILD_ID + 4, GUILD_ID + 5]
+
+def make_guild(member_count: int, seed: int = 1) -> SimpleNamespace:
+    """A stand-in for discord.Guild with just the attributes the index and the scans read."""
+    rng = random.Random(seed)
+    roles = [SimpleNamespace(id=GUILD_ID + i) for i in range(ROLE_COUNT + 1)]
+    staff_roles = roles[1:6]
+    other_roles = roles[6:]
+    started = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    members = []
+    for i in range(member_count):
+        name = "".join(rng.choices(string.ascii_lowercase + "_.", k=rng.randint(4, 16)))
+        member_roles = [roles[0]] + rng.sample(other_roles, rng.randint(0, 5))
+        if rng.random() < 0.001:
+            member_roles.append(rng.choice(staff_roles))
+        members.append(SimpleNamespace(
+            id=10_000 + i,
+            name=name,
+            global_name=None,
+            display_name=name if rng.random() < 0.8 else name.title(),
+            bot=rng.random() < 0.01,
+            status=discord.Status.online if rng.random() < 0.2 else discord.Status.offline,
+            joined_at=started + timedelta(seconds=rng.randint(0, 5 * 365 * 86400)),
+            roles=member_roles
+        ))
+    return SimpleNamespace(id=GUILD_ID, members=members)
+
+def timed(label: str, func, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"  {label:<44} {elapsed * 1e6:>12.1f} us")
+    return result
+
+def scan_staff(guild):
+    # What panel_mod_menu did on every request.
+    admins, mods = [], []
+    for member in guild.members:
+        if member.bot: continue
+        member_role_ids = {role.id for role in member.roles}
+        if any(role_id in member_role_ids for role_id in ADMIN_ROLE_IDS):
+            admins.append(member.id)
+        elif any(role_id in member_role_ids for role_id in MOD_ROLE_IDS):
+            mods.append(member.id)
+    return set(admins), set(mods)
+
+def index_staff(index: GuildMemberIndex):
+    admins = index.members_with_roles(ADMIN_ROLE_IDS)
+    return admins, index.members_with_roles(MOD_ROLE_IDS) - admins
+
+def scan_stats(guild):
+    # What panel_home did on every request.
+    last = sorted(guild.members, key=lambda m: m.joined_at, reverse=True)[0]
+    online = sum(1 for m in guild.members if m.status != discord.Status.offline)
+    bots = sum(1 for m in guild.members if m.bot)
+    return last.id, online, bots
+
+def index_stats(index: GuildMemberIndex):
+    return index.last_joined_id, index.online_count, index.bot_count
+
+def scan_search(guild, query):
+    # What api_user_search did on every request.
+    return next((m.id for m in guild.members if query in m.display_name.lower() and not m.bot), None)
+
+def main():
+    member_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    guild = make_guild(member_count)
+    print(f"Synthetic guild: {member_count} members, {ROLE_COUNT} roles")
+
+    start = time.perf_counter()
+    index = GuildMemberIndex(guild)
+    print(f"  {'build index':<44} {(time.perf_counter() - start) * 1e3:>12.1f} ms")
+
+    print("Staff listing (members holding any admin or mod role):")
+    scanned = timed("full scan", lambda: scan_staff(guild), 5)
+    indexed = timed("role index", lambda: index_staff(index), 1000)
+    assert scanned == indexed, "role index disagrees with the full scan"
+
+    print("Dashboard statistics (newest member, online, bots):")
+    scanned = timed("full scan", lambda: scan_stats(guild), 5)
+    indexed = timed("stats index", lambda: index_stats(index), 1000)
+    assert scanned == indexed, "stats index disagrees with the full scan"
+
+    query = guild.members[member_count // 2].name[1:5]
+    print(f"Name search for {query!r}:")
+    timed("full scan (first match only)", lambda: scan_search(guild, query), 5)
+    timed("trigram index (top 10)", lambda: index.search(query, 10), 1000)
+
+    print("Role change on one member:")
+    member = guild.members[0]
+    def toggle_role():
+        member.roles = member.roles[:-1] if member.roles[-1].id == ADMIN_ROLE_IDS[0] else member.roles + [SimpleNamespace(id=ADMIN_ROLE_IDS[0])]
+        index.update(member)
+    timed("index update", toggle_role, 1000)
+
+if __name__ == "__main__":
+    main()
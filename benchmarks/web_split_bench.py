@@ -0,0 +1,224 @@
+"""Measures the bot's event latency under web load, with the web server in the bot's process and split into workers.
+
+A stand-in bot handles a simulated message event every few milliseconds while a separate load
+process hammers leaderboard pages and widget views. The latency of an event is how late its handler
+finishes relative to when the event was due, which is what users feel as a slow bot.
+
+Run from the repository root:  python benchmarks/web_split_bench.py [--workers 2] [--seconds 10] [--concurrency 32]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+GUILD_ID = 1
+RANKED_USERS = 20_000
+EVENT_INTERVAL_SECONDS = 0.005
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.display_name = f"user{user_id}"
+        self.display_avatar = SimpleNamespace(url=f"https://cdn.example/{user_id}.png")
+
+class FakeBot:
+    """A stand-in for the bot with just what the web server's gateway reads. Half the ranked users are cached."""
+    def __init__(self, app):
+        self.app = app
+        self.action_queue = asyncio.Queue()
+        self.tier_approval_queue = asyncio.Queue()
+        self.guild = SimpleNamespace(id=GUILD_ID, name="Benchmark Guild", icon=None)
+
+    def get_guild(self, guild_id):
+        return self.guild if guild_id == GUILD_ID else None
+
+    def get_user(self, user_id):
+        return FakeUser(user_id) if user_id % 2 == 0 else None
+
+    def get_cog(self, name):
+        return None
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def seed_database(database) -> str:
+    await database.initialize_database()
+    rng = random.Random(1)
+    await database.apply_xp_grants(GUILD_ID, {10_000 + i: rng.randint(0, 500_000) for i in range(RANKED_USERS)})
+    return await database.get_or_create_widget_token(GUILD_ID)
+
+async def run_events(database, stop: asyncio.Event) -> list[float]:
+    """Dispatches a simulated on_message every EVENT_INTERVAL_SECONDS and returns each event's latency in seconds."""
+    loop = asyncio.get_running_loop()
+    latencies = []
+    handlers = set()
+
+    async def on_message(due: float, user_id: int):
+        await database.buffer_channel_activity(GUILD_ID, user_id, 99, message_count=1)
+        latencies.append(loop.time() - due)
+
+    due = loop.time()
+    while not stop.is_set():
+        due += EVENT_INTERVAL_SECONDS
+        await asyncio.sleep(max(0.0, due - loop.time()))
+        task = asyncio.create_task(on_message(due, random.randint(10_000, 10_000 + RANKED_USERS)))
+        handlers.add(task)
+        task.add_done_callback(handlers.discard)
+    await asyncio.gather(*handlers)
+    return latencies
+
+async def run_load_process(port: int, token: str, seconds: float, concurrency: int) -> dict:
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.abspath(__file__), "--load", str(port), "--token", token,
+        "--seconds", str(seconds), "--concurrency", str(concurrency),
+        stdout=asyncio.subprocess.PIPE
+    )
+    stdout, _ = await process.communicate()
+    return json.loads(stdout)
+
+async def wait_for_port(port: int):
+    for _ in range(100):
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"Nothing is listening on port {port}")
+
+async def measure(mode: str, workers: int, seconds: float, concurrency: int) -> dict:
+    import database
+    import web_server
+    from bot_gateway import LocalBotGateway, WidgetBusPublisher, serve_gateway
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+    from ipc import IPCServer
+
+    token = await seed_database(database)
+    bot = FakeBot(web_server.app)
+    web_server.app.gateway = LocalBotGateway(bot)
+    port = free_port()
+    shutdown = asyncio.Event()
+    server_task = ipc_server = None
+    worker_processes = []
+
+    if mode == "in-process":
+        hypercorn_config = Config()
+        hypercorn_config.bind = [f"127.0.0.1:{port}"]
+        server_task = asyncio.create_task(serve(web_server.app, hypercorn_config, shutdown_trigger=shutdown.wait))
+    elif mode == "split":
+        ipc_server = IPCServer(os.path.abspath("bot_ipc.sock"))
+        serve_gateway(ipc_server, web_server.app.gateway)
+        await ipc_server.start()
+        web_server.widget_updates.publisher = WidgetBusPublisher(ipc_server)
+        for worker_id in range(workers):
+            worker_processes.append(await asyncio.create_subprocess_exec(
+                sys.executable, os.path.join(ROOT, "web_worker.py"), "--port", str(port), "--worker-id", str(worker_id),
+                stderr=asyncio.subprocess.DEVNULL
+            ))
+    if mode != "idle":
+        await wait_for_port(port)
+        # Warm up first, so a cold server's first burst (template compiles, opening connections) isn't measured.
+        await run_load_process(port, token, 2, concurrency)
+
+    stop = asyncio.Event()
+    events = asyncio.create_task(run_events(database, stop))
+    if mode == "idle":
+        await asyncio.sleep(seconds)
+        load = {"requests": 0, "errors": 0}
+    else:
+        load = await run_load_process(port, token, seconds, concurrency)
+    stop.set()
+    latencies = sorted(await events)
+
+    shutdown.set()
+    if server_task is not None:
+        await server_task
+    for process in worker_processes:
+        process.send_signal(signal.SIGTERM)
+        await process.wait()
+    if ipc_server is not None:
+        await ipc_server.close()
+    await database.close_database()
+    return {
+        "mode": mode,
+        "events": len(latencies),
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "max_ms": latencies[-1] * 1000,
+        "requests_per_second": load["requests"] / seconds,
+        "errors": load["errors"]
+    }
+
+async def generate_load(port: int, token: str, seconds: float, concurrency: int) -> dict:
+    """Walks the XP leaderboard API page by page and views the widget, from `concurrency` clients at once."""
+    import httpx
+    counts = {"requests": 0, "errors": 0}
+    deadline = time.monotonic() + seconds
+
+    async def client_loop(client):
+        cursor = None
+        while time.monotonic() < deadline:
+            if random.random() < 0.2:
+                path = f"/widget/view/{token}"
+            else:
+                path = f"/api/v1/leaderboard/xp/{GUILD_ID}?limit=100" + (f"&cursor={cursor}" if cursor else "")
+            try:
+                response = await client.get(path)
+                response.raise_for_status()
+                if "leaderboard" in path:
+                    cursor = response.json()["next"]
+                counts["requests"] += 1
+            except httpx.HTTPError:
+                counts["errors"] += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+        await asyncio.gather(*[client_loop(client) for _ in range(concurrency)])
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    parser.add_argument("--load", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--token", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.load:
+        print(json.dumps(asyncio.run(generate_load(args.load, args.token, args.seconds, args.concurrency))))
+        return
+    if args.mode:
+        # Each mode runs in its own process, in a scratch directory holding its database and IPC socket.
+        os.chdir(tempfile.mkdtemp(prefix="web_split_bench_"))
+        print(json.dumps(asyncio.run(measure(args.mode, args.workers, args.seconds, args.concurrency))))
+        return
+
+    print(f"Bot event latency, one simulated message every {EVENT_INTERVAL_SECONDS * 1000:g} ms, "
+          f"{args.concurrency} concurrent web clients for {args.seconds:g} s:")
+    print(f"  {'web server':<24} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'req/s':>8} {'errors':>7}")
+    for mode, label in (("idle", "none (no web load)"), ("in-process", "in the bot's process"), ("split", f"{args.workers} worker processes")):
+        output = os.popen(
+            f'"{sys.executable}" "{os.path.abspath(__file__)}" --mode {mode} --workers {args.workers} '
+            f'--seconds {args.seconds} --concurrency {args.concurrency} 2>/dev/null'
+        ).read()
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"  {label:<24} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['max_ms']:>8.2f} "
+              f"{result['requests_per_second']:>8.0f} {result['errors']:>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""How the web server reaches the bot, whether it runs in the bot's process or in a web worker.
+
+Routes only ever go through app.gateway. In the bot's process that is a LocalBotGateway reading the
+bot's caches directly. In a web worker it is a RemoteBotGateway making the same calls over the IPC
+bus, answered by the bot's LocalBotGateway through serve_gateway. Every call takes and returns plain
+JSON values, so the two are interchangeable.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+import discord
+from discord.ext import commands
+
+import config
+import database
+import utils
+from cogs.member_index import get_guild_index
+from ipc import IPCClient, IPCError, IPCServer
+
+log = logging.getLogger(__name__)
+
+# Requests a worker can make of the bot; each is the LocalBotGateway method of the same name.
+GATEWAY_REQUESTS = (
+    "get_guild", "get_user_profiles", "get_access_level", "get_channel_names", "get_member_stats",
+    "find_members", "search_members", "get_staff_members", "get_koth_session", "get_audit_log", "get_widget_snapshot",
+    "get_database_stats"
+)
+
+# Database functions the web routes call as app.db.<name>. In a worker, each is a request the bot runs, so the
+# bot's process is the only one that opens the database.
+DATABASE_REQUESTS = (
+    "get_verification_link", "complete_verification_if_pending", "get_user_profiles", "get_setting",
+    "get_submission_queue_count", "get_current_review", "get_koth_leaderboard", "get_koth_leaderboard_page",
+    "get_leaderboard", "get_leaderboard_page", "get_top_users_overall", "get_top_users_today",
+    "get_top_text_channels", "get_top_voice_channels", "get_user_activity", "get_user_channel_activity",
+    "get_user_tier", "get_or_create_widget_token", "get_guild_from_token", "get_all_pending_tier_requests",
+    "get_active_giveaway", "get_giveaway_entrants", "get_all_user_cosmetics", "get_tier_request_by_token",
+    "get_all_tier_requirements", "delete_tier_request"
+)
+# Of those, the ones returning dicts keyed by ints, which JSON would turn into strings; they travel as pairs.
+INT_KEYED_DATABASE_RESULTS = {"get_user_profiles", "get_all_user_cosmetics", "get_all_tier_requirements"}
+
+def widget_topic(guild_id: int) -> str:
+    return f"widget:{guild_id}"
+
+def member_info(member: discord.Member) -> dict:
+    return {
+        "id": member.id,
+        "name": member.display_name,
+        "username": member.name,
+        "discriminator": member.discriminator,
+        "avatar_url": member.display_avatar.url
+    }
+
+class LocalBotGateway:
+    """Answers the web server's questions from the bot's own caches, in the bot's process."""
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    async def get_guild(self, guild_id: int) -> dict | None:
+        guild = self.bot.get_guild(guild_id)
+        if not guild:
+            return None
+        return {"id": guild.id, "name": guild.name, "icon_url": guild.icon.url if guild.icon else None}
+
+    async def get_user_profiles(self, user_ids: list[int]) -> list[dict | None]:
+        """Profiles from the gateway cache, in the order given; None for users the bot hasn't cached."""
+        profiles = []
+        for user_id in user_ids:
+            user = self.bot.get_user(user_id)
+            profiles.append({"name": user.display_name, "avatar_url": user.display_avatar.url} if user else None)
+        return profiles
+
+    async def get_access_level(self, guild_id: int, user_id: int) -> str:
+        """"Admin", "Moderator" or "Member", or "Unknown" if the bot can't see the user in the guild."""
+        guild = self.bot.get_guild(guild_id)
+        member = guild.get_member(user_id) if guild else None
+        if not member:
+            return "Unknown"
+        if await utils.has_admin_role(member):
+            return "Admin"
+        if await utils.has_mod_role(member):
+            return "Moderator"
+        return "Member"
+
+    async def get_channel_names(self, guild_id: int, channel_ids: list[int]) -> list[str | None]:
+        """Channel names in the order given; None for channels that no longer exist."""
+        guild = self.bot.get_guild(guild_id)
+        channels = [guild.get_channel(channel_id) if guild else None for channel_id in channel_ids]
+        return [channel.name if channel else None for channel in channels]
+
+    async def get_member_stats(self, guild_id: int) -> dict | None:
+        """The newest member's name, the online count and the count of non-bot, non-excluded members."""
+        guild = self.bot.get_guild(guild_id)
+        if not guild:
+            return None
+        excluded_ids = set(config.BOT_CONFIG.get("MILESTONE_EXCLUDED_IDS", []))
+        guild_index = get_guild_index(self.bot, guild_id)
+        if guild_index is None:
+            # The index is built on ready; until then fall back to walking the member list.
+            last_member = max(guild.members, key=lambda m: m.joined_at or datetime.min.replace(tzinfo=timezone.utc), default=None)
+            online_count = sum(1 for m in guild.members if m.status != discord.Status.offline)
+            member_count = guild.member_count - sum(1 for m in guild.members if m.bot or m.id in excluded_ids)
+        else:
+            last_member = guild.get_member(guild_index.last_joined_id) if guild_index.last_joined_id else None
+            online_count = guild_index.online_count
+            member_count = guild_index.true_member_count(excluded_ids)
+        return {
+            "last_member": last_member.display_name if last_member else None,
+            "online_count": online_count,
+            "member_count": member_count
+        }
+
+    def _search_members(self, guild: discord.Guild, query: str, limit: int) -> list[discord.Member]:
+        guild_index = get_guild_index(self.bot, guild.id)
+        if guild_index is None:
+            # The index is built on ready; until then fall back to a substring scan of the member list.
+            query = query.lower()
+            return [m for m in guild.members if query in m.display_name.lower() and not m.bot][:limit]
+        return [member for member_id in guild_index.search(query, limit) if (member := guild.get_member(member_id))]
+
+    async def search_members(self, guild_id: int, query: str, limit: int) -> list[dict]:
+        """Up to `limit` non-bot members matching a partial name, best matches first."""
+        guild = self.bot.get_guild(guild_id)
+        if not guild:
+            return []
+        return [member_info(member) for member in self._search_members(guild, query, limit)]
+
+    async def find_members(self, guild_id: int, query: str, limit: int) -> list[dict]:
+        """The non-bot members a user search means, best first: by ID or name#discriminator, else ranked name matches."""
+        guild = self.bot.get_guild(guild_id)
+        if not guild:
+            return []
+        query = query.lower()
+        if query.isdigit():
+            member = guild.get_member(int(query))
+            return [member_info(member)] if member and not member.bot else []
+        if '#' in query:
+            name, discrim = query.split('#', 1)
+            found_member = next((
+                m for m in self._search_members(guild, name, config.BOT_CONFIG["MEMBER_SUGGEST_MAX_LIMIT"])
+                if m.name.lower() == name and m.discriminator == discrim
+            ), None)
+            if found_member:
+                return [member_info(found_member)]
+        return [member_info(member) for member in self._search_members(guild, query, limit)]
+
+    async def get_staff_members(self, guild_id: int) -> dict:
+        """The guild's admins and, separately, its mods who aren't also admins, sorted by name."""
+        guild = self.bot.get_guild(guild_id)
+        admin_members, mod_members = [], []
+        if not guild:
+            return {"admins": admin_members, "mods": mod_members}
+        admin_role_ids = await utils.get_admin_roles(guild_id)
+        mod_role_ids = await utils.get_mod_roles(guild_id)
+        if guild_index := get_guild_index(self.bot, guild_id):
+            admin_ids = guild_index.members_with_roles(admin_role_ids)
+            mod_ids = guild_index.members_with_roles(mod_role_ids) - admin_ids
+            for member_ids, members in ((admin_ids, admin_members), (mod_ids, mod_members)):
+                for member in sorted(filter(None, map(guild.get_member, member_ids)), key=lambda m: m.display_name.lower()):
+                    members.append({"name": member.display_name, "avatar_url": member.display_avatar.url})
+        else:
+            # The index is built on ready; until then fall back to walking the member list.
+            for member in guild.members:
+                if member.bot: continue
+                member_role_ids = {role.id for role in member.roles}
+                if any(role_id in member_role_ids for role_id in admin_role_ids):
+                    admin_members.append({"name": member.display_name, "avatar_url": member.display_avatar.url})
+                elif any(role_id in member_role_ids for role_id in mod_role_ids):
+                    mod_members.append({"name": member.display_name, "avatar_url": member.display_avatar.url})
+        return {"admins": admin_members, "mods": mod_members}
+
+    async def get_koth_session(self, guild_id: int) -> list[list[int]]:
+        """[user_id, points] for the current KOTH battle, highest first; empty if none is running."""
+        cog = self.bot.get_cog("Submissions")
+        session_stats = cog.current_koth_session.get(guild_id, {}) if cog else {}
+        sorted_session = sorted(session_stats.items(), key=lambda item: item[1]['points'], reverse=True)
+        return [[user_id, stats['points']] for user_id, stats in sorted_session]
+
+    async def get_audit_log(self, guild_id: int, limit: int) -> list[dict] | None:
+        """The latest audit log entries, or None if the bot isn't allowed to read them."""
+        guild = self.bot.get_guild(guild_id)
+        logs = []
+        try:
+            async for entry in guild.audit_logs(limit=limit):
+                logs.append({
+                    "user": str(entry.user),
+                    "action": entry.action.name.replace('_', ' ').title(),
+                    "target": str(entry.target) if entry.target else "N/A",
+                    "reason": str(entry.reason) if entry.reason else "No reason provided."
+                })
+        except discord.Forbidden:
+            return None
+        return logs
+
+    async def get_widget_snapshot(self, guild_id: int) -> str:
+        return await self.bot.app.widget_updates.get_snapshot(guild_id)
+
+    async def get_database_stats(self) -> dict:
+        return {"database_readers": database.get_pool_stats(), "settings_cache": database.get_settings_cache_stats()}
+
+    def submit_action(self, task: dict):
+        """Queues a panel action for the panel handler cog."""
+        self.bot.action_queue.put_nowait(task)
+
+    def submit_tier_approval(self, approval_details: dict):
+        self.bot.tier_approval_queue.put_nowait(approval_details)
+
+    def request_profile_refresh(self, user_id: int):
+        """Asks the bot's profile refresher to fetch this user from Discord in the background."""
+        refresh_queue = getattr(self.bot, 'profile_refresh_queue', None)
+        if refresh_queue is not None:
+            try:
+                refresh_queue.put_nowait(user_id)
+            except asyncio.QueueFull:
+                pass
+
+    def watch_widget(self, guild_id: int, callback):
+        # In the bot's process the widget updater sends to the WebSocket manager directly.
+        pass
+
+    def unwatch_widget(self, guild_id: int):
+        pass
+
+    def get_stats(self) -> dict:
+        return {"mode": "local"}
+
+class RemoteBotGateway:
+    """LocalBotGateway's interface for a web worker, answered by the bot over the IPC bus."""
+    def __init__(self, client: IPCClient):
+        self.client = client
+
+    async def get_guild(self, guild_id: int) -> dict | None:
+        return await self.client.request("get_guild", guild_id=guild_id)
+
+    async def get_user_profiles(self, user_ids: list[int]) -> list[dict | None]:
+        return await self.client.request("get_user_profiles", user_ids=list(user_ids))
+
+    async def get_access_level(self, guild_id: int, user_id: int) -> str:
+        return await self.client.request("get_access_level", guild_id=guild_id, user_id=user_id)
+
+    async def get_channel_names(self, guild_id: int, channel_ids: list[int]) -> list[str | None]:
+        return await self.client.request("get_channel_names", guild_id=guild_id, channel_ids=list(channel_ids))
+
+    async def get_member_stats(self, guild_id: int) -> dict | None:
+        return await self.client.request("get_member_stats", guild_id=guild_id)
+
+    async def search_members(self, guild_id: int, query: str, limit: int) -> list[dict]:
+        return await self.client.request("search_members", guild_id=guild_id, query=query, limit=limit)
+
+    async def find_members(self, guild_id: int, query: str, limit: int) -> list[dict]:
+        return await self.client.request("find_members", guild_id=guild_id, query=query, limit=limit)
+
+    async def get_staff_members(self, guild_id: int) -> dict:
+        return await self.client.request("get_staff_members", guild_id=guild_id)
+
+    async def get_koth_session(self, guild_id: int) -> list[list[int]]:
+        return await self.client.request("get_koth_session", guild_id=guild_id)
+
+    async def get_audit_log(self, guild_id: int, limit: int) -> list[dict] | None:
+        return await self.client.request("get_audit_log", guild_id=guild_id, limit=limit)
+
+    async def get_widget_snapshot(self, guild_id: int) -> str:
+        return await self.client.request("get_widget_snapshot", guild_id=guild_id)
+
+    async def get_database_stats(self) -> dict:
+        return await self.client.request("get_database_stats")
+
+    def _publish(self, topic: str, data):
+        if not self.client.publish(topic, data):
+            raise IPCError("Not connected to the bot")
+
+    def submit_action(self, task: dict):
+        self._publish("actions", task)
+
+    def submit_tier_approval(self, approval_details: dict):
+        self._publish("tier_approvals", approval_details)
+
+    def request_profile_refresh(self, user_id: int):
+        # Best effort, like the local queue: a refresh that can't be sent is asked for again on a later view.
+        self.client.publish("profile_refresh", user_id)
+
+    def watch_widget(self, guild_id: int, callback):
+        """Has the bot send this worker the guild's widget messages, passing each to callback(message)."""
+        self.client.subscribe(widget_topic(guild_id), callback)
+
+    def unwatch_widget(self, guild_id: int):
+        self.client.unsubscribe(widget_topic(guild_id))
+
+    def get_stats(self) -> dict:
+        return {"mode": "remote", **self.client.get_stats()}
+
+class RemoteDatabase:
+    """The database functions in DATABASE_REQUESTS for a web worker, each run by the bot over the IPC bus."""
+    def __init__(self, client: IPCClient):
+        self.client = client
+
+    def __getattr__(self, function: str):
+        if function not in DATABASE_REQUESTS:
+            raise AttributeError(f"{function!r} is not one of the DATABASE_REQUESTS a worker can make")
+
+        async def request(*args, **kwargs):
+            result = await self.client.request("database", function=function, args=list(args), kwargs=kwargs)
+            return dict(result) if function in INT_KEYED_DATABASE_RESULTS else result
+        return request
+
+async def _run_database_request(function: str, args: list, kwargs: dict):
+    if function not in DATABASE_REQUESTS:
+        raise IPCError(f"{function!r} is not one of the DATABASE_REQUESTS a worker can make")
+    result = await getattr(database, function)(*args, **kwargs)
+    return list(result.items()) if function in INT_KEYED_DATABASE_RESULTS else result
+
+class WidgetBusPublisher:
+    """Stands in for the WebSocket manager in the bot's widget updater when the widget connections live in workers."""
+    def __init__(self, server: IPCServer):
+        self.server = server
+
+    def has_listeners(self, guild_id: int) -> bool:
+        return self.server.has_subscribers(widget_topic(guild_id))
+
+    async def broadcast(self, guild_id: int, message: dict):
+        self.server.publish(widget_topic(guild_id), message)
+
+def _apply_change(change: dict):
+    database.apply_external_change(change["topic"], change["guild_id"])
+
+def serve_gateway(server: IPCServer, gateway: LocalBotGateway):
+    """Answers worker requests with the bot's gateway and database, and tells the workers about database changes."""
+    for method in GATEWAY_REQUESTS:
+        server.add_handler(method, getattr(gateway, method))
+    server.add_handler("database", _run_database_request)
+    server.add_listener("actions", gateway.submit_action)
+    server.add_listener("tier_approvals", gateway.submit_tier_approval)
+    server.add_listener("profile_refresh", gateway.request_profile_refresh)
+    database.add_change_listener(
+        lambda topic, guild_id: server.publish("db_change", {"topic": topic, "guild_id": guild_id})
+    )
+
+def connect_gateway(client: IPCClient) -> RemoteBotGateway:
+    """A worker's gateway to the bot, with the bot's database changes passed to the worker's cache listeners."""
+    client.subscribe("db_change", _apply_change)
+    return RemoteBotGateway(client)
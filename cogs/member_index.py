@@ -0,0 +1,320 @@
+import discord
+from discord.ext import commands
+from bisect import bisect_left, insort
+from collections import defaultdict
+import heapq
+import logging
+import unicodedata
+
+log = logging.getLogger(__name__)
+
+def is_online(member: discord.Member) -> bool:
+    return member.status != discord.Status.offline
+
+def normalize_name(text: str) -> str:
+    """Folds case and compatibility forms so fancy-font and full-width names match plain queries."""
+    return unicodedata.normalize("NFKC", text).casefold()
+
+def name_trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def search_terms(member: discord.Member) -> tuple[str, ...]:
+    """The normalized names a member can be found by: their display name, username and global name."""
+    names = {member.display_name, member.name, getattr(member, "global_name", None)}
+    return tuple(sorted({normalize_name(name) for name in names if name}))
+
+def match_rank(term: str, query: str) -> int | None:
+    """Ranks how well a normalized name matches a query: exact, prefix, word start, substring, or None."""
+    position = term.find(query)
+    if position < 0:
+        return None
+    if position == 0:
+        return 0 if len(term) == len(query) else 1
+    return 2 if not term[position - 1].isalnum() else 3
+
+class GuildMemberIndex:
+    """Member statistics, name search and role holders for one guild, kept current from gateway events so reads never walk guild.members."""
+    def __init__(self, guild: discord.Guild):
+        self.guild_id = guild.id
+        self.members: dict[int, tuple[tuple[float, int], bool, bool]] = {}
+        self.join_order: list[tuple[float, int]] = []
+        self.online_count = 0
+        self.bot_count = 0
+        # Search postings for non-bot members: trigram -> member IDs, plus (term, member_id) sorted for prefix lookups.
+        self.terms: dict[int, tuple[str, ...]] = {}
+        self.trigrams: defaultdict[str, set[int]] = defaultdict(set)
+        self.prefixes: list[tuple[str, int]] = []
+        # Role postings for every member, bots included: role ID -> member IDs, and member ID -> role IDs.
+        self.role_members: defaultdict[int, set[int]] = defaultdict(set)
+        self.member_roles: dict[int, frozenset[int]] = {}
+        # Build with appends and sort once; insort per member is quadratic on large guilds.
+        for member in guild.members:
+            self._add(member, list.append)
+        self.join_order.sort()
+        self.prefixes.sort()
+
+    @staticmethod
+    def _join_key(member: discord.Member) -> tuple[float, int]:
+        return (member.joined_at.timestamp() if member.joined_at else 0.0, member.id)
+
+    @property
+    def member_count(self) -> int:
+        return len(self.members)
+
+    @property
+    def last_joined_id(self) -> int | None:
+        return self.join_order[-1][1] if self.join_order else None
+
+    def true_member_count(self, excluded_ids) -> int:
+        """Members who are neither bots nor listed in excluded_ids."""
+        # Excluded IDs that aren't in the guild, or are bots already subtracted, don't lower the count.
+        excluded_members = sum(1 for member_id in excluded_ids if (entry := self.members.get(member_id)) and not entry[1])
+        return self.member_count - self.bot_count - excluded_members
+
+    def add(self, member: discord.Member):
+        self._add(member, insort)
+
+    def _add(self, member: discord.Member, insert):
+        if member.id in self.members:
+            self.remove(member.id)
+        join_key, online = self._join_key(member), is_online(member)
+        self.members[member.id] = (join_key, member.bot, online)
+        insert(self.join_order, join_key)
+        self.bot_count += member.bot
+        self.online_count += online
+        if not member.bot:
+            self._index_terms(member.id, search_terms(member), insert)
+        self._index_roles(member.id, self._role_ids(member))
+
+    def remove(self, member_id: int):
+        entry = self.members.pop(member_id, None)
+        if entry is None:
+            return
+        join_key, is_bot, online = entry
+        position = bisect_left(self.join_order, join_key)
+        if position < len(self.join_order) and self.join_order[position] == join_key:
+            self.join_order.pop(position)
+        self.bot_count -= is_bot
+        self.online_count -= online
+        self._unindex_terms(member_id)
+        self._unindex_roles(member_id)
+
+    def update(self, member: discord.Member):
+        """Re-indexes a member's names and roles after a nickname, username, global name or role change."""
+        terms = search_terms(member)
+        if member.id in self.terms and self.terms[member.id] != terms:
+            self._unindex_terms(member.id)
+            self._index_terms(member.id, terms, insort)
+        role_ids = self._role_ids(member)
+        if member.id in self.member_roles and self.member_roles[member.id] != role_ids:
+            self._unindex_roles(member.id)
+            self._index_roles(member.id, role_ids)
+
+    def _role_ids(self, member: discord.Member) -> frozenset[int]:
+        # Every member has @everyone, whose ID is the guild's; indexing it would just duplicate self.members.
+        return frozenset(role.id for role in member.roles if role.id != self.guild_id)
+
+    def _index_roles(self, member_id: int, role_ids: frozenset[int]):
+        self.member_roles[member_id] = role_ids
+        for role_id in role_ids:
+            self.role_members[role_id].add(member_id)
+
+    def _unindex_roles(self, member_id: int):
+        for role_id in self.member_roles.pop(member_id, ()):
+            holders = self.role_members.get(role_id)
+            if holders is not None:
+                holders.discard(member_id)
+                if not holders:
+                    del self.role_members[role_id]
+
+    def remove_role(self, role_id: int):
+        """Drops a deleted role from every member that held it."""
+        for member_id in self.role_members.pop(role_id, ()):
+            self.member_roles[member_id] = self.member_roles[member_id] - {role_id}
+
+    def members_with_roles(self, role_ids, include_bots: bool = False) -> set[int]:
+        """Returns the IDs of members holding any of the given roles."""
+        member_ids = set()
+        for role_id in role_ids:
+            member_ids |= self.role_members.get(role_id, set())
+        if not include_bots:
+            member_ids = {member_id for member_id in member_ids if not self.members[member_id][1]}
+        return member_ids
+
+    def has_role(self, member_id: int, role_id: int) -> bool:
+        return role_id in self.member_roles.get(member_id, ())
+
+    def _index_terms(self, member_id: int, terms: tuple[str, ...], insert):
+        self.terms[member_id] = terms
+        for term in terms:
+            insert(self.prefixes, (term, member_id))
+            for trigram in name_trigrams(term):
+                self.trigrams[trigram].add(member_id)
+
+    def _unindex_terms(self, member_id: int):
+        terms = self.terms.pop(member_id, ())
+        for term in terms:
+            position = bisect_left(self.prefixes, (term, member_id))
+            if position < len(self.prefixes) and self.prefixes[position] == (term, member_id):
+                self.prefixes.pop(position)
+            for trigram in name_trigrams(term):
+                postings = self.trigrams.get(trigram)
+                if postings is not None:
+                    postings.discard(member_id)
+                    if not postings:
+                        del self.trigrams[trigram]
+
+    def _prefix_matches(self, query: str):
+        position = bisect_left(self.prefixes, (query,))
+        while position < len(self.prefixes) and self.prefixes[position][0].startswith(query):
+            term, member_id = self.prefixes[position]
+            yield (0 if term == query else 1, len(term), term, member_id)
+            position += 1
+
+    def _candidates(self, query: str) -> set[int]:
+        postings = sorted((self.trigrams.get(trigram, set()) for trigram in name_trigrams(query)), key=len)
+        candidates = set(postings[0])
+        for member_ids in postings[1:]:
+            if not candidates:
+                break
+            candidates &= member_ids
+        return candidates
+
+    def search(self, query: str, limit: int = 10) -> list[int]:
+        """Returns the IDs of up to `limit` non-bot members whose names contain the query, best matches first."""
+        query = normalize_name(query).strip()
+        if not query:
+            return []
+        if len(query) < 3:
+            # Too short for trigrams. Names starting with the query outrank every other match, so take them straight
+            # off the prefix list; a member can match by more than one name, so take extra entries and keep each
+            # member's best. Only when those don't fill the limit are the remaining names scanned for the query.
+            best = heapq.nsmallest(limit * 3, self._prefix_matches(query))
+            found = list(dict.fromkeys(entry[-1] for entry in best))[:limit]
+            if len(found) == limit:
+                return found
+            candidates = self.terms.keys() - set(found)
+        else:
+            found, candidates = [], self._candidates(query)
+        ranked = []
+        for member_id in candidates:
+            matches = [(rank, len(term), term) for term in self.terms[member_id] if (rank := match_rank(term, query)) is not None]
+            if matches:
+                ranked.append((*min(matches), member_id))
+        return found + [entry[-1] for entry in heapq.nsmallest(limit - len(found), ranked)]
+
+    def set_online(self, member_id: int, online: bool):
+        entry = self.members.get(member_id)
+        if entry is None or entry[2] == online:
+            return
+        self.members[member_id] = (entry[0], entry[1], online)
+        self.online_count += 1 if online else -1
+
+    def get_stats(self) -> dict:
+        return {
+            "members": self.member_count,
+            "online": self.online_count,
+            "bots": self.bot_count,
+            "last_joined_id": self.last_joined_id,
+            "indexed_names": len(self.prefixes),
+            "trigrams": len(self.trigrams),
+            "roles": len(self.role_members)
+        }
+
+class MemberIndex:
+    """Per-guild GuildMemberIndex objects, shared with the web server as bot.member_index."""
+    def __init__(self):
+        self.guilds: dict[int, GuildMemberIndex] = {}
+
+    def get(self, guild_id: int) -> GuildMemberIndex | None:
+        return self.guilds.get(guild_id)
+
+    def rebuild(self, guild: discord.Guild) -> GuildMemberIndex:
+        self.guilds[guild.id] = GuildMemberIndex(guild)
+        return self.guilds[guild.id]
+
+    def discard(self, guild_id: int):
+        self.guilds.pop(guild_id, None)
+
+def get_guild_index(bot: commands.Bot, guild_id: int) -> GuildMemberIndex | None:
+    """The guild's member index, or None if the MemberIndex cog is not loaded or has not built it yet."""
+    member_index = getattr(bot, 'member_index', None)
+    return member_index.get(guild_id) if member_index else None
+
+def get_role_members(bot: commands.Bot, role: discord.Role) -> list[discord.Member]:
+    """role.members, read from the guild's role index instead of scanning every member when the guild is indexed."""
+    guild_index = get_guild_index(bot, role.guild.id)
+    if guild_index is None:
+        return role.members
+    return [member for member_id in guild_index.members_with_roles([role.id], include_bots=True) if (member := role.guild.get_member(member_id))]
+
+class MemberIndexCog(commands.Cog, name="MemberIndex"):
+    """Maintains bot.member_index from member, user, role and presence events."""
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        if not hasattr(bot, 'member_index'):
+            bot.member_index = MemberIndex()
+        self.index: MemberIndex = bot.member_index
+
+    def _rebuild(self, guild: discord.Guild):
+        guild_index = self.index.rebuild(guild)
+        log.info(f"Indexed {guild_index.member_count} members of guild {guild.id}.")
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # Also runs after a reconnect that could not resume, which corrects any events missed while disconnected.
+        for guild in self.bot.guilds:
+            self._rebuild(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        self._rebuild(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_available(self, guild: discord.Guild):
+        # At startup on_ready builds every guild; this covers guilds coming back from an outage afterwards.
+        if self.bot.is_ready():
+            self._rebuild(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.index.discard(guild.id)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        if guild_index := self.index.get(member.guild.id):
+            guild_index.add(member)
+
+    @commands.Cog.listener()
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        # The raw event also fires for members who were not in the member cache.
+        if guild_index := self.index.get(payload.guild_id):
+            guild_index.remove(payload.user.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        if guild_index := self.index.get(role.guild.id):
+            guild_index.remove_role(role.id)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if guild_index := self.index.get(after.guild.id):
+            guild_index.update(after)
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        # Username and global name changes arrive once per user, not once per guild.
+        for guild in after.mutual_guilds:
+            guild_index = self.index.get(guild.id)
+            member = guild.get_member(after.id)
+            if guild_index and member:
+                guild_index.update(member)
+
+    @commands.Cog.listener()
+    async def on_presence_update(self, before: discord.Member, after: discord.Member):
+        if guild_index := self.index.get(after.guild.id):
+            guild_index.set_online(after.id, is_online(after))
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(MemberIndexCog(bot))
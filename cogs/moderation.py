@@ -238,8 +238,9 @@ class ModerationCog(commands.Cog, name="Moderation"):
     async def on_ready(self):
         """Populates the cache when the bot starts."""
         log.info("Populating bad words cache for all guilds...")
+        words_by_guild = await database.get_all_bad_words()
         for guild in self.bot.guilds:
-            await self._update_bad_words_cache(guild.id)
+            self.bad_words_cache[guild.id] = words_by_guild.get(guild.id, [])
         log.info("Bad words cache populated.")
 
     @commands.Cog.listener()
@@ -0,0 +1,85 @@
+import discord
+from discord.ext import commands, tasks
+import logging
+import asyncio
+import database
+import config
+
+log = logging.getLogger(__name__)
+
+def profile_row(user: discord.abc.User) -> tuple[int, str, str]:
+    """The (user_id, name, avatar_url) stored for a user: their account-wide name and avatar, not a guild nickname."""
+    avatar = user.avatar or user.default_avatar
+    return user.id, user.global_name or user.name, avatar.url
+
+class ProfilesCog(commands.Cog, name="Profiles"):
+    """Keeps the user_profiles table current so the web pages never wait on Discord's REST API."""
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        # The web server puts user IDs it couldn't find in the gateway cache or the store on this queue.
+        if not hasattr(bot, 'profile_refresh_queue'):
+            bot.profile_refresh_queue = asyncio.Queue(maxsize=10000)
+        self.pending_refresh: dict[int, None] = {}
+        self.refresh_profiles_loop.start()
+
+    async def cog_unload(self):
+        self.refresh_profiles_loop.cancel()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        await database.upsert_user_profiles([profile_row(user) for user in self.bot.users])
+        log.info(f"Stored profiles for {len(self.bot.users)} cached users.")
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        if profile_row(before) != profile_row(after):
+            await database.upsert_user_profiles([profile_row(after)])
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if profile_row(before) != profile_row(after):
+            await database.upsert_user_profiles([profile_row(after)])
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        await database.upsert_user_profiles([profile_row(member)])
+
+    @tasks.loop(minutes=1)
+    async def refresh_profiles_loop(self):
+        """Refreshes requested and stale profiles, spending at most PROFILE_REFRESH_PER_MINUTE REST calls."""
+        while not self.bot.profile_refresh_queue.empty():
+            self.pending_refresh[self.bot.profile_refresh_queue.get_nowait()] = None
+
+        budget = config.BOT_CONFIG["PROFILE_REFRESH_PER_MINUTE"]
+        if len(self.pending_refresh) < budget:
+            stale_ids = await database.get_stale_user_profile_ids(config.BOT_CONFIG["PROFILE_MAX_AGE_SECONDS"], budget)
+            for user_id in stale_ids:
+                self.pending_refresh.setdefault(user_id, None)
+
+        rows = []
+        for user_id in list(self.pending_refresh):
+            if user := self.bot.get_user(user_id):
+                rows.append(profile_row(user))
+            elif budget > 0:
+                budget -= 1
+                try:
+                    rows.append(profile_row(await self.bot.fetch_user(user_id)))
+                except discord.NotFound:
+                    rows.append((user_id, None, None))
+                except discord.HTTPException as e:
+                    log.warning(f"Could not refresh profile for user {user_id}: {e}")
+                    continue
+            else:
+                break
+            del self.pending_refresh[user_id]
+        await database.upsert_user_profiles(rows)
+        if rows:
+            log.info(f"Refreshed {len(rows)} user profiles, {len(self.pending_refresh)} still pending.")
+
+    @refresh_profiles_loop.before_loop
+    async def before_refresh_profiles_loop(self):
+        await self.bot.wait_until_ready()
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(ProfilesCog(bot))
@@ -84,33 +84,47 @@ class RankingCog(commands.Cog, name="Ranking"):
     async def before_cleanup_buffs_loop(self):
         await self.bot.wait_until_ready()
 
+    async def _handle_xp_batch(self, guild: discord.Guild, grants: dict[discord.Member, int]):
+        """Adds XP for a batch of members in one transaction and hands out rank rewards."""
+        if not grants:
+            return
+        members = {member.id: member for member in grants}
+
+        # Check for active XP boosts for the whole batch at once
+        boosted_ids = await database.get_users_with_buff(guild.id, list(members), "xp_boost")
+        xp_by_user = {member.id: xp * 2 if member.id in boosted_ids else xp for member, xp in grants.items()}
+
+        results = await database.apply_xp_grants(guild.id, xp_by_user)
+
+        rank_ups = {}
+        for user_id, (old_xp, new_xp) in results.items():
+            old_rank = get_rank_from_xp(old_xp)
+            new_rank = get_rank_from_xp(new_xp)
+            if new_rank > old_rank:
+                log.info(f"User {user_id} in guild {guild.id} ranked up from {old_rank} to {new_rank}.")
+                rank_ups[user_id] = new_rank
+        if not rank_ups:
+            return
+
+        rank_rewards = dict(await database.get_all_rank_rewards(guild.id))
+        for user_id, new_rank in rank_ups.items():
+            reward_role_id = rank_rewards.get(new_rank)
+            if not reward_role_id:
+                continue
+            role = guild.get_role(reward_role_id)
+            if role:
+                member = members[user_id]
+                try:
+                    await member.add_roles(role, reason=f"Reached Rank {new_rank}")
+                    log.info(f"Awarded rank-up role {role.name} to {member.id}.")
+                except discord.Forbidden:
+                    log.error(f"Failed to add rank-up role to {member.id}. Missing permissions.")
+                except discord.HTTPException as e:
+                    log.error(f"An HTTP error occurred while adding rank-up role: {e}")
+
     async def _handle_xp_gain(self, guild: discord.Guild, member: discord.Member, xp_to_add: int):
         """A central function to handle adding XP and checking for rank rewards."""
-        # Check for an active XP boost
-        if await database.get_user_buff(guild.id, member.id, "xp_boost"):
-            xp_to_add *= 2
-
-        old_xp = await database.get_user_xp(guild.id, member.id)
-        old_rank = get_rank_from_xp(old_xp)
-        
-        await database.update_user_xp(guild.id, member.id, xp_to_add)
-        new_xp = old_xp + xp_to_add
-        new_rank = get_rank_from_xp(new_xp)
-        
-        if new_rank > old_rank:
-            log.info(f"User {member.id} in guild {guild.id} ranked up from {old_rank} to {new_rank}.")
-            
-            reward_role_id = await database.get_rank_reward(guild.id, new_rank)
-            if reward_role_id:
-                role = guild.get_role(reward_role_id)
-                if role:
-                    try:
-                        await member.add_roles(role, reason=f"Reached Rank {new_rank}")
-                        log.info(f"Awarded rank-up role {role.name} to {member.id}.")
-                    except discord.Forbidden:
-                        log.error(f"Failed to add rank-up role to {member.id}. Missing permissions.")
-                    except discord.HTTPException as e:
-                        log.error(f"An HTTP error occurred while adding rank-up role: {e}")
+        await self._handle_xp_batch(guild, {member: xp_to_add})
 
     @tasks.loop(minutes=5)
     async def voice_xp_loop(self):
@@ -118,12 +132,13 @@ class RankingCog(commands.Cog, name="Ranking"):
         for guild in self.bot.guilds:
             if not await database.get_setting(guild.id, 'ranking_system_enabled'):
                 continue
+            grants = {}
             for channel in guild.voice_channels:
                 active_members = [m for m in channel.members if not m.bot and not m.voice.deaf and not m.voice.mute]
                 if len(active_members) >= 2:
                     for member in active_members:
-                        xp_to_add = random.randint(5, 10)
-                        await self._handle_xp_gain(guild, member, xp_to_add)
+                        grants[member] = random.randint(5, 10)
+            await self._handle_xp_batch(guild, grants)
 
     @voice_xp_loop.before_loop
     async def before_voice_xp_loop(self):
@@ -8,6 +8,7 @@ from collections import defaultdict
 import database
 import config
 import utils
+from cogs.member_index import get_role_members
 
 log = logging.getLogger(__name__)
 
@@ -116,19 +117,17 @@ class KOTHBattleView(discord.ui.View):
             await self.cog.finalize_koth_battle(interaction, winner_data['user_id'])
             return
 
-        await database.update_koth_battle_results(interaction.guild.id, winner_data['user_id'], loser_data['user_id'])
+        async with database.transaction():
+            await database.update_koth_battle_results(interaction.guild.id, winner_data['user_id'], loser_data['user_id'])
+            await database.update_submission_status(self.king_data['submission_id'], 'reviewed', interaction.user.id)
+            await database.update_submission_status(self.challenger_data['submission_id'], 'reviewed', interaction.user.id)
+            await database.update_settings(interaction.guild.id, koth_king_id=winner_data['user_id'], koth_king_submission_id=winner_data['submission_id'])
 
         session_stats = self.cog.current_koth_session[interaction.guild.id]
         winner_id = winner_data['user_id']
         session_stats.setdefault(winner_id, {'points': 0, 'wins': 0})['points'] += 1
         session_stats.setdefault(winner_id, {'points': 0, 'wins': 0})['wins'] += 1
 
-        await database.update_submission_status(self.king_data['submission_id'], 'reviewed', interaction.user.id)
-        await database.update_submission_status(self.challenger_data['submission_id'], 'reviewed', interaction.user.id)
-
-        await database.update_setting(interaction.guild.id, 'koth_king_id', winner_data['user_id'])
-        await database.update_setting(interaction.guild.id, 'koth_king_submission_id', winner_data['submission_id'])
-
         await interaction.message.delete()
 
         if panel_message := await self.cog.get_panel_message(interaction.guild):
@@ -270,7 +269,7 @@ class SubmissionViewKothClosed(SubmissionBaseView):
         self.cog.current_koth_session.pop(interaction.guild.id, None)
         if winner_role_id := await database.get_setting(interaction.guild.id, 'koth_winner_role_id'):
             if role := interaction.guild.get_role(winner_role_id):
-                for member in role.members:
+                for member in get_role_members(self.bot, role):
                     await member.remove_roles(role, reason="New KOTH battle started.")
         await database.update_setting(interaction.guild.id, 'submission_status', 'koth_open')
         await self._update_panel(interaction)
@@ -311,9 +310,9 @@ class SubmissionViewKothOpen(SubmissionBaseView):
         if not king_id:
             if not challenger_track: return await interaction.response.send_message("The KOTH queue is empty! Need at least one challenger.", ephemeral=True)
             sub_id, user_id, url = challenger_track
-            await database.update_setting(guild_id, 'koth_king_id', user_id)
-            await database.update_setting(guild_id, 'koth_king_submission_id', sub_id)
-            await database.update_submission_status(sub_id, 'reviewing', interaction.user.id)
+            async with database.transaction():
+                await database.update_settings(guild_id, koth_king_id=user_id, koth_king_submission_id=sub_id)
+                await database.update_submission_status(sub_id, 'reviewing', interaction.user.id)
             king_user = interaction.guild.get_member(user_id)
             embed = discord.Embed(title="👑 New King of the Hill!", description=f"**{king_user.display_name}** is the new King!", color=config.BOT_CONFIG["EMBED_COLORS"]["SUCCESS"])
             await interaction.response.send_message(content=url, embed=embed)
@@ -324,8 +323,7 @@ class SubmissionViewKothOpen(SubmissionBaseView):
             c_sub_id, c_user_id, c_url = challenger_track
             await database.update_submission_status(c_sub_id, 'reviewing', interaction.user.id)
             king_sub_id = await database.get_setting(guild_id, 'koth_king_submission_id')
-            conn = await database.get_db_connection()
-            async with conn.cursor() as cursor:
+            async with database.read_connection() as conn, conn.cursor() as cursor:
                 await cursor.execute("SELECT track_url FROM music_submissions WHERE submission_id = ?", (king_sub_id,))
                 king_url_result = await cursor.fetchone()
                 king_url = king_url_result[0] if king_url_result else "Track URL not found"
@@ -348,9 +346,8 @@ class SubmissionViewKothOpen(SubmissionBaseView):
         is_tie = len(sorted_session) > 1 and sorted_session[0][1]['points'] > 0 and sorted_session[0][1]['points'] == sorted_session[1][1]['points']
         if is_tie:
             user1_id, user2_id = sorted_session[0][0], sorted_session[1][0]
-            await database.update_setting(guild_id, 'koth_tiebreaker_users', f"{user1_id},{user2_id}")
             self.cog.tiebreaker_submissions.pop(guild_id, None)
-            await database.update_setting(guild_id, 'submission_status', 'koth_tiebreaker')
+            await database.update_settings(guild_id, koth_tiebreaker_users=f"{user1_id},{user2_id}", submission_status='koth_tiebreaker')
             await self._update_panel(interaction)
             user1 = interaction.guild.get_member(user1_id)
             user2 = interaction.guild.get_member(user2_id)
@@ -402,10 +399,9 @@ class SubmissionsCog(commands.Cog, name="Submissions"):
                     log.warning(f"Failed to update panel for guild {guild.id}, message not found.")
 
     async def _broadcast_full_update(self, guild_id: int):
-        """Helper to construct and broadcast a full widget update."""
-        if hasattr(self.bot, 'app') and hasattr(self.bot.app, 'ws_manager'):
-            full_data = await self.bot.app.get_full_widget_data(guild_id)
-            await self.bot.app.ws_manager.broadcast(guild_id, full_data)
+        """Schedules a full widget update. Updates requested in quick succession are sent as one."""
+        if hasattr(self.bot, 'app') and hasattr(self.bot.app, 'widget_updates'):
+            self.bot.app.widget_updates.mark_dirty(guild_id)
 
     async def cog_check(self, interaction: discord.Interaction) -> bool:
         """Checks if the submissions system is enabled for this guild."""
@@ -450,11 +446,12 @@ class SubmissionsCog(commands.Cog, name="Submissions"):
             if channel := self.bot.get_channel(koth_channel_id):
                 await channel.send(embed=public_embed)
 
-        await database.clear_session_submissions(guild_id, 'koth')
-        await database.update_setting(guild_id, 'submission_status', 'koth_closed')
-        await database.update_setting(guild_id, 'koth_king_id', None)
-        await database.update_setting(guild_id, 'koth_king_submission_id', None)
-        await database.update_setting(guild_id, 'koth_tiebreaker_users', None)
+        async with database.transaction():
+            await database.clear_session_submissions(guild_id, 'koth')
+            await database.update_settings(
+                guild_id, submission_status='koth_closed', koth_king_id=None,
+                koth_king_submission_id=None, koth_tiebreaker_users=None
+            )
 
         self.current_koth_session.pop(guild_id, None)
         self.tiebreaker_submissions.pop(guild_id, None)
@@ -549,9 +546,9 @@ class SubmissionsCog(commands.Cog, name="Submissions"):
                         user_id = message.author.id
                         session_stats.setdefault(user_id, {'points': 0, 'wins': 0, 'submissions': 0})['submissions'] += 1
 
-                    if hasattr(self.bot, 'app') and hasattr(self.bot.app, 'ws_manager'):
+                    if hasattr(self.bot, 'app') and hasattr(self.bot.app, 'widget_updates'):
                         user_data = await self.bot.app.fetch_user_data(message.author.id)
-                        await self.bot.app.ws_manager.broadcast(message.guild.id, {
+                        await self.bot.app.widget_updates.send_event(message.guild.id, {
                             "type": "new_submission",
                             "username": user_data['name'],
                             "avatar_url": user_data['avatar_url']
@@ -633,8 +630,7 @@ class SubmissionsCog(commands.Cog, name="Submissions"):
 
         try:
             panel_message = await review_channel.send(embed=embed, view=view)
-            await database.update_setting(interaction.guild.id, 'review_panel_message_id', panel_message.id)
-            await database.update_setting(interaction.guild.id, 'submission_status', 'closed')
+            await database.update_settings(interaction.guild.id, review_panel_message_id=panel_message.id, submission_status='closed')
             await interaction.followup.send(f"✅ Submission panel has been posted in {review_channel.mention}.")
         except discord.Forbidden:
             await interaction.followup.send(f"❌ I don't have permission to send messages in {review_channel.mention}.")
@@ -667,8 +663,7 @@ class SubmissionsCog(commands.Cog, name="Submissions"):
         """Manually finds and resets any submission stuck in 'reviewing' status."""
         await interaction.response.defer(ephemeral=True)
 
-        conn = await database.get_db_connection()
-        async with conn.cursor() as cursor:
+        async with database.read_connection() as conn, conn.cursor() as cursor:
             await cursor.execute(
                 "SELECT submission_id, user_id FROM music_submissions WHERE guild_id = ? AND status = 'reviewing' AND submission_type = 'regular' LIMIT 1",
                 (interaction.guild.id,)
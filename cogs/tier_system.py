@@ -5,6 +5,7 @@ import logging
 import database
 import config
 import utils
+from cogs.member_index import get_guild_index
 import asyncio
 from collections import defaultdict
 import time
@@ -41,10 +42,17 @@ class TierSystemCog(commands.Cog, name="Tier System"):
 
         self.activity_check_loop.start()
         self.process_web_approvals.start()
+        self.flush_activity_loop.start()
+        self.compact_activity_loop.start()
+        self.reconcile_activity_loop.start()
 
-    def cog_unload(self):
+    async def cog_unload(self):
         self.activity_check_loop.cancel()
         self.process_web_approvals.cancel()
+        self.flush_activity_loop.cancel()
+        self.compact_activity_loop.cancel()
+        self.reconcile_activity_loop.cancel()
+        await database.flush_channel_activity()
 
     # --- Activity Tracking ---
 
@@ -53,7 +61,7 @@ class TierSystemCog(commands.Cog, name="Tier System"):
         if not message.guild or (message.author.bot and message.author.id == self.bot.user.id):
             return
             
-        await database.update_channel_activity(message.guild.id, message.author.id, message.channel.id, message_count=1)
+        await database.buffer_channel_activity(message.guild.id, message.author.id, message.channel.id, message_count=1)
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
@@ -71,9 +79,34 @@ class TierSystemCog(commands.Cog, name="Tier System"):
         elif before.channel and not after.channel:
             if self.voice_activity[guild_id][user_id]:
                 duration_seconds = int(time.time() - self.voice_activity[guild_id][user_id])
-                await database.update_channel_activity(guild_id, user_id, before.channel.id, voice_seconds=duration_seconds)
+                await database.buffer_channel_activity(guild_id, user_id, before.channel.id, voice_seconds=duration_seconds)
                 del self.voice_activity[guild_id][user_id]
 
+    @tasks.loop(seconds=config.BOT_CONFIG["ACTIVITY_FLUSH_SECONDS"])
+    async def flush_activity_loop(self):
+        """Writes buffered channel activity to the database."""
+        await database.flush_channel_activity()
+
+    @tasks.loop(hours=6)
+    async def compact_activity_loop(self):
+        """Folds old hourly activity buckets into daily ones."""
+        removed = await database.compact_activity_buckets()
+        if removed:
+            log.info(f"Compacted {removed} hourly activity buckets into daily buckets.")
+
+    @compact_activity_loop.before_loop
+    async def before_compact_activity_loop(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(hours=24)
+    async def reconcile_activity_loop(self):
+        """Checks the per-user activity totals against the per-channel detail rows."""
+        await database.reconcile_user_activity_totals()
+
+    @reconcile_activity_loop.before_loop
+    async def before_reconcile_activity_loop(self):
+        await self.bot.wait_until_ready()
+
     @tasks.loop(minutes=1)
     async def activity_check_loop(self):
         log.info("Running periodic activity check for tier upgrades...")
@@ -84,6 +117,7 @@ class TierSystemCog(commands.Cog, name="Tier System"):
 
             tier_roles = await database.get_all_tier_roles(guild.id)
             if not tier_roles: continue # Skip if no tier roles are configured
+            guild_index = get_guild_index(self.bot, guild.id)
 
             for member in guild.members:
                 if member.bot: continue
@@ -92,10 +126,10 @@ class TierSystemCog(commands.Cog, name="Tier System"):
 
                 # --- MODIFIED LOGIC FOR ENROLLMENT ---
                 if current_tier is None:
-                    # Check if the member has any of the configured tier roles
-                    member_role_ids = {role.id for role in member.roles}
+                    # Check if the member has any of the configured tier roles, from the role index once it is built
+                    member_role_ids = None if guild_index else {role.id for role in member.roles}
                     for tier_level, role_id in tier_roles.items():
-                        if role_id in member_role_ids:
+                        if guild_index.has_role(member.id, role_id) if guild_index else role_id in member_role_ids:
                             await database.set_user_tier(guild.id, member.id, tier_level)
                             current_tier = tier_level
                             log.info(f"Automatically enrolled existing member {member.name} into the tier system at Tier {tier_level}.")
@@ -13,6 +13,80 @@ BOT_CONFIG = {
 
     "DEFAULT_MUTE_MINS": 30,
 
+    # Channel activity is buffered in memory and written in batches. A crash can lose at most
+    # ACTIVITY_FLUSH_SECONDS of activity; a flush also happens once ACTIVITY_FLUSH_MAX_ROWS rows are pending.
+    "ACTIVITY_FLUSH_SECONDS": 5,
+    "ACTIVITY_FLUSH_MAX_ROWS": 500,
+
+    # Hourly activity buckets older than this are folded into one bucket per day.
+    "ACTIVITY_BUCKET_COMPACT_AFTER_DAYS": 14,
+
+    # Read-only WAL connections used for leaderboard and dashboard queries.
+    "DB_READER_POOL_SIZE": 4,
+    # After the pool fails to open (say, before the database file exists), reads use the main connection
+    # for this long before another attempt.
+    "DB_READER_POOL_RETRY_SECONDS": 60,
+    # On shutdown, how long to wait for borrowed reader connections to be returned before closing them anyway.
+    "DB_READER_POOL_CLOSE_TIMEOUT_SECONDS": 5,
+
+    # How long a verification link looked up by its OAuth state stays cached.
+    "VERIFICATION_LINK_CACHE_SECONDS": 60,
+
+    # Web server cache of Discord user names and avatars. Unknown users are remembered for the shorter TTL.
+    "USER_CACHE_MAX_SIZE": 5000,
+    "USER_CACHE_TTL_SECONDS": 300,
+    "USER_CACHE_NEGATIVE_TTL_SECONDS": 60,
+
+    # Stored user profiles. The refresher spends at most PROFILE_REFRESH_PER_MINUTE REST calls a minute,
+    # first on users the web pages asked for, then on profiles older than PROFILE_MAX_AGE_SECONDS.
+    "PROFILE_REFRESH_PER_MINUTE": 30,
+    "PROFILE_MAX_AGE_SECONDS": 7 * 24 * 3600,
+
+    # Rendered /leaderboard and /koth pages. A page older than the TTL, or whose data changed, is still served
+    # while it re-renders in the background; past the max stale age the request waits for a fresh render.
+    "RESPONSE_CACHE_MAX_ENTRIES": 500,
+    "RESPONSE_CACHE_TTL_SECONDS": 120,
+    "RESPONSE_CACHE_MAX_STALE_SECONDS": 3600,
+
+    # Entries per page of the leaderboard JSON API and of the first page rendered into the HTML leaderboards.
+    # Clients may ask for fewer or more with ?limit=, up to LEADERBOARD_MAX_PAGE_SIZE.
+    "LEADERBOARD_PAGE_SIZE": 50,
+    "LEADERBOARD_MAX_PAGE_SIZE": 100,
+
+    # Results returned by the member typeahead endpoint, by default and at most.
+    "MEMBER_SUGGEST_LIMIT": 10,
+    "MEMBER_SUGGEST_MAX_LIMIT": 25,
+
+    # Widget WebSockets. Each connection has its own queue of outgoing messages; a connection whose queue fills
+    # up, or whose send takes longer than the timeout, is closed so it cannot hold back the rest of the guild.
+    "WS_SEND_QUEUE_SIZE": 32,
+    "WS_SEND_TIMEOUT_SECONDS": 10,
+    # Widget state changes within this window are coalesced into one full update per guild.
+    "WIDGET_BROADCAST_WINDOW_SECONDS": 0.25,
+    # New widget connections are sent the cached snapshot unless a change was signalled since it was built or it
+    # is older than this, which bounds how long a change the bot never signals can go unseen.
+    "WIDGET_SNAPSHOT_TTL_SECONDS": 30,
+
+    # Web worker processes. With 0 the web server runs inside the bot's process; otherwise the bot starts this
+    # many workers sharing the web port, which reach it over a Unix-socket bus. The WEB_WORKERS env var overrides.
+    "WEB_WORKERS": 0,
+    "IPC_SOCKET_PATH": "bot_ipc.sock",
+    "IPC_REQUEST_TIMEOUT_SECONDS": 5,
+    # Frames queued for a worker before it is judged too slow and disconnected.
+    "IPC_SEND_QUEUE_SIZE": 1000,
+    # A worker exits once it has been unable to reach the bot for this long, or as soon as the bot's process is gone.
+    "IPC_DISCONNECT_EXIT_SECONDS": 30,
+
+    # Shared outbound HTTP client used by the web server for OAuth calls.
+    # Retries back off from HTTP_RETRY_BACKOFF_SECONDS with full jitter; POSTs are only retried on connect errors.
+    "HTTP_TIMEOUT_SECONDS": 10,
+    "HTTP_CONNECT_TIMEOUT_SECONDS": 5,
+    "HTTP_MAX_CONNECTIONS": 100,
+    "HTTP_MAX_CONNECTIONS_PER_HOST": 20,
+    "HTTP_KEEPALIVE_SECONDS": 30,
+    "HTTP_RETRIES": 2,
+    "HTTP_RETRY_BACKOFF_SECONDS": 0.25,
+
     "MILESTONE_EXCLUDED_IDS": [
         902664751778267147, # Dimitri's ID
         927313212704178237, # Soren's ID
@@ -1,9 +1,21 @@
 import aiosqlite
+import argparse
+import ast
+import asyncio
+from bisect import bisect_left, bisect_right, insort
+import inspect
 import logging
+import re
+import sys
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from datetime import datetime
 import secrets
+import time
 from typing import Optional
 
+import config
+
 log = logging.getLogger(__name__)
 DB_FILE = "bot_database.db"
 db_conn = None
@@ -22,205 +34,608 @@ async def get_db_connection():
         log.critical(f"Could not connect to the SQLite database: {e}")
         return None
 
-async def initialize_database():
-    """Initializes and updates the database schema if needed."""
-    conn = await get_db_connection()
-    if not conn: return
-    async with conn.cursor() as cursor:
-        # --- Main Tables ---
-        await cursor.execute("""
-            CREATE TABLE IF NOT EXISTS guild_settings (
-                guild_id INTEGER PRIMARY KEY, log_channel_id INTEGER, report_channel_id INTEGER,
-                verification_channel_id INTEGER, unverified_role_id INTEGER, member_role_id INTEGER,
-                verification_message_id INTEGER, admin_role_ids TEXT, mod_role_ids TEXT,
-                mod_chat_channel_id INTEGER, temp_vc_hub_id INTEGER, temp_vc_category_id INTEGER,
-                submission_channel_id INTEGER, review_channel_id INTEGER, submission_status TEXT DEFAULT 'closed',
-                review_panel_message_id INTEGER, announcement_channel_id INTEGER, last_milestone_count INTEGER DEFAULT 0,
-                koth_submission_channel_id INTEGER, koth_winner_role_id INTEGER, verification_mode TEXT DEFAULT 'captcha',
-                ranking_system_enabled INTEGER DEFAULT 1, submissions_system_enabled INTEGER DEFAULT 1,
-                temp_vc_system_enabled INTEGER DEFAULT 1, reporting_system_enabled INTEGER DEFAULT 1
-            )
-        """)
-        await cursor.execute("""
-            CREATE TABLE IF NOT EXISTS channel_activity (
-                guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, channel_id INTEGER NOT NULL,
-                message_count INTEGER DEFAULT 0, voice_seconds INTEGER DEFAULT 0,
-                PRIMARY KEY (guild_id, user_id, channel_id)
-            )
-        """)
-        # --- Tier System Tables ---
-        await cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_tiers (
-                guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL,
-                current_tier INTEGER DEFAULT 1,
-                PRIMARY KEY (guild_id, user_id)
-            )
-        """)
-        await cursor.execute("""
-            CREATE TABLE IF NOT EXISTS tier_requirements (
-                guild_id INTEGER NOT NULL, tier_level INTEGER NOT NULL,
-                messages_req INTEGER DEFAULT 0, voice_hours_req INTEGER DEFAULT 0,
-                PRIMARY KEY (guild_id, tier_level)
-            )
-        """)
-        await cursor.execute("""
-            CREATE TABLE IF NOT EXISTS tier_approval_requests (
-                guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL,
-                next_tier INTEGER NOT NULL, token TEXT UNIQUE NOT NULL,
-                message_id INTEGER NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (guild_id, user_id)
-            )
-        """)
-        await cursor.execute("""
-            CREATE TABLE IF NOT EXISTS giveaways (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                guild_id INTEGER NOT NULL,
-                name TEXT NOT NULL,
-                description TEXT,
-                start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                end_time TIMESTAMP,
-                winner_id INTEGER,
-                is_active BOOLEAN DEFAULT 1,
-                message_id INTEGER
-            )
-        """)
-        await cursor.execute("""
-            CREATE TABLE IF NOT EXISTS giveaway_entrants (
-                giveaway_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                guild_id INTEGER NOT NULL,
-                entry_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (giveaway_id, user_id, guild_id)
-            )
-        """)
-        await cursor.execute("CREATE TABLE IF NOT EXISTS warnings (warning_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, moderator_id INTEGER NOT NULL, reason TEXT, issued_at TIMESTAMP NOT NULL, log_message_id INTEGER)")
-        await cursor.execute("CREATE TABLE IF NOT EXISTS reaction_roles (message_id INTEGER NOT NULL, emoji TEXT NOT NULL, role_id INTEGER NOT NULL, guild_id INTEGER NOT NULL, PRIMARY KEY (message_id, emoji))")
-        await cursor.execute("CREATE TABLE IF NOT EXISTS temporary_vcs (channel_id INTEGER PRIMARY KEY, owner_id INTEGER NOT NULL, text_channel_id INTEGER)")
-        await cursor.execute("CREATE TABLE IF NOT EXISTS music_submissions ( submission_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, track_url TEXT NOT NULL, status TEXT NOT NULL, submitted_at TIMESTAMP NOT NULL, reviewer_id INTEGER, submission_type TEXT DEFAULT 'regular' )")
-        await cursor.execute("CREATE TABLE IF NOT EXISTS koth_leaderboard ( user_id INTEGER NOT NULL, guild_id INTEGER NOT NULL, points INTEGER DEFAULT 0, PRIMARY KEY (user_id, guild_id) )")
-        await cursor.execute("CREATE TABLE IF NOT EXISTS ranking ( user_id INTEGER NOT NULL, guild_id INTEGER NOT NULL, xp INTEGER DEFAULT 0, PRIMARY KEY (user_id, guild_id) )")
-        await cursor.execute("CREATE TABLE IF NOT EXISTS bad_words ( word_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER NOT NULL, word TEXT NOT NULL )")
-        await cursor.execute("CREATE TABLE IF NOT EXISTS verification_links ( state TEXT PRIMARY KEY, guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, status TEXT DEFAULT 'pending', verified_account TEXT, server_name TEXT, bot_avatar_url TEXT )")
-        await cursor.execute("CREATE TABLE IF NOT EXISTS gmail_verification ( user_id INTEGER NOT NULL, guild_id INTEGER NOT NULL, verification_code TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (user_id, guild_id) )")
-        await cursor.execute("CREATE TABLE IF NOT EXISTS rank_rewards (guild_id INTEGER NOT NULL, rank_level INTEGER NOT NULL, role_id INTEGER NOT NULL, PRIMARY KEY (guild_id, rank_level))")
-        await cursor.execute("CREATE TABLE IF NOT EXISTS user_custom_roles (guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, role_id INTEGER NOT NULL, PRIMARY KEY (guild_id, user_id))")
-        await cursor.execute("CREATE TABLE IF NOT EXISTS widget_tokens (token TEXT PRIMARY KEY, guild_id INTEGER NOT NULL UNIQUE)")
-        await cursor.execute("CREATE TABLE IF NOT EXISTS user_buffs (guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, buff_type TEXT NOT NULL, expires_at TIMESTAMP NOT NULL, PRIMARY KEY (guild_id, user_id, buff_type))")
-        await cursor.execute("CREATE TABLE IF NOT EXISTS user_cosmetics (guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, leaderboard_emoji TEXT, PRIMARY KEY (guild_id, user_id))")
-        await cursor.execute("CREATE TABLE IF NOT EXISTS user_inventory (guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, item_id TEXT NOT NULL, quantity INTEGER NOT NULL, PRIMARY KEY (guild_id, user_id, item_id))")
-
-        # --- Schema Updates ---
-        await cursor.execute("PRAGMA table_info(guild_settings)")
-        settings_columns = [row[1] for row in await cursor.fetchall()]
-
-        await cursor.execute("PRAGMA table_info(channel_activity)")
-        activity_columns = [row[1] for row in await cursor.fetchall()]
-        if 'last_updated' not in activity_columns:
-            await cursor.execute("ALTER TABLE channel_activity ADD COLUMN last_updated TIMESTAMP")
-
-        if 'koth_king_id' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN koth_king_id INTEGER")
-        if 'koth_king_submission_id' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN koth_king_submission_id INTEGER")
-        if 'koth_tiebreaker_users' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN koth_tiebreaker_users TEXT")
-        if 'warning_limit' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN warning_limit INTEGER DEFAULT 3")
-        if 'warning_action' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN warning_action TEXT DEFAULT 'mute'")
-        if 'warning_action_duration' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN warning_action_duration INTEGER DEFAULT 60")
-        if 'submissions_system_enabled' not in settings_columns: 
-            await cursor.execute("ALTER TABLE guild_settings ADD COLUMN submissions_system_enabled INTEGER DEFAULT 1")
-        if 'temp_vc_system_enabled' not in settings_columns: 
-            await cursor.execute("ALTER TABLE guild_settings ADD COLUMN temp_vc_system_enabled INTEGER DEFAULT 1")
-        if 'reporting_system_enabled' not in settings_columns: 
-            await cursor.execute("ALTER TABLE guild_settings ADD COLUMN reporting_system_enabled INTEGER DEFAULT 1")
-        if 'ranking_system_enabled' not in settings_columns: 
-            await cursor.execute("ALTER TABLE guild_settings ADD COLUMN ranking_system_enabled INTEGER DEFAULT 1")
-        if 'free_verification_modes' not in settings_columns: 
-            await cursor.execute("ALTER TABLE guild_settings ADD COLUMN free_verification_modes TEXT DEFAULT 'captcha,twitch,youtube,gmail'")
-
-        await cursor.execute("PRAGMA table_info(koth_leaderboard)")
-        koth_columns = [row[1] for row in await cursor.fetchall()]
-        if 'wins' not in koth_columns: await cursor.execute("ALTER TABLE koth_leaderboard ADD COLUMN wins INTEGER NOT NULL DEFAULT 0")
-        if 'losses' not in koth_columns: await cursor.execute("ALTER TABLE koth_leaderboard ADD COLUMN losses INTEGER NOT NULL DEFAULT 0")
-        if 'streak' not in koth_columns: await cursor.execute("ALTER TABLE koth_leaderboard ADD COLUMN streak INTEGER NOT NULL DEFAULT 0")
-
-        await cursor.execute("PRAGMA table_info(warnings)")
-        warnings_columns = [row[1] for row in await cursor.fetchall()]
-        if 'moderator_id' not in warnings_columns: await cursor.execute("ALTER TABLE warnings ADD COLUMN moderator_id INTEGER NOT NULL DEFAULT 0")
-        if 'reason' not in warnings_columns: await cursor.execute("ALTER TABLE warnings ADD COLUMN reason TEXT")
-        if 'issued_at' not in warnings_columns: await cursor.execute("ALTER TABLE warnings ADD COLUMN issued_at TIMESTAMP")
-
-        # Inside the initialize_database function, within the "Schema Updates" section
-        if 'custom_role_cost' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN custom_role_cost INTEGER DEFAULT 100")
-        if 'custom_role_divider_role_id' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN custom_role_divider_role_id INTEGER")
-        if 'xp_boost_cost' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN xp_boost_cost INTEGER DEFAULT 25")
-        if 'priority_pass_cost' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN priority_pass_cost INTEGER DEFAULT 50")
-        if 'emoji_unlock_cost' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN emoji_unlock_cost INTEGER DEFAULT 100")
-        if 'tier1_role_id' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN tier1_role_id INTEGER")
-        if 'tier2_role_id' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN tier2_role_id INTEGER")
-        if 'tier3_role_id' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN tier3_role_id INTEGER")
-        if 'tier4_role_id' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN tier4_role_id INTEGER")
-        if 'giveaway_youtube_channel_id' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN giveaway_youtube_channel_id TEXT")
-
-    await conn.commit()
+# --- READ-ONLY CONNECTION POOL ---
+# Heavy reads (leaderboards, dashboard aggregates) run on their own read-only WAL connections,
+# so they don't queue on db_conn's worker thread behind the bot's writes.
+reader_pool: Optional[asyncio.Queue] = None
+# Every connection the pool opened, idle or borrowed, so shutdown can close them all.
+reader_pool_connections: list = []
+reader_pool_lock = asyncio.Lock()
+reader_pool_stats = {"acquires": 0, "waits": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0}
+# Monotonic time before which a failed pool isn't opened again.
+reader_pool_retry_at = 0.0
+
+async def _open_reader_pool() -> Optional[asyncio.Queue]:
+    """Opens the configured number of read-only connections."""
+    global reader_pool, reader_pool_connections, reader_pool_retry_at
+    async with reader_pool_lock:
+        if reader_pool is not None:
+            return reader_pool
+        if time.monotonic() < reader_pool_retry_at:
+            # Another reader failed to open it while this one waited for the lock.
+            return None
+        connections = []
+        try:
+            for _ in range(config.BOT_CONFIG["DB_READER_POOL_SIZE"]):
+                conn = await aiosqlite.connect(f"file:{DB_FILE}?mode=ro", uri=True)
+                connections.append(conn)
+                await conn.execute("PRAGMA query_only = ON;")
+        except Exception as e:
+            retry_seconds = config.BOT_CONFIG["DB_READER_POOL_RETRY_SECONDS"]
+            reader_pool_retry_at = time.monotonic() + retry_seconds
+            log.error(f"Could not open the read-only connection pool, reads will use the main connection for {retry_seconds}s: {e}")
+            for conn in connections:
+                await conn.close()
+            return None
+        pool = asyncio.Queue()
+        for conn in connections:
+            pool.put_nowait(conn)
+        reader_pool, reader_pool_connections = pool, connections
+        log.info(f"Opened {pool.qsize()} read-only database connections.")
+        return reader_pool
+
+@asynccontextmanager
+async def read_connection():
+    """Borrows a connection from the read-only pool for the duration of the block.
+
+    Every read outside transaction() goes through here, never straight to db_conn, where it could see another
+    task's uncommitted writes. Inside a transaction it is the transaction's own connection, so the reads see
+    its writes; without the pool it is db_conn under the write lock.
+    """
+    tx = _active_transaction()
+    if tx is not None:
+        yield tx.conn
+        return
+    pool = reader_pool
+    if pool is None and time.monotonic() >= reader_pool_retry_at:
+        pool = await _open_reader_pool()
+    if pool is None:
+        async with write_lock:
+            yield await get_db_connection()
+        return
+
+    had_to_wait = pool.empty()
+    start = time.perf_counter()
+    conn = await pool.get()
+    waited = time.perf_counter() - start
+
+    reader_pool_stats["acquires"] += 1
+    if had_to_wait:
+        reader_pool_stats["waits"] += 1
+    reader_pool_stats["total_wait_seconds"] += waited
+    reader_pool_stats["max_wait_seconds"] = max(reader_pool_stats["max_wait_seconds"], waited)
+    try:
+        yield conn
+    finally:
+        pool.put_nowait(conn)
+
+def get_pool_stats() -> dict:
+    """Returns wait-time metrics for the read-only connection pool."""
+    acquires = reader_pool_stats["acquires"]
+    return {
+        "size": config.BOT_CONFIG["DB_READER_POOL_SIZE"] if reader_pool is not None else 0,
+        "idle": reader_pool.qsize() if reader_pool is not None else 0,
+        "acquires": acquires,
+        "waits": reader_pool_stats["waits"],
+        "avg_wait_ms": (reader_pool_stats["total_wait_seconds"] / acquires) * 1000 if acquires else 0.0,
+        "max_wait_ms": reader_pool_stats["max_wait_seconds"] * 1000
+    }
+
+async def _close_reader_pool():
+    """Closes every connection the pool opened, first giving borrowed ones a few seconds to be returned."""
+    global reader_pool, reader_pool_connections
+    pool, connections = reader_pool, reader_pool_connections
+    reader_pool, reader_pool_connections = None, []
+    deadline = time.monotonic() + config.BOT_CONFIG["DB_READER_POOL_CLOSE_TIMEOUT_SECONDS"]
+    returned = 0
+    try:
+        while returned < len(connections):
+            await asyncio.wait_for(pool.get(), max(deadline - time.monotonic(), 0))
+            returned += 1
+    except asyncio.TimeoutError:
+        log.warning(f"Closing {len(connections) - returned} read-only database connections that are still in use.")
+    for conn in connections:
+        await conn.close()
+
+async def close_database():
+    """Closes the main connection and every pooled reader connection."""
+    global db_conn, reader_pool_retry_at
+    if reader_pool is not None:
+        await _close_reader_pool()
+    reader_pool_retry_at = 0.0
+    if db_conn:
+        await db_conn.close()
+        db_conn = None
+    log.info("Closed database connections.")
+
+# --- TRANSACTIONS ---
+# Every write goes through transaction(). Outside a transaction it is a single-statement unit of work;
+# inside one it becomes a savepoint, so helper functions join whatever transaction the caller opened.
+# The write lock keeps other tasks from interleaving statements into an open transaction on db_conn.
+write_lock = asyncio.Lock()
+
+class Transaction:
+    """The open transaction of the current task, with callbacks to run once it ends."""
+    def __init__(self, conn):
+        self.conn = conn
+        self.task = asyncio.current_task()
+        self.depth = 0
+        self.commit_callbacks = []
+        self.rollback_callbacks = []
+
+current_transaction: ContextVar[Optional[Transaction]] = ContextVar("current_transaction", default=None)
+
+def _active_transaction() -> Optional[Transaction]:
+    tx = current_transaction.get()
+    # Tasks spawned inside a transaction inherit the context var but not the write lock.
+    if tx is not None and tx.task is asyncio.current_task():
+        return tx
+    return None
+
+async def _run_callbacks(callbacks):
+    for callback in callbacks:
+        try:
+            result = callback()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            log.error(f"Transaction callback {callback!r} failed: {e}")
+
+def on_commit(callback):
+    """Runs callback after the current transaction commits, or right away if there is none."""
+    tx = _active_transaction()
+    if tx is None:
+        result = callback()
+        if inspect.isawaitable(result):
+            asyncio.ensure_future(result)
+        return
+    tx.commit_callbacks.append(callback)
+
+def on_rollback(callback):
+    """Runs callback if the current transaction, or the savepoint it was registered in, rolls back."""
+    tx = _active_transaction()
+    if tx is not None:
+        tx.rollback_callbacks.append(callback)
+
+@asynccontextmanager
+async def transaction():
+    """Groups writes into one commit. Nested blocks become savepoints.
+
+    Usage: async with database.transaction(): ...
+    Database helpers called inside the block join it instead of committing on their own.
+    """
+    tx = _active_transaction()
+    if tx is not None:
+        tx.depth += 1
+        savepoint = f"sp_{tx.depth}"
+        commit_mark, rollback_mark = len(tx.commit_callbacks), len(tx.rollback_callbacks)
+        await tx.conn.execute(f"SAVEPOINT {savepoint}")
+        try:
+            yield tx.conn
+        except BaseException:
+            await tx.conn.execute(f"ROLLBACK TO {savepoint}")
+            await tx.conn.execute(f"RELEASE {savepoint}")
+            rolled_back = tx.rollback_callbacks[rollback_mark:]
+            del tx.commit_callbacks[commit_mark:]
+            del tx.rollback_callbacks[rollback_mark:]
+            await _run_callbacks(reversed(rolled_back))
+            raise
+        else:
+            await tx.conn.execute(f"RELEASE {savepoint}")
+        finally:
+            tx.depth -= 1
+        return
+
+    tx = None
+    try:
+        async with write_lock:
+            conn = await get_db_connection()
+            tx = Transaction(conn)
+            token = current_transaction.set(tx)
+            try:
+                await conn.execute("BEGIN")
+                yield conn
+                await conn.commit()
+            except BaseException:
+                await conn.rollback()
+                raise
+            finally:
+                current_transaction.reset(token)
+    except BaseException:
+        # Callbacks run after the lock is released, so they are free to start new transactions.
+        if tx is not None:
+            await _run_callbacks(reversed(tx.rollback_callbacks))
+        raise
+    await _run_callbacks(tx.commit_callbacks)
+
+# --- CHANGE NOTIFICATIONS ---
+# Callbacks taking (topic, guild_id), told about committed changes other layers cache. Topics:
+# "xp" (ranking), "koth" (koth_leaderboard), "cosmetics" (user_cosmetics) and "settings" (guild_settings).
+# In a web worker, which never opens the database, the bot's changes arrive through apply_external_change.
+change_listeners = []
+
+def add_change_listener(callback):
+    change_listeners.append(callback)
+
+def _dispatch_change(topic: str, guild_id: int):
+    for listener in change_listeners:
+        try:
+            listener(topic, guild_id)
+        except Exception as e:
+            log.error(f"Change listener {listener!r} failed for {topic} in guild {guild_id}: {e}")
+
+def _notify_change(topic: str, guild_id: int):
+    """Tells the change listeners about a write once the transaction it belongs to commits."""
+    on_commit(lambda: _dispatch_change(topic, guild_id))
+
+def apply_external_change(topic: str, guild_id: int):
+    """Tells the change listeners about a change the bot's process committed."""
+    _dispatch_change(topic, guild_id)
+
+# --- INDEXES ---
+# Secondary indexes for the hot lookup paths. Primary keys already cover the (guild_id, user_id) point lookups.
+INDEXES = {
+    "idx_submissions_queue": "CREATE INDEX IF NOT EXISTS idx_submissions_queue ON music_submissions (guild_id, submission_type, status, submitted_at)",
+    "idx_submissions_user": "CREATE INDEX IF NOT EXISTS idx_submissions_user ON music_submissions (guild_id, user_id, submission_type, status, submitted_at)",
+    "idx_warnings_user": "CREATE INDEX IF NOT EXISTS idx_warnings_user ON warnings (guild_id, user_id, issued_at)",
+    "idx_bad_words_guild": "CREATE INDEX IF NOT EXISTS idx_bad_words_guild ON bad_words (guild_id, word)",
+    "idx_ranking_guild_xp": "CREATE INDEX IF NOT EXISTS idx_ranking_guild_xp ON ranking (guild_id, xp DESC, user_id)",
+    "idx_koth_guild_points": "CREATE INDEX IF NOT EXISTS idx_koth_guild_points ON koth_leaderboard (guild_id, points DESC)",
+    "idx_channel_activity_updated": "CREATE INDEX IF NOT EXISTS idx_channel_activity_updated ON channel_activity (guild_id, last_updated)",
+    "idx_verification_links_status": "CREATE INDEX IF NOT EXISTS idx_verification_links_status ON verification_links (status)",
+    "idx_verification_links_user": "CREATE INDEX IF NOT EXISTS idx_verification_links_user ON verification_links (guild_id, user_id, status)",
+    "idx_user_buffs_expiry": "CREATE INDEX IF NOT EXISTS idx_user_buffs_expiry ON user_buffs (expires_at)",
+    "idx_giveaways_active": "CREATE INDEX IF NOT EXISTS idx_giveaways_active ON giveaways (guild_id, is_active)",
+}
+
+# --- SCHEMA MIGRATIONS ---
+# Each step runs exactly once, in order, inside its own transaction. Applied versions are
+# recorded in schema_version, so an up-to-date database costs a single version read on startup.
+
+async def _migration_baseline(cursor):
+    """Creates the original tables and adds columns that databases from before schema_version lack."""
+    # --- Main Tables ---
+    await cursor.execute("""
+        CREATE TABLE IF NOT EXISTS guild_settings (
+            guild_id INTEGER PRIMARY KEY, log_channel_id INTEGER, report_channel_id INTEGER,
+            verification_channel_id INTEGER, unverified_role_id INTEGER, member_role_id INTEGER,
+            verification_message_id INTEGER, admin_role_ids TEXT, mod_role_ids TEXT,
+            mod_chat_channel_id INTEGER, temp_vc_hub_id INTEGER, temp_vc_category_id INTEGER,
+            submission_channel_id INTEGER, review_channel_id INTEGER, submission_status TEXT DEFAULT 'closed',
+            review_panel_message_id INTEGER, announcement_channel_id INTEGER, last_milestone_count INTEGER DEFAULT 0,
+            koth_submission_channel_id INTEGER, koth_winner_role_id INTEGER, verification_mode TEXT DEFAULT 'captcha',
+            ranking_system_enabled INTEGER DEFAULT 1, submissions_system_enabled INTEGER DEFAULT 1,
+            temp_vc_system_enabled INTEGER DEFAULT 1, reporting_system_enabled INTEGER DEFAULT 1
+        )
+    """)
+    await cursor.execute("""
+        CREATE TABLE IF NOT EXISTS channel_activity (
+            guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, channel_id INTEGER NOT NULL,
+            message_count INTEGER DEFAULT 0, voice_seconds INTEGER DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id, channel_id)
+        )
+    """)
+    # --- Tier System Tables ---
+    await cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_tiers (
+            guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL,
+            current_tier INTEGER DEFAULT 1,
+            PRIMARY KEY (guild_id, user_id)
+        )
+    """)
+    await cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tier_requirements (
+            guild_id INTEGER NOT NULL, tier_level INTEGER NOT NULL,
+            messages_req INTEGER DEFAULT 0, voice_hours_req INTEGER DEFAULT 0,
+            PRIMARY KEY (guild_id, tier_level)
+        )
+    """)
+    await cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tier_approval_requests (
+            guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL,
+            next_tier INTEGER NOT NULL, token TEXT UNIQUE NOT NULL,
+            message_id INTEGER NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (guild_id, user_id)
+        )
+    """)
+    await cursor.execute("""
+        CREATE TABLE IF NOT EXISTS giveaways (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT,
+            start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            end_time TIMESTAMP,
+            winner_id INTEGER,
+            is_active BOOLEAN DEFAULT 1,
+            message_id INTEGER
+        )
+    """)
+    await cursor.execute("""
+        CREATE TABLE IF NOT EXISTS giveaway_entrants (
+            giveaway_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            entry_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (giveaway_id, user_id, guild_id)
+        )
+    """)
+    await cursor.execute("CREATE TABLE IF NOT EXISTS warnings (warning_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, moderator_id INTEGER NOT NULL, reason TEXT, issued_at TIMESTAMP NOT NULL, log_message_id INTEGER)")
+    await cursor.execute("CREATE TABLE IF NOT EXISTS reaction_roles (message_id INTEGER NOT NULL, emoji TEXT NOT NULL, role_id INTEGER NOT NULL, guild_id INTEGER NOT NULL, PRIMARY KEY (message_id, emoji))")
+    await cursor.execute("CREATE TABLE IF NOT EXISTS temporary_vcs (channel_id INTEGER PRIMARY KEY, owner_id INTEGER NOT NULL, text_channel_id INTEGER)")
+    await cursor.execute("CREATE TABLE IF NOT EXISTS music_submissions ( submission_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, track_url TEXT NOT NULL, status TEXT NOT NULL, submitted_at TIMESTAMP NOT NULL, reviewer_id INTEGER, submission_type TEXT DEFAULT 'regular' )")
+    await cursor.execute("CREATE TABLE IF NOT EXISTS koth_leaderboard ( user_id INTEGER NOT NULL, guild_id INTEGER NOT NULL, points INTEGER DEFAULT 0, PRIMARY KEY (user_id, guild_id) )")
+    await cursor.execute("CREATE TABLE IF NOT EXISTS ranking ( user_id INTEGER NOT NULL, guild_id INTEGER NOT NULL, xp INTEGER DEFAULT 0, PRIMARY KEY (user_id, guild_id) )")
+    await cursor.execute("CREATE TABLE IF NOT EXISTS bad_words ( word_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER NOT NULL, word TEXT NOT NULL )")
+    await cursor.execute("CREATE TABLE IF NOT EXISTS verification_links ( state TEXT PRIMARY KEY, guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, status TEXT DEFAULT 'pending', verified_account TEXT, server_name TEXT, bot_avatar_url TEXT )")
+    await cursor.execute("CREATE TABLE IF NOT EXISTS gmail_verification ( user_id INTEGER NOT NULL, guild_id INTEGER NOT NULL, verification_code TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (user_id, guild_id) )")
+    await cursor.execute("CREATE TABLE IF NOT EXISTS rank_rewards (guild_id INTEGER NOT NULL, rank_level INTEGER NOT NULL, role_id INTEGER NOT NULL, PRIMARY KEY (guild_id, rank_level))")
+    await cursor.execute("CREATE TABLE IF NOT EXISTS user_custom_roles (guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, role_id INTEGER NOT NULL, PRIMARY KEY (guild_id, user_id))")
+    await cursor.execute("CREATE TABLE IF NOT EXISTS widget_tokens (token TEXT PRIMARY KEY, guild_id INTEGER NOT NULL UNIQUE)")
+    await cursor.execute("CREATE TABLE IF NOT EXISTS user_buffs (guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, buff_type TEXT NOT NULL, expires_at TIMESTAMP NOT NULL, PRIMARY KEY (guild_id, user_id, buff_type))")
+    await cursor.execute("CREATE TABLE IF NOT EXISTS user_cosmetics (guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, leaderboard_emoji TEXT, PRIMARY KEY (guild_id, user_id))")
+    await cursor.execute("CREATE TABLE IF NOT EXISTS user_inventory (guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, item_id TEXT NOT NULL, quantity INTEGER NOT NULL, PRIMARY KEY (guild_id, user_id, item_id))")
+
+    # --- Schema Updates ---
+    await cursor.execute("PRAGMA table_info(guild_settings)")
+    settings_columns = [row[1] for row in await cursor.fetchall()]
+
+    await cursor.execute("PRAGMA table_info(channel_activity)")
+    activity_columns = [row[1] for row in await cursor.fetchall()]
+    if 'last_updated' not in activity_columns:
+        await cursor.execute("ALTER TABLE channel_activity ADD COLUMN last_updated TIMESTAMP")
+
+    if 'koth_king_id' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN koth_king_id INTEGER")
+    if 'koth_king_submission_id' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN koth_king_submission_id INTEGER")
+    if 'koth_tiebreaker_users' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN koth_tiebreaker_users TEXT")
+    if 'warning_limit' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN warning_limit INTEGER DEFAULT 3")
+    if 'warning_action' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN warning_action TEXT DEFAULT 'mute'")
+    if 'warning_action_duration' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN warning_action_duration INTEGER DEFAULT 60")
+    if 'submissions_system_enabled' not in settings_columns: 
+        await cursor.execute("ALTER TABLE guild_settings ADD COLUMN submissions_system_enabled INTEGER DEFAULT 1")
+    if 'temp_vc_system_enabled' not in settings_columns: 
+        await cursor.execute("ALTER TABLE guild_settings ADD COLUMN temp_vc_system_enabled INTEGER DEFAULT 1")
+    if 'reporting_system_enabled' not in settings_columns: 
+        await cursor.execute("ALTER TABLE guild_settings ADD COLUMN reporting_system_enabled INTEGER DEFAULT 1")
+    if 'ranking_system_enabled' not in settings_columns: 
+        await cursor.execute("ALTER TABLE guild_settings ADD COLUMN ranking_system_enabled INTEGER DEFAULT 1")
+    if 'free_verification_modes' not in settings_columns: 
+        await cursor.execute("ALTER TABLE guild_settings ADD COLUMN free_verification_modes TEXT DEFAULT 'captcha,twitch,youtube,gmail'")
+
+    await cursor.execute("PRAGMA table_info(koth_leaderboard)")
+    koth_columns = [row[1] for row in await cursor.fetchall()]
+    if 'wins' not in koth_columns: await cursor.execute("ALTER TABLE koth_leaderboard ADD COLUMN wins INTEGER NOT NULL DEFAULT 0")
+    if 'losses' not in koth_columns: await cursor.execute("ALTER TABLE koth_leaderboard ADD COLUMN losses INTEGER NOT NULL DEFAULT 0")
+    if 'streak' not in koth_columns: await cursor.execute("ALTER TABLE koth_leaderboard ADD COLUMN streak INTEGER NOT NULL DEFAULT 0")
+
+    await cursor.execute("PRAGMA table_info(warnings)")
+    warnings_columns = [row[1] for row in await cursor.fetchall()]
+    if 'moderator_id' not in warnings_columns: await cursor.execute("ALTER TABLE warnings ADD COLUMN moderator_id INTEGER NOT NULL DEFAULT 0")
+    if 'reason' not in warnings_columns: await cursor.execute("ALTER TABLE warnings ADD COLUMN reason TEXT")
+    if 'issued_at' not in warnings_columns: await cursor.execute("ALTER TABLE warnings ADD COLUMN issued_at TIMESTAMP")
+
+    if 'custom_role_cost' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN custom_role_cost INTEGER DEFAULT 100")
+    if 'custom_role_divider_role_id' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN custom_role_divider_role_id INTEGER")
+    if 'xp_boost_cost' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN xp_boost_cost INTEGER DEFAULT 25")
+    if 'priority_pass_cost' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN priority_pass_cost INTEGER DEFAULT 50")
+    if 'emoji_unlock_cost' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN emoji_unlock_cost INTEGER DEFAULT 100")
+    if 'tier1_role_id' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN tier1_role_id INTEGER")
+    if 'tier2_role_id' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN tier2_role_id INTEGER")
+    if 'tier3_role_id' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN tier3_role_id INTEGER")
+    if 'tier4_role_id' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN tier4_role_id INTEGER")
+    if 'giveaway_youtube_channel_id' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN giveaway_youtube_channel_id TEXT")
+
+async def _migration_indexes(cursor):
+    for index_sql in INDEXES.values():
+        await cursor.execute(index_sql)
+
+async def _migration_activity_buckets(cursor):
+    await cursor.execute("""
+        CREATE TABLE IF NOT EXISTS activity_buckets (
+            guild_id INTEGER NOT NULL, bucket_hour INTEGER NOT NULL,
+            user_id INTEGER NOT NULL, channel_id INTEGER NOT NULL,
+            message_count INTEGER DEFAULT 0, voice_seconds INTEGER DEFAULT 0,
+            PRIMARY KEY (guild_id, bucket_hour, user_id, channel_id)
+        )
+    """)
+
+async def _migration_user_activity_totals(cursor):
+    await cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_activity_totals (
+            guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL,
+            message_count INTEGER DEFAULT 0, voice_seconds INTEGER DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id)
+        )
+    """)
+    await cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_activity_totals_top ON user_activity_totals (guild_id, message_count DESC, voice_seconds DESC)")
+    await cursor.execute("""
+        INSERT INTO user_activity_totals (guild_id, user_id, message_count, voice_seconds)
+        SELECT guild_id, user_id, SUM(message_count), SUM(voice_seconds) FROM channel_activity GROUP BY guild_id, user_id
+    """)
+
+async def _migration_user_profiles(cursor):
+    await cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            user_id INTEGER PRIMARY KEY, name TEXT, avatar_url TEXT, fetched_at INTEGER NOT NULL
+        )
+    """)
+    await cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_profiles_fetched ON user_profiles (fetched_at)")
+
+async def _migration_koth_keyset_index(cursor):
+    # Extends idx_koth_guild_points with user_id so keyset pages on (points, user_id) are read straight off the index.
+    await cursor.execute("DROP INDEX IF EXISTS idx_koth_guild_points")
+    await cursor.execute("CREATE INDEX IF NOT EXISTS idx_koth_guild_points_user ON koth_leaderboard (guild_id, points DESC, user_id)")
+
+MIGRATIONS = [
+    (1, "Create base tables and add columns missing from older databases", _migration_baseline),
+    (2, "Add secondary indexes for hot query paths", _migration_indexes),
+    (3, "Add hourly activity_buckets table", _migration_activity_buckets),
+    (4, "Add user_activity_totals table backfilled from channel_activity", _migration_user_activity_totals),
+    (5, "Add user_profiles table for names and avatars of users outside the gateway cache", _migration_user_profiles),
+    (6, "Replace idx_koth_guild_points with a (guild_id, points, user_id) index for keyset paging", _migration_koth_keyset_index),
+]
+
+async def get_schema_version(conn) -> int:
+    """Returns the highest applied migration version, or 0 for a database that predates schema_version."""
+    try:
+        async with conn.execute("SELECT MAX(version) FROM schema_version") as cursor:
+            row = await cursor.fetchone()
+            return row[0] or 0
+    except aiosqlite.OperationalError:
+        return 0
+
+async def initialize_database(dry_run: bool = False):
+    """Brings the schema up to date by running every pending migration. Returns the pending steps.
+
+    With dry_run=True the pending steps are only printed, nothing is changed.
+    """
+    conn = await get_db_connection()
+    if not conn: return []
+    current_version = await get_schema_version(conn)
+    pending = [(version, description, step) for version, description, step in MIGRATIONS if version > current_version]
+    if not pending:
+        log.info(f"Database schema is up to date (version {current_version}).")
+        return []
+
+    if dry_run:
+        print(f"Database is at schema version {current_version}. Pending migrations:")
+        for version, description, _ in pending:
+            print(f"  {version}: {description}")
+        return pending
+
+    await conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    for version, description, step in pending:
+        try:
+            async with transaction() as conn, conn.cursor() as cursor:
+                await step(cursor)
+                await cursor.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (version, description))
+        except Exception as e:
+            log.critical(f"Schema migration {version} ({description}) failed and was rolled back: {e}")
+            raise
+        log.info(f"Applied schema migration {version}: {description}")
     log.info("Database tables initialized/updated successfully.")
+    return pending
 
 # --- SETTINGS FUNCTIONS ---
-async def get_setting(guild_id, setting_name):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
-        await cursor.execute(f"SELECT {setting_name} FROM guild_settings WHERE guild_id = ?", (guild_id,))
+# Whole guild_settings rows keyed by guild_id. An empty dict means the guild has no row yet.
+settings_cache: dict[int, dict] = {}
+settings_cache_stats = {"hits": 0, "misses": 0}
+# Set by load_all_settings: every existing row is cached, so a miss means the guild has no row.
+settings_cache_complete = False
+
+async def _get_cached_settings(guild_id) -> dict:
+    """Returns the cached settings row for a guild, loading it from the database on a miss."""
+    row = settings_cache.get(guild_id)
+    if row is not None:
+        settings_cache_stats["hits"] += 1
+        return row
+    settings_cache_stats["misses"] += 1
+    if settings_cache_complete:
+        settings_cache[guild_id] = {}
+        return settings_cache[guild_id]
+    async with read_connection() as conn, conn.cursor() as cursor:
+        await cursor.execute("SELECT * FROM guild_settings WHERE guild_id = ?", (guild_id,))
         result = await cursor.fetchone()
-        return result[0] if result else None
+        columns = [description[0] for description in cursor.description]
+    row = dict(zip(columns, result)) if result else {}
+    # A write that committed while this read ran has already cached the newer row.
+    return settings_cache.setdefault(guild_id, row)
+
+async def get_setting(guild_id, setting_name):
+    row = await _get_cached_settings(guild_id)
+    return row.get(setting_name)
 
 async def update_setting(guild_id, setting_name, value):
-    conn = await get_db_connection()
-    sql = f"INSERT INTO guild_settings (guild_id, {setting_name}) VALUES (?, ?) ON CONFLICT(guild_id) DO UPDATE SET {setting_name} = excluded.{setting_name}"
-    await conn.execute(sql, (guild_id, value))
-    await conn.commit()
+    await update_settings(guild_id, **{setting_name: value})
+
+async def update_settings(guild_id, **settings):
+    """Writes several settings columns for a guild as a single UPSERT."""
+    if not settings:
+        return
+    columns = list(settings)
+    sql = (
+        f"INSERT INTO guild_settings (guild_id, {', '.join(columns)}) VALUES (?{', ?' * len(columns)}) "
+        f"ON CONFLICT(guild_id) DO UPDATE SET {', '.join(f'{column} = excluded.{column}' for column in columns)}"
+    )
+    async with transaction() as conn:
+        await conn.execute(sql, (guild_id, *settings.values()))
+        row = settings_cache.get(guild_id)
+        if row:
+            row.update(settings)
+        else:
+            # A freshly inserted row picks up the column defaults, so read it back whole.
+            async with conn.execute("SELECT * FROM guild_settings WHERE guild_id = ?", (guild_id,)) as cursor:
+                result = await cursor.fetchone()
+                settings_cache[guild_id] = dict(zip([description[0] for description in cursor.description], result))
+        on_rollback(lambda: invalidate_settings_cache(guild_id))
+        _notify_change("settings", guild_id)
+
+async def load_all_settings():
+    """Caches every guild's settings row in a single scan."""
+    global settings_cache_complete
+    async with read_connection() as conn, conn.execute("SELECT * FROM guild_settings") as cursor:
+        rows = await cursor.fetchall()
+        columns = [description[0] for description in cursor.description]
+    for result in rows:
+        row = dict(zip(columns, result))
+        settings_cache[row["guild_id"]] = row
+    settings_cache_complete = True
+    log.info(f"Loaded settings for {len(rows)} guilds.")
 
 async def get_all_settings(guild_id):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
-        await cursor.execute("SELECT * FROM guild_settings WHERE guild_id = ?", (guild_id,))
-        row = await cursor.fetchone()
-        if not row: return {}
-        columns = [description[0] for description in cursor.description]
-        return dict(zip(columns, row))
+    return dict(await _get_cached_settings(guild_id))
+
+def invalidate_settings_cache(guild_id=None):
+    """Drops one guild's cached settings, or the whole cache if no guild is given."""
+    global settings_cache_complete
+    # A dropped row has to be read back from the database, so misses can no longer be assumed empty.
+    settings_cache_complete = False
+    if guild_id is None:
+        settings_cache.clear()
+    else:
+        settings_cache.pop(guild_id, None)
+
+def get_settings_cache_stats() -> dict:
+    """Returns hit/miss counters for the settings cache."""
+    lookups = settings_cache_stats["hits"] + settings_cache_stats["misses"]
+    return {
+        "hits": settings_cache_stats["hits"],
+        "misses": settings_cache_stats["misses"],
+        "hit_rate": settings_cache_stats["hits"] / lookups if lookups else 0.0,
+        "cached_guilds": len(settings_cache),
+        "fully_loaded": settings_cache_complete
+    }
 
 # --- RANK REWARD FUNCTIONS ---
 async def set_rank_reward(guild_id: int, rank_level: int, role_id: int):
-    conn = await get_db_connection()
-    await conn.execute("INSERT INTO rank_rewards (guild_id, rank_level, role_id) VALUES (?, ?, ?) ON CONFLICT(guild_id, rank_level) DO UPDATE SET role_id = excluded.role_id", (guild_id, rank_level, role_id))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("INSERT INTO rank_rewards (guild_id, rank_level, role_id) VALUES (?, ?, ?) ON CONFLICT(guild_id, rank_level) DO UPDATE SET role_id = excluded.role_id", (guild_id, rank_level, role_id))
 
 async def remove_rank_reward(guild_id: int, rank_level: int):
-    conn = await get_db_connection()
-    await conn.execute("DELETE FROM rank_rewards WHERE guild_id = ? AND rank_level = ?", (guild_id, rank_level))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("DELETE FROM rank_rewards WHERE guild_id = ? AND rank_level = ?", (guild_id, rank_level))
 
 async def get_rank_reward(guild_id: int, rank_level: int):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT role_id FROM rank_rewards WHERE guild_id = ? AND rank_level = ?", (guild_id, rank_level))
         result = await cursor.fetchone()
         return result[0] if result else None
 
 async def get_all_rank_rewards(guild_id: int):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT rank_level, role_id FROM rank_rewards WHERE guild_id = ?", (guild_id,))
         return await cursor.fetchall()
 
 # --- WARNINGS FUNCTIONS ---
 async def add_warning(guild_id, user_id, moderator_id, reason, log_message_id):
-    conn = await get_db_connection()
-    await conn.execute(
-        "INSERT INTO warnings (guild_id, user_id, moderator_id, reason, issued_at, log_message_id) VALUES (?, ?, ?, ?, ?, ?)",
-        (guild_id, user_id, moderator_id, reason, datetime.utcnow(), log_message_id)
-    )
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute(
+            "INSERT INTO warnings (guild_id, user_id, moderator_id, reason, issued_at, log_message_id) VALUES (?, ?, ?, ?, ?, ?)",
+            (guild_id, user_id, moderator_id, reason, datetime.utcnow(), log_message_id)
+        )
 
 async def get_warnings(guild_id, user_id):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute(
             "SELECT moderator_id, reason, issued_at, warning_id FROM warnings WHERE guild_id = ? AND user_id = ? ORDER BY issued_at ASC",
             (guild_id, user_id)
@@ -228,114 +643,97 @@ async def get_warnings(guild_id, user_id):
         return await cursor.fetchall()
 
 async def get_warnings_count(guild_id, user_id):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT COUNT(*) FROM warnings WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
         result = await cursor.fetchone()
         return result[0] if result else 0
 
 async def clear_warnings(guild_id, user_id):
-    conn = await get_db_connection()
-    await conn.execute("DELETE FROM warnings WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("DELETE FROM warnings WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
 
 # --- REACTION ROLES FUNCTIONS ---
 async def add_reaction_role(guild_id, message_id, emoji, role_id):
-    conn = await get_db_connection()
-    await conn.execute("INSERT OR REPLACE INTO reaction_roles (guild_id, message_id, emoji, role_id) VALUES (?, ?, ?, ?)", (guild_id, message_id, emoji, role_id))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("INSERT OR REPLACE INTO reaction_roles (guild_id, message_id, emoji, role_id) VALUES (?, ?, ?, ?)", (guild_id, message_id, emoji, role_id))
 
 async def get_reaction_role(message_id, emoji):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT role_id FROM reaction_roles WHERE message_id = ? AND emoji = ?", (message_id, emoji))
         result = await cursor.fetchone()
         return result[0] if result else None
 
 # --- TEMP VC FUNCTIONS ---
 async def add_temp_vc(channel_id, owner_id, text_channel_id=None):
-    conn = await get_db_connection()
-    await conn.execute("INSERT OR REPLACE INTO temporary_vcs (channel_id, owner_id, text_channel_id) VALUES (?, ?, ?)", (channel_id, owner_id, text_channel_id))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("INSERT OR REPLACE INTO temporary_vcs (channel_id, owner_id, text_channel_id) VALUES (?, ?, ?)", (channel_id, owner_id, text_channel_id))
 
 async def remove_temp_vc(channel_id):
-    conn = await get_db_connection()
-    await conn.execute("DELETE FROM temporary_vcs WHERE channel_id = ?", (channel_id,))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("DELETE FROM temporary_vcs WHERE channel_id = ?", (channel_id,))
 
 async def get_temp_vc_owner(channel_id):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT owner_id FROM temporary_vcs WHERE channel_id = ?", (channel_id,))
         result = await cursor.fetchone()
         return result[0] if result else None
 
 async def get_temp_vc_text_channel_id(channel_id):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT text_channel_id FROM temporary_vcs WHERE channel_id = ?", (channel_id,))
         result = await cursor.fetchone()
         return result[0] if result else None
 
 async def update_temp_vc_owner(channel_id, new_owner_id):
-    conn = await get_db_connection()
-    await conn.execute("UPDATE temporary_vcs SET owner_id = ? WHERE channel_id = ?", (new_owner_id, channel_id))
+    async with transaction() as conn:
+        await conn.execute("UPDATE temporary_vcs SET owner_id = ? WHERE channel_id = ?", (new_owner_id, channel_id))
 
 # --- SUBMISSION FUNCTIONS ---
 async def add_submission(guild_id, user_id, track_url, submission_type='regular'):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
-        await cursor.execute("INSERT INTO music_submissions (guild_id, user_id, track_url, status, submitted_at, submission_type) VALUES (?, ?, ?, ?, ?, ?)",(guild_id, user_id, track_url, "pending", datetime.utcnow(), submission_type))
-        submission_id = cursor.lastrowid
-    await conn.commit()
+    async with transaction() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("INSERT INTO music_submissions (guild_id, user_id, track_url, status, submitted_at, submission_type) VALUES (?, ?, ?, ?, ?, ?)",(guild_id, user_id, track_url, "pending", datetime.utcnow(), submission_type))
+            submission_id = cursor.lastrowid
     return submission_id
 
 async def get_user_submission_count(guild_id, user_id, submission_type='regular'):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT COUNT(*) FROM music_submissions WHERE guild_id = ? AND user_id = ? AND submission_type = ?", (guild_id, user_id, submission_type))
         result = await cursor.fetchone()
         return result[0] if result else 0
 
 async def get_submission_queue_count(guild_id, submission_type='regular', status="pending"):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT COUNT(*) FROM music_submissions WHERE guild_id = ? AND submission_type = ? AND status = ?", (guild_id, submission_type, status))
         result = await cursor.fetchone()
         return result[0] if result else 0
 
 async def get_total_reviewed_count(guild_id, submission_type='regular'):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT COUNT(DISTINCT submission_id) FROM music_submissions WHERE guild_id = ? AND submission_type = ? AND status = 'reviewed'", (guild_id, submission_type))
         result = await cursor.fetchone()
         return result[0] if result else 0
         
 async def get_next_submission(guild_id, submission_type='regular'):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT submission_id, user_id, track_url FROM music_submissions WHERE guild_id = ? AND status = 'pending' AND submission_type = ? ORDER BY submitted_at ASC LIMIT 1", (guild_id, submission_type))
         return await cursor.fetchone()
 
 async def update_submission_status(submission_id, status, reviewer_id=None):
-    conn = await get_db_connection()
-    await conn.execute("UPDATE music_submissions SET status = ?, reviewer_id = ? WHERE submission_id = ?", (status, reviewer_id, submission_id))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("UPDATE music_submissions SET status = ?, reviewer_id = ? WHERE submission_id = ?", (status, reviewer_id, submission_id))
 
 async def clear_session_submissions(guild_id, submission_type='regular'):
-    conn = await get_db_connection()
-    await conn.execute("DELETE FROM music_submissions WHERE guild_id = ? AND submission_type = ? AND status != 'reviewed'", (guild_id, submission_type))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("DELETE FROM music_submissions WHERE guild_id = ? AND submission_type = ? AND status != 'reviewed'", (guild_id, submission_type))
 
 async def prioritize_submission(submission_id):
-    conn = await get_db_connection()
-    await conn.execute("UPDATE music_submissions SET submitted_at = '1970-01-01 00:00:00' WHERE submission_id = ?", (submission_id,))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("UPDATE music_submissions SET submitted_at = '1970-01-01 00:00:00' WHERE submission_id = ?", (submission_id,))
 
 async def get_latest_pending_submission_id(guild_id: int, user_id: int, submission_type: str = 'regular') -> int | None:
     """Gets the ID of a user's most recent pending submission."""
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute(
             "SELECT submission_id FROM music_submissions WHERE guild_id = ? AND user_id = ? AND status = 'pending' AND submission_type = ? ORDER BY submitted_at DESC LIMIT 1",
             (guild_id, user_id, submission_type)
@@ -345,156 +743,307 @@ async def get_latest_pending_submission_id(guild_id: int, user_id: int, submissi
 
 # --- KOTH FUNCTIONS ---
 async def get_koth_points(guild_id, user_id):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT points FROM koth_leaderboard WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
         result = await cursor.fetchone()
         return result[0] if result else 0
 
 async def get_koth_leaderboard(guild_id):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT user_id, points, wins, losses, streak FROM koth_leaderboard WHERE guild_id = ? ORDER BY points DESC", (guild_id,))
         return await cursor.fetchall()
 
+async def get_koth_leaderboard_page(guild_id: int, limit: int, after: Optional[tuple[int, int]] = None):
+    """Gets (user_id, points, wins, losses, streak) rows ordered by points, then user_id, starting after the (points, user_id) cursor."""
+    async with read_connection() as conn, conn.cursor() as cursor:
+        if after is None:
+            await cursor.execute(
+                "SELECT user_id, points, wins, losses, streak FROM koth_leaderboard WHERE guild_id = ? ORDER BY points DESC, user_id LIMIT ?",
+                (guild_id, limit)
+            )
+        else:
+            points, user_id = after
+            await cursor.execute("""
+                SELECT user_id, points, wins, losses, streak FROM koth_leaderboard
+                WHERE guild_id = ? AND points <= ? AND (points < ? OR user_id > ?)
+                ORDER BY points DESC, user_id LIMIT ?
+            """, (guild_id, points, points, user_id, limit))
+        return await cursor.fetchall()
+
 async def update_koth_battle_results(guild_id, winner_id, loser_id):
-    conn = await get_db_connection()
-    await conn.execute("INSERT INTO koth_leaderboard (guild_id, user_id, points, wins, losses, streak) VALUES (?, ?, 1, 1, 0, 1) ON CONFLICT(guild_id, user_id) DO UPDATE SET points = points + 1, wins = wins + 1, streak = streak + 1", (guild_id, winner_id))
-    await conn.execute("INSERT INTO koth_leaderboard (guild_id, user_id, points, wins, losses, streak) VALUES (?, ?, 0, 0, 1, 0) ON CONFLICT(guild_id, user_id) DO UPDATE SET losses = losses + 1, streak = 0", (guild_id, loser_id))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("INSERT INTO koth_leaderboard (guild_id, user_id, points, wins, losses, streak) VALUES (?, ?, 1, 1, 0, 1) ON CONFLICT(guild_id, user_id) DO UPDATE SET points = points + 1, wins = wins + 1, streak = streak + 1", (guild_id, winner_id))
+        await conn.execute("INSERT INTO koth_leaderboard (guild_id, user_id, points, wins, losses, streak) VALUES (?, ?, 0, 0, 1, 0) ON CONFLICT(guild_id, user_id) DO UPDATE SET losses = losses + 1, streak = 0", (guild_id, loser_id))
+        _notify_change("koth", guild_id)
 
 async def reset_koth_leaderboard(guild_id):
-    conn = await get_db_connection()
-    await conn.execute("DELETE FROM koth_leaderboard WHERE guild_id = ?", (guild_id,))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("DELETE FROM koth_leaderboard WHERE guild_id = ?", (guild_id,))
+        _notify_change("koth", guild_id)
 
 # --- BAD WORD FILTER FUNCTIONS ---
 async def add_bad_word(guild_id, word):
-    conn = await get_db_connection()
-    await conn.execute("INSERT INTO bad_words (guild_id, word) VALUES (?, ?)", (guild_id, word.lower()))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("INSERT INTO bad_words (guild_id, word) VALUES (?, ?)", (guild_id, word.lower()))
     return True
 
 async def remove_bad_word(guild_id, word):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with transaction() as conn, conn.cursor() as cursor:
         await cursor.execute("DELETE FROM bad_words WHERE guild_id = ? AND word = ?", (guild_id, word.lower()))
-        await conn.commit()
         return cursor.rowcount > 0
 
 async def get_bad_words(guild_id):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT word FROM bad_words WHERE guild_id = ?", (guild_id,))
         rows = await cursor.fetchall()
         return [row[0] for row in rows]
 
+async def get_all_bad_words() -> dict[int, list[str]]:
+    """Gets every guild's bad words in a single scan, keyed by guild_id."""
+    async with read_connection() as conn, conn.execute("SELECT guild_id, word FROM bad_words") as cursor:
+        rows = await cursor.fetchall()
+    words_by_guild = {}
+    for guild_id, word in rows:
+        words_by_guild.setdefault(guild_id, []).append(word)
+    return words_by_guild
+
 # --- RANKING SYSTEM FUNCTIONS ---
 async def get_user_xp(guild_id, user_id):
     """Gets just the user's XP."""
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT xp FROM ranking WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
         result = await cursor.fetchone()
         return result[0] if result else 0
 
+# --- LEADERBOARD RANK INDEX ---
+class RankIndex:
+    """A guild's XP ordering kept in memory as a sorted list of (-xp, user_id).
+
+    Rank lookups and leaderboard pages are binary searches; an XP change is one
+    delete and one insert into the list.
+    """
+    def __init__(self, rows=()):
+        self.xp_by_user = {user_id: xp for user_id, xp in rows}
+        self.entries = sorted((-xp, user_id) for user_id, xp in self.xp_by_user.items())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_xp(self, user_id) -> Optional[int]:
+        return self.xp_by_user.get(user_id)
+
+    def set_xp(self, user_id, xp):
+        old_xp = self.xp_by_user.get(user_id)
+        if old_xp is not None:
+            del self.entries[bisect_left(self.entries, (-old_xp, user_id))]
+        self.xp_by_user[user_id] = xp
+        insort(self.entries, (-xp, user_id))
+
+    def remove(self, user_id):
+        old_xp = self.xp_by_user.pop(user_id, None)
+        if old_xp is not None:
+            del self.entries[bisect_left(self.entries, (-old_xp, user_id))]
+
+    def rank_of(self, user_id) -> Optional[int]:
+        """1-based rank: one more than the number of users with strictly more XP."""
+        xp = self.xp_by_user.get(user_id)
+        if xp is None:
+            return None
+        return bisect_left(self.entries, (-xp,)) + 1
+
+    def page(self, offset: int, limit: int) -> list[tuple[int, int]]:
+        """Returns (user_id, xp) rows for a slice of the leaderboard."""
+        return [(user_id, -neg_xp) for neg_xp, user_id in self.entries[offset:offset + limit]]
+
+    def page_after(self, xp: int, user_id: int, limit: int) -> list[tuple[int, int]]:
+        """Returns (user_id, xp) rows ranked after the given (xp, user_id) entry."""
+        start = bisect_right(self.entries, (-xp, user_id))
+        return [(uid, -neg_xp) for neg_xp, uid in self.entries[start:start + limit]]
+
+rank_indexes: dict[int, RankIndex] = {}
+rank_index_loaded = False
+rank_index_lock = asyncio.Lock()
+
+async def load_rank_index():
+    """Rebuilds every guild's rank index from the ranking table in one pass."""
+    global rank_indexes, rank_index_loaded
+    async with rank_index_lock:
+        async with read_connection() as conn, conn.execute("SELECT guild_id, user_id, xp FROM ranking") as cursor:
+            rows = await cursor.fetchall()
+        by_guild = {}
+        for guild_id, user_id, xp in rows:
+            by_guild.setdefault(guild_id, []).append((user_id, xp))
+        rank_indexes = {guild_id: RankIndex(guild_rows) for guild_id, guild_rows in by_guild.items()}
+        rank_index_loaded = True
+    log.info(f"Loaded rank index for {len(rank_indexes)} guilds ({len(rows)} users).")
+
+async def get_rank_index(guild_id: int) -> RankIndex:
+    if not rank_index_loaded:
+        await load_rank_index()
+    index = rank_indexes.get(guild_id)
+    if index is None:
+        # A guild with no XP yet.
+        async with read_connection() as conn, conn.execute("SELECT user_id, xp FROM ranking WHERE guild_id = ?", (guild_id,)) as cursor:
+            rows = await cursor.fetchall()
+        # Another caller may have loaded it meanwhile and already be updating it.
+        index = rank_indexes.setdefault(guild_id, RankIndex(rows))
+    return index
+
 async def update_user_xp(guild_id, user_id, xp_to_add):
-    conn = await get_db_connection()
-    await conn.execute("INSERT INTO ranking (guild_id, user_id, xp) VALUES (?, ?, ?) ON CONFLICT(guild_id, user_id) DO UPDATE SET xp = xp + excluded.xp", (guild_id, user_id, xp_to_add))
-    await conn.commit()
+    await apply_xp_grants(guild_id, {user_id: xp_to_add})
+
+async def apply_xp_grants(guild_id: int, grants: dict[int, int]) -> dict[int, tuple[int, int]]:
+    """Adds XP for several users in one transaction. Returns user_id -> (old_xp, new_xp)."""
+    if not grants:
+        return {}
+    async with transaction() as conn:
+        # The index is the source of the before/after values. It is looked up and updated under the write
+        # lock, before the write is awaited, so concurrent grants for the same user can't both read the same
+        # old value or update an index object that has since been replaced.
+        index = await get_rank_index(guild_id)
+        results = {}
+        new_users = set()
+        for user_id, xp in grants.items():
+            old_xp = index.get_xp(user_id)
+            if old_xp is None:
+                new_users.add(user_id)
+                old_xp = 0
+            results[user_id] = (old_xp, old_xp + xp)
+            index.set_xp(user_id, old_xp + xp)
+        on_rollback(lambda: _undo_xp_grants(index, grants, new_users))
+        await conn.executemany(
+            "INSERT INTO ranking (guild_id, user_id, xp) VALUES (?, ?, ?) ON CONFLICT(guild_id, user_id) DO UPDATE SET xp = xp + excluded.xp",
+            [(guild_id, user_id, xp) for user_id, xp in grants.items()]
+        )
+        _notify_change("xp", guild_id)
+    return results
+
+def _undo_xp_grants(index: RankIndex, grants: dict[int, int], new_users: set[int]):
+    """Takes a rolled-back grant's XP back out of the index, leaving any change made since in place."""
+    for user_id, xp in grants.items():
+        current_xp = index.get_xp(user_id)
+        if current_xp is None:
+            continue
+        if user_id in new_users and current_xp == xp:
+            # The grant created the entry, and the rollback removed the user's row with it.
+            index.remove(user_id)
+        else:
+            index.set_xp(user_id, current_xp - xp)
 
 async def get_user_rank(guild_id, user_id):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
-        await cursor.execute("SELECT xp FROM ranking WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
-        result = await cursor.fetchone()
-        if not result: return None, None
-        user_xp = result[0]
-        await cursor.execute("SELECT COUNT(*) FROM ranking WHERE guild_id = ? AND xp > ?", (guild_id, user_xp))
-        rank_result = await cursor.fetchone()
-        rank = rank_result[0] + 1
-        return user_xp, rank
-
-async def get_leaderboard(guild_id, limit=10):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
-        await cursor.execute("SELECT user_id, xp FROM ranking WHERE guild_id = ? ORDER BY xp DESC LIMIT ?", (guild_id, limit))
-        return await cursor.fetchall()
+    index = await get_rank_index(guild_id)
+    user_xp = index.get_xp(user_id)
+    if user_xp is None: return None, None
+    return user_xp, index.rank_of(user_id)
+
+async def get_leaderboard(guild_id, limit=10, offset=0):
+    index = await get_rank_index(guild_id)
+    return index.page(offset, limit)
+
+async def get_leaderboard_page(guild_id: int, limit: int, after: Optional[tuple[int, int]] = None) -> list[tuple[int, int]]:
+    """Gets (user_id, xp) rows ordered by XP, then user_id, starting after the (xp, user_id) cursor."""
+    index = await get_rank_index(guild_id)
+    if after is None:
+        return index.page(0, limit)
+    return index.page_after(after[0], after[1], limit)
 
 # --- OAUTH & GMAIL VERIFICATION FUNCTIONS ---
+# verification_links rows by state -> (expires_at, row), so an OAuth callback doesn't have to read the link back.
+verification_link_cache: dict[str, tuple[float, dict]] = {}
+
+def _cache_verification_link(state, row: dict):
+    expires_at = time.monotonic() + config.BOT_CONFIG["VERIFICATION_LINK_CACHE_SECONDS"]
+    verification_link_cache[state] = (expires_at, row)
+
 async def create_verification_link(state, guild_id, user_id, server_name, bot_avatar_url):
-    conn = await get_db_connection()
-    await conn.execute("INSERT INTO verification_links (state, guild_id, user_id, server_name, bot_avatar_url) VALUES (?, ?, ?, ?, ?)", (state, guild_id, user_id, server_name, bot_avatar_url))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("INSERT INTO verification_links (state, guild_id, user_id, server_name, bot_avatar_url) VALUES (?, ?, ?, ?, ?)", (state, guild_id, user_id, server_name, bot_avatar_url))
+        row = {"guild_id": guild_id, "user_id": user_id, "server_name": server_name, "bot_avatar_url": bot_avatar_url, "status": "pending"}
+        on_commit(lambda: _cache_verification_link(state, row))
+
+async def get_verification_link(state) -> Optional[dict]:
+    """Gets a verification link by its OAuth state, from a short-lived cache when possible."""
+    cached = verification_link_cache.get(state)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    verification_link_cache.pop(state, None)
+    async with read_connection() as conn, conn.cursor() as cursor:
+        await cursor.execute("SELECT guild_id, user_id, server_name, bot_avatar_url, status FROM verification_links WHERE state = ?", (state,))
+        result = await cursor.fetchone()
+    if not result:
+        return None
+    row = {"guild_id": result[0], "user_id": result[1], "server_name": result[2], "bot_avatar_url": result[3], "status": result[4]}
+    _cache_verification_link(state, row)
+    return row
 
 async def complete_verification(state, account_name):
-    conn = await get_db_connection()
-    await conn.execute("UPDATE verification_links SET status = 'verified', verified_account = ? WHERE state = ?", (account_name, state))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("UPDATE verification_links SET status = 'verified', verified_account = ? WHERE state = ?", (account_name, state))
+        on_commit(lambda: verification_link_cache.pop(state, None))
+
+async def complete_verification_if_pending(state, account_name) -> bool:
+    """Marks a pending verification link as verified. Returns False if it was missing or already used."""
+    async with transaction() as conn, conn.cursor() as cursor:
+        await cursor.execute("UPDATE verification_links SET status = 'verified', verified_account = ? WHERE state = ? AND status = 'pending'", (account_name, state))
+        completed = cursor.rowcount > 0
+        on_commit(lambda: verification_link_cache.pop(state, None))
+        return completed
 
 async def get_completed_verifications():
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT state, guild_id, user_id, verified_account FROM verification_links WHERE status = 'verified'")
         return await cursor.fetchall()
 
 async def delete_verification_link(state):
-    conn = await get_db_connection()
-    await conn.execute("DELETE FROM verification_links WHERE state = ?", (state,))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("DELETE FROM verification_links WHERE state = ?", (state,))
+        on_commit(lambda: verification_link_cache.pop(state, None))
 
 async def store_gmail_code(guild_id, user_id, code):
-    conn = await get_db_connection()
-    await conn.execute("INSERT INTO gmail_verification (guild_id, user_id, verification_code) VALUES (?, ?, ?) ON CONFLICT(guild_id, user_id) DO UPDATE SET verification_code = excluded.verification_code, created_at = CURRENT_TIMESTAMP", (guild_id, user_id, code))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("INSERT INTO gmail_verification (guild_id, user_id, verification_code) VALUES (?, ?, ?) ON CONFLICT(guild_id, user_id) DO UPDATE SET verification_code = excluded.verification_code, created_at = CURRENT_TIMESTAMP", (guild_id, user_id, code))
 
 async def get_gmail_code(guild_id, user_id):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT verification_code FROM gmail_verification WHERE guild_id = ? AND user_id = ? AND created_at > datetime('now', '-10 minutes')", (guild_id, user_id))
         result = await cursor.fetchone()
         return result[0] if result else None
 
 async def delete_gmail_code(guild_id, user_id):
-    conn = await get_db_connection()
-    await conn.execute("DELETE FROM gmail_verification WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("DELETE FROM gmail_verification WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
 
 async def adjust_koth_points(guild_id, user_id, points_to_add):
     """Manually adds or removes points from a user's KOTH score."""
-    conn = await get_db_connection()
-    await conn.execute(
-        """
-        INSERT INTO koth_leaderboard (guild_id, user_id, points)
-        VALUES (?, ?, ?)
-        ON CONFLICT(guild_id, user_id) DO UPDATE SET points = points + excluded.points
-        """,
-        (guild_id, user_id, points_to_add)
-    )
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute(
+            """
+            INSERT INTO koth_leaderboard (guild_id, user_id, points)
+            VALUES (?, ?, ?)
+            ON CONFLICT(guild_id, user_id) DO UPDATE SET points = points + excluded.points
+            """,
+            (guild_id, user_id, points_to_add)
+        )
+        _notify_change("koth", guild_id)
     log.info(f"Adjusted KOTH points for user {user_id} in guild {guild_id} by {points_to_add}.")
 
 # --- CUSTOM ROLE SHOP FUNCTIONS ---
 async def get_user_custom_role(guild_id: int, user_id: int):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT role_id FROM user_custom_roles WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
         result = await cursor.fetchone()
         return result[0] if result else None
 
 async def set_user_custom_role(guild_id: int, user_id: int, role_id: int):
-    conn = await get_db_connection()
-    await conn.execute("INSERT INTO user_custom_roles (guild_id, user_id, role_id) VALUES (?, ?, ?) ON CONFLICT(guild_id, user_id) DO UPDATE SET role_id = excluded.role_id", (guild_id, user_id, role_id))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("INSERT INTO user_custom_roles (guild_id, user_id, role_id) VALUES (?, ?, ?) ON CONFLICT(guild_id, user_id) DO UPDATE SET role_id = excluded.role_id", (guild_id, user_id, role_id))
 
 async def delete_user_custom_role(guild_id: int, user_id: int):
-    conn = await get_db_connection()
-    await conn.execute("DELETE FROM user_custom_roles WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("DELETE FROM user_custom_roles WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
 
 async def get_or_create_widget_token(guild_id: int) -> str:
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with transaction() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT token FROM widget_tokens WHERE guild_id = ?", (guild_id,))
         result = await cursor.fetchone()
         if result:
@@ -502,20 +1051,17 @@ async def get_or_create_widget_token(guild_id: int) -> str:
         else:
             token = secrets.token_urlsafe(32)
             await cursor.execute("INSERT INTO widget_tokens (token, guild_id) VALUES (?, ?)", (token, guild_id))
-            await conn.commit()
             return token
 
 async def get_guild_from_token(token: str) -> Optional[int]:
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT guild_id FROM widget_tokens WHERE token = ?", (token,))
         result = await cursor.fetchone()
         return result[0] if result else None
     
 async def get_current_review(guild_id: int, submission_type: str = 'regular'):
     """Gets the user_id of the submission currently being reviewed."""
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute(
             "SELECT user_id FROM music_submissions WHERE guild_id = ? AND status = 'reviewing' AND submission_type = ? ORDER BY submitted_at ASC LIMIT 1",
             (guild_id, submission_type)
@@ -525,22 +1071,20 @@ async def get_current_review(guild_id: int, submission_type: str = 'regular'):
 
 async def add_user_buff(guild_id: int, user_id: int, buff_type: str, duration_seconds: int):
     """Adds or extends a buff for a user."""
-    conn = await get_db_connection()
-    await conn.execute(
-        """
-        INSERT INTO user_buffs (guild_id, user_id, buff_type, expires_at)
-        VALUES (?, ?, ?, datetime('now', '+' || ? || ' seconds'))
-        ON CONFLICT(guild_id, user_id, buff_type) DO UPDATE SET
-        expires_at = datetime('now', '+' || ? || ' seconds')
-        """,
-        (guild_id, user_id, buff_type, duration_seconds, duration_seconds)
-    )
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute(
+            """
+            INSERT INTO user_buffs (guild_id, user_id, buff_type, expires_at)
+            VALUES (?, ?, ?, datetime('now', '+' || ? || ' seconds'))
+            ON CONFLICT(guild_id, user_id, buff_type) DO UPDATE SET
+            expires_at = datetime('now', '+' || ? || ' seconds')
+            """,
+            (guild_id, user_id, buff_type, duration_seconds, duration_seconds)
+        )
 
 async def get_user_buff(guild_id: int, user_id: int, buff_type: str):
     """Checks if a user has a specific, non-expired buff."""
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute(
             "SELECT expires_at FROM user_buffs WHERE guild_id = ? AND user_id = ? AND buff_type = ? AND expires_at > datetime('now')",
             (guild_id, user_id, buff_type)
@@ -548,40 +1092,50 @@ async def get_user_buff(guild_id: int, user_id: int, buff_type: str):
         result = await cursor.fetchone()
         return result[0] if result else None
 
+async def get_users_with_buff(guild_id: int, user_ids: list[int], buff_type: str) -> set[int]:
+    """Returns the subset of users that have a specific, non-expired buff."""
+    if not user_ids:
+        return set()
+    placeholders = ','.join('?' for _ in user_ids)
+    async with read_connection() as conn, conn.cursor() as cursor:
+        await cursor.execute(
+            f"SELECT user_id FROM user_buffs WHERE guild_id = ? AND buff_type = ? AND expires_at > datetime('now') AND user_id IN ({placeholders})",
+            [guild_id, buff_type] + list(user_ids)
+        )
+        rows = await cursor.fetchall()
+        return {row[0] for row in rows}
+
 async def cleanup_expired_buffs():
     """Removes expired buffs from the database."""
-    conn = await get_db_connection()
-    await conn.execute("DELETE FROM user_buffs WHERE expires_at <= datetime('now')")
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("DELETE FROM user_buffs WHERE expires_at <= datetime('now')")
 
 async def unlock_cosmetic(guild_id: int, user_id: int, cosmetic_type: str):
     """Unlocks a cosmetic for a user, preparing it to be set."""
-    conn = await get_db_connection()
-    # We use INSERT OR IGNORE to create a row only if one doesn't exist.
-    await conn.execute(
-        "INSERT OR IGNORE INTO user_cosmetics (guild_id, user_id) VALUES (?, ?)",
-        (guild_id, user_id)
-    )
-    await conn.commit()
+    async with transaction() as conn:
+        # We use INSERT OR IGNORE to create a row only if one doesn't exist.
+        await conn.execute(
+            "INSERT OR IGNORE INTO user_cosmetics (guild_id, user_id) VALUES (?, ?)",
+            (guild_id, user_id)
+        )
 
 async def set_user_cosmetic(guild_id: int, user_id: int, cosmetic_type: str, value: str):
     """Sets or updates a user's cosmetic."""
-    conn = await get_db_connection()
-    await conn.execute(
-        f"UPDATE user_cosmetics SET {cosmetic_type} = ? WHERE guild_id = ? AND user_id = ?",
-        (value, guild_id, user_id)
-    )
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute(
+            f"UPDATE user_cosmetics SET {cosmetic_type} = ? WHERE guild_id = ? AND user_id = ?",
+            (value, guild_id, user_id)
+        )
+        _notify_change("cosmetics", guild_id)
 
 async def get_all_user_cosmetics(guild_id: int, user_ids: list[int]) -> dict:
     """Gets all cosmetics for a list of users."""
     if not user_ids:
         return {}
-    conn = await get_db_connection()
     placeholders = ','.join('?' for _ in user_ids)
     query = f"SELECT user_id, leaderboard_emoji FROM user_cosmetics WHERE guild_id = ? AND user_id IN ({placeholders})"
     
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute(query, [guild_id] + user_ids)
         rows = await cursor.fetchall()
         # Return a dictionary mapping user_id to their emoji
@@ -591,20 +1145,18 @@ async def get_all_user_cosmetics(guild_id: int, user_ids: list[int]) -> dict:
 
 async def add_to_inventory(guild_id: int, user_id: int, item_id: str, quantity: int = 1):
     """Adds a quantity of an item to a user's inventory."""
-    conn = await get_db_connection()
-    await conn.execute(
-        """
-        INSERT INTO user_inventory (guild_id, user_id, item_id, quantity) VALUES (?, ?, ?, ?)
-        ON CONFLICT(guild_id, user_id, item_id) DO UPDATE SET quantity = quantity + excluded.quantity
-        """,
-        (guild_id, user_id, item_id, quantity)
-    )
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute(
+            """
+            INSERT INTO user_inventory (guild_id, user_id, item_id, quantity) VALUES (?, ?, ?, ?)
+            ON CONFLICT(guild_id, user_id, item_id) DO UPDATE SET quantity = quantity + excluded.quantity
+            """,
+            (guild_id, user_id, item_id, quantity)
+        )
 
 async def get_inventory_item_count(guild_id: int, user_id: int, item_id: str) -> int:
     """Gets the quantity of a specific item from a user's inventory."""
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute(
             "SELECT quantity FROM user_inventory WHERE guild_id = ? AND user_id = ? AND item_id = ?",
             (guild_id, user_id, item_id)
@@ -614,99 +1166,72 @@ async def get_inventory_item_count(guild_id: int, user_id: int, item_id: str) ->
 
 async def use_inventory_item(guild_id: int, user_id: int, item_id: str, quantity: int = 1):
     """Decrements the quantity of an item from a user's inventory."""
-    conn = await get_db_connection()
-    await conn.execute(
-        "UPDATE user_inventory SET quantity = quantity - ? WHERE guild_id = ? AND user_id = ? AND item_id = ?",
-        (quantity, guild_id, user_id, item_id)
-    )
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute(
+            "UPDATE user_inventory SET quantity = quantity - ? WHERE guild_id = ? AND user_id = ? AND item_id = ?",
+            (quantity, guild_id, user_id, item_id)
+        )
 
     # --- TIER SYSTEM FUNCTIONS ---
 
 async def set_user_tier(guild_id: int, user_id: int, tier: int):
-    conn = await get_db_connection()
-    await conn.execute("INSERT INTO user_tiers (guild_id, user_id, current_tier) VALUES (?, ?, ?) ON CONFLICT(guild_id, user_id) DO UPDATE SET current_tier = excluded.current_tier", (guild_id, user_id, tier))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("INSERT INTO user_tiers (guild_id, user_id, current_tier) VALUES (?, ?, ?) ON CONFLICT(guild_id, user_id) DO UPDATE SET current_tier = excluded.current_tier", (guild_id, user_id, tier))
 
 async def get_user_tier(guild_id: int, user_id: int):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT current_tier FROM user_tiers WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
         result = await cursor.fetchone()
         return result[0] if result else None
 
-async def update_user_activity(guild_id: int, user_id: int, message_count: int = 0, voice_seconds: int = 0):
-    conn = await get_db_connection()
-    await conn.execute("""
-        INSERT INTO user_activity (guild_id, user_id, message_count, voice_seconds, last_updated)
-        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ON CONFLICT(guild_id, user_id) DO UPDATE SET
-        message_count = message_count + excluded.message_count,
-        voice_seconds = voice_seconds + excluded.voice_seconds,
-        last_updated = CURRENT_TIMESTAMP
-    """, (guild_id, user_id, message_count, voice_seconds))
-    await conn.commit()
-
 async def set_tier_requirement(guild_id: int, tier_level: int, messages: int, voice_hours: int):
-    conn = await get_db_connection()
-    await conn.execute("INSERT INTO tier_requirements (guild_id, tier_level, messages_req, voice_hours_req) VALUES (?, ?, ?, ?) ON CONFLICT(guild_id, tier_level) DO UPDATE SET messages_req=excluded.messages_req, voice_hours_req=excluded.voice_hours_req", (guild_id, tier_level, messages, voice_hours))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("INSERT INTO tier_requirements (guild_id, tier_level, messages_req, voice_hours_req) VALUES (?, ?, ?, ?) ON CONFLICT(guild_id, tier_level) DO UPDATE SET messages_req=excluded.messages_req, voice_hours_req=excluded.voice_hours_req", (guild_id, tier_level, messages, voice_hours))
 
-# REPLACE this function
 async def get_user_activity(guild_id: int, user_id: int):
-    """Calculates a user's total activity by summing their channel_activity."""
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
-        await cursor.execute("""
-            SELECT SUM(message_count), SUM(voice_seconds) 
-            FROM channel_activity 
-            WHERE guild_id = ? AND user_id = ?
-        """, (guild_id, user_id))
+    """Gets a user's total activity from the running totals kept alongside channel_activity."""
+    async with read_connection() as conn, conn.cursor() as cursor:
+        await cursor.execute("SELECT message_count, voice_seconds FROM user_activity_totals WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
         result = await cursor.fetchone()
-        if not result or result[0] is None: 
+        if not result:
             return {'message_count': 0, 'voice_seconds': 0}
         return {'message_count': result[0], 'voice_seconds': result[1]}
 
 async def get_all_tier_requirements(guild_id: int):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT tier_level, messages_req, voice_hours_req FROM tier_requirements WHERE guild_id = ?", (guild_id,))
         rows = await cursor.fetchall()
         return {row[0]: {'messages_req': row[1], 'voice_hours_req': row[2]} for row in rows}
 
 async def create_or_update_tier_approval_request(guild_id, user_id, next_tier, token, message_id):
     """Creates a new tier approval request or updates an existing one for a user."""
-    conn = await get_db_connection()
-    await conn.execute("""
-        INSERT INTO tier_approval_requests (guild_id, user_id, next_tier, token, message_id)
-        VALUES (?, ?, ?, ?, ?)
-        ON CONFLICT(guild_id, user_id) DO UPDATE SET
-            next_tier = excluded.next_tier,
-            token = excluded.token,
-            message_id = excluded.message_id,
-            created_at = CURRENT_TIMESTAMP
-    """, (guild_id, user_id, next_tier, token, message_id))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("""
+            INSERT INTO tier_approval_requests (guild_id, user_id, next_tier, token, message_id)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(guild_id, user_id) DO UPDATE SET
+                next_tier = excluded.next_tier,
+                token = excluded.token,
+                message_id = excluded.message_id,
+                created_at = CURRENT_TIMESTAMP
+        """, (guild_id, user_id, next_tier, token, message_id))
 
 async def get_tier_approval_request(guild_id, user_id):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT token FROM tier_approval_requests WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
         result = await cursor.fetchone()
         return result[0] if result else None
 
 async def get_tier_request_by_token(token: str):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT guild_id, user_id, next_tier, message_id FROM tier_approval_requests WHERE token = ?", (token,))
         result = await cursor.fetchone()
         if not result: return None
         return {'guild_id': result[0], 'user_id': result[1], 'next_tier': result[2], 'message_id': result[3], 'token': token}
 
 async def delete_tier_request(token: str):
-    conn = await get_db_connection()
-    await conn.execute("DELETE FROM tier_approval_requests WHERE token = ?", (token,))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("DELETE FROM tier_approval_requests WHERE token = ?", (token,))
 
 async def get_all_tier_roles(guild_id: int):
     settings = await get_all_settings(guild_id)
@@ -716,68 +1241,217 @@ async def get_all_tier_roles(guild_id: int):
     }
 
 async def update_channel_activity(guild_id: int, user_id: int, channel_id: int, message_count: int = 0, voice_seconds: int = 0):
-    conn = await get_db_connection()
-    await conn.execute("""
-        INSERT INTO channel_activity (guild_id, user_id, channel_id, message_count, voice_seconds, last_updated)
-        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ON CONFLICT(guild_id, user_id, channel_id) DO UPDATE SET
-        message_count = message_count + excluded.message_count,
-        voice_seconds = voice_seconds + excluded.voice_seconds,
-        last_updated = CURRENT_TIMESTAMP
-    """, (guild_id, user_id, channel_id, message_count, voice_seconds))
-    await conn.commit()
+    """Records activity and writes it out immediately instead of waiting for the next flush."""
+    await buffer_channel_activity(guild_id, user_id, channel_id, message_count, voice_seconds)
+    await flush_channel_activity()
+
+# --- ACTIVITY WRITE-BEHIND BUFFER ---
+# Pending activity deltas keyed by (guild_id, user_id, channel_id, bucket_hour) -> [message_count, voice_seconds].
+# bucket_hour is the Unix time in whole hours, so the same flush feeds channel_activity and activity_buckets.
+activity_buffer: dict[tuple[int, int, int, int], list[int]] = {}
+
+def _current_hour() -> int:
+    return int(time.time()) // 3600
+
+async def buffer_channel_activity(guild_id: int, user_id: int, channel_id: int, message_count: int = 0, voice_seconds: int = 0):
+    """Merges an activity delta into the in-memory buffer. It is written out by flush_channel_activity."""
+    key = (guild_id, user_id, channel_id, _current_hour())
+    pending = activity_buffer.get(key)
+    if pending:
+        pending[0] += message_count
+        pending[1] += voice_seconds
+    else:
+        activity_buffer[key] = [message_count, voice_seconds]
+
+    if len(activity_buffer) >= config.BOT_CONFIG["ACTIVITY_FLUSH_MAX_ROWS"]:
+        await flush_channel_activity()
+
+async def flush_channel_activity() -> int:
+    """Writes every buffered activity delta in one transaction. Returns the number of rows written."""
+    global activity_buffer
+    if not activity_buffer:
+        return 0
+    try:
+        async with transaction() as conn:
+            # Swapped only once the write lock is held, so concurrent flushes never split a batch.
+            if not activity_buffer:
+                return 0
+            pending, activity_buffer = activity_buffer, {}
+            # Merge the batch back if it is rolled back, here or with an enclosing transaction, so nothing is dropped.
+            on_rollback(lambda: _requeue_activity(pending))
+            bucket_rows = [(g, hour, u, c, msgs, secs) for (g, u, c, hour), (msgs, secs) in pending.items()]
+            channel_totals = {}
+            for (g, u, c, _), (msgs, secs) in pending.items():
+                totals = channel_totals.setdefault((g, u, c), [0, 0])
+                totals[0] += msgs
+                totals[1] += secs
+            rows = [(g, u, c, msgs, secs) for (g, u, c), (msgs, secs) in channel_totals.items()]
+            user_totals = {}
+            for (g, u, _), (msgs, secs) in channel_totals.items():
+                totals = user_totals.setdefault((g, u), [0, 0])
+                totals[0] += msgs
+                totals[1] += secs
+            user_rows = [(g, u, msgs, secs) for (g, u), (msgs, secs) in user_totals.items()]
+
+            await conn.executemany("""
+                INSERT INTO channel_activity (guild_id, user_id, channel_id, message_count, voice_seconds, last_updated)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(guild_id, user_id, channel_id) DO UPDATE SET
+                message_count = message_count + excluded.message_count,
+                voice_seconds = voice_seconds + excluded.voice_seconds,
+                last_updated = CURRENT_TIMESTAMP
+            """, rows)
+            await conn.executemany("""
+                INSERT INTO activity_buckets (guild_id, bucket_hour, user_id, channel_id, message_count, voice_seconds)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(guild_id, bucket_hour, user_id, channel_id) DO UPDATE SET
+                message_count = message_count + excluded.message_count,
+                voice_seconds = voice_seconds + excluded.voice_seconds
+            """, bucket_rows)
+            await conn.executemany("""
+                INSERT INTO user_activity_totals (guild_id, user_id, message_count, voice_seconds)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(guild_id, user_id) DO UPDATE SET
+                message_count = message_count + excluded.message_count,
+                voice_seconds = voice_seconds + excluded.voice_seconds
+            """, user_rows)
+    except Exception as e:
+        log.error(f"Failed to flush channel activity, keeping it for the next flush: {e}")
+        return 0
+    return len(rows)
+
+def _requeue_activity(pending):
+    for key, (msgs, secs) in pending.items():
+        current = activity_buffer.setdefault(key, [0, 0])
+        current[0] += msgs
+        current[1] += secs
 
 async def get_user_channel_activity(guild_id: int, user_id: int):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT channel_id, message_count, voice_seconds FROM channel_activity WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
         return await cursor.fetchall()
 
-# REPLACE this function
 async def get_top_users_overall(guild_id: int, limit: int = 5):
-    """Gets top users by summing their activity across all channels."""
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    """Gets top users by their activity across all channels."""
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("""
-            SELECT user_id, SUM(message_count), SUM(voice_seconds) 
-            FROM channel_activity 
-            WHERE guild_id = ? 
-            GROUP BY user_id 
-            ORDER BY SUM(message_count) DESC, SUM(voice_seconds) DESC 
+            SELECT user_id, message_count, voice_seconds
+            FROM user_activity_totals
+            WHERE guild_id = ?
+            ORDER BY message_count DESC, voice_seconds DESC
             LIMIT ?
         """, (guild_id, limit))
         return await cursor.fetchall()
 
+async def reconcile_user_activity_totals() -> int:
+    """Checks user_activity_totals against the channel_activity detail rows and repairs any drift.
+
+    Returns the number of totals rows that had to be fixed.
+    """
+    # The full comparison runs on a read-only snapshot, so writers aren't held up for the whole scan.
+    async with read_connection() as conn:
+        async with conn.execute("""
+            SELECT detail.guild_id, detail.user_id
+            FROM (
+                SELECT guild_id, user_id, SUM(message_count) AS msgs, SUM(voice_seconds) AS secs
+                FROM channel_activity GROUP BY guild_id, user_id
+            ) AS detail
+            LEFT JOIN user_activity_totals AS totals
+                ON totals.guild_id = detail.guild_id AND totals.user_id = detail.user_id
+            WHERE totals.user_id IS NULL OR totals.message_count != detail.msgs OR totals.voice_seconds != detail.secs
+        """) as cursor:
+            mismatched = await cursor.fetchall()
+        async with conn.execute("""
+            SELECT guild_id, user_id FROM user_activity_totals WHERE NOT EXISTS (
+                SELECT 1 FROM channel_activity
+                WHERE channel_activity.guild_id = user_activity_totals.guild_id AND channel_activity.user_id = user_activity_totals.user_id
+            )
+        """) as cursor:
+            orphaned = await cursor.fetchall()
+    if not mismatched and not orphaned:
+        return 0
+
+    # Flushes may have landed since the snapshot, so the repairs recompute each suspect user from the
+    # current detail rows and only count the ones that still disagree.
+    async with transaction() as conn:
+        fixed = 0
+        if mismatched:
+            cursor = await conn.executemany("""
+                INSERT INTO user_activity_totals (guild_id, user_id, message_count, voice_seconds)
+                SELECT guild_id, user_id, SUM(message_count), SUM(voice_seconds) FROM channel_activity
+                WHERE guild_id = ? AND user_id = ? GROUP BY guild_id, user_id
+                ON CONFLICT(guild_id, user_id) DO UPDATE SET
+                message_count = excluded.message_count, voice_seconds = excluded.voice_seconds
+                WHERE message_count != excluded.message_count OR voice_seconds != excluded.voice_seconds
+            """, mismatched)
+            fixed += cursor.rowcount
+        if orphaned:
+            cursor = await conn.executemany("""
+                DELETE FROM user_activity_totals WHERE guild_id = ? AND user_id = ? AND NOT EXISTS (
+                    SELECT 1 FROM channel_activity
+                    WHERE channel_activity.guild_id = user_activity_totals.guild_id AND channel_activity.user_id = user_activity_totals.user_id
+                )
+            """, orphaned)
+            fixed += cursor.rowcount
+    if fixed:
+        log.warning(f"Reconciled {fixed} user activity totals that had drifted from channel_activity.")
+    return fixed
+
 async def get_top_text_channels(guild_id: int, limit: int = 5):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT channel_id, SUM(message_count) as total_msgs FROM channel_activity WHERE guild_id = ? GROUP BY channel_id ORDER BY total_msgs DESC LIMIT ?", (guild_id, limit))
         return await cursor.fetchall()
 
 async def get_top_voice_channels(guild_id: int, limit: int = 5):
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT channel_id, SUM(voice_seconds) as total_voice FROM channel_activity WHERE guild_id = ? GROUP BY channel_id ORDER BY total_voice DESC LIMIT ?", (guild_id, limit))
         return await cursor.fetchall()
     
-async def get_top_users_today(guild_id: int, limit: int = 5):
-    """Gets top users by activity in the last 24 hours."""
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+# Rollup windows for activity_buckets, in hours.
+ACTIVITY_PERIOD_HOURS = {"day": 24, "week": 24 * 7, "month": 24 * 30}
+
+async def get_top_users_for_period(guild_id: int, period: str = "day", limit: int = 5):
+    """Gets top users by activity within the last day, week or month."""
+    since_hour = _current_hour() - ACTIVITY_PERIOD_HOURS[period] + 1
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("""
-            SELECT user_id, SUM(message_count), SUM(voice_seconds) 
-            FROM channel_activity 
-            WHERE guild_id = ? AND last_updated >= datetime('now', '-1 day')
-            GROUP BY user_id 
-            ORDER BY SUM(message_count) DESC, SUM(voice_seconds) DESC 
+            SELECT user_id, SUM(message_count), SUM(voice_seconds)
+            FROM activity_buckets
+            WHERE guild_id = ? AND bucket_hour >= ?
+            GROUP BY user_id
+            ORDER BY SUM(message_count) DESC, SUM(voice_seconds) DESC
             LIMIT ?
-        """, (guild_id, limit))
+        """, (guild_id, since_hour, limit))
         return await cursor.fetchall()
+
+async def get_top_users_today(guild_id: int, limit: int = 5):
+    """Gets top users by activity in the last 24 hours."""
+    return await get_top_users_for_period(guild_id, "day", limit)
+
+async def compact_activity_buckets() -> int:
+    """Folds hourly activity buckets older than the configured age into one bucket per day.
+
+    The daily bucket is stored at the day's first hour. Returns the number of hourly rows removed.
+    """
+    cutoff_hour = (_current_hour() - config.BOT_CONFIG["ACTIVITY_BUCKET_COMPACT_AFTER_DAYS"] * 24) // 24 * 24
+    async with transaction() as conn:
+        await conn.execute("""
+            INSERT INTO activity_buckets (guild_id, bucket_hour, user_id, channel_id, message_count, voice_seconds)
+            SELECT guild_id, (bucket_hour / 24) * 24, user_id, channel_id, SUM(message_count), SUM(voice_seconds)
+            FROM activity_buckets
+            WHERE bucket_hour < ? AND bucket_hour % 24 != 0
+            GROUP BY guild_id, bucket_hour / 24, user_id, channel_id
+            ON CONFLICT(guild_id, bucket_hour, user_id, channel_id) DO UPDATE SET
+            message_count = message_count + excluded.message_count,
+            voice_seconds = voice_seconds + excluded.voice_seconds
+        """, (cutoff_hour,))
+        async with conn.execute("DELETE FROM activity_buckets WHERE bucket_hour < ? AND bucket_hour % 24 != 0", (cutoff_hour,)) as cursor:
+            removed = cursor.rowcount
+    return removed
     
 async def get_all_pending_tier_requests(guild_id: int):
     """Gets all pending tier approval requests for a guild."""
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("""
             SELECT user_id, next_tier, token, message_id 
             FROM tier_approval_requests 
@@ -789,25 +1463,21 @@ async def get_all_pending_tier_requests(guild_id: int):
 
 async def create_giveaway(guild_id: int, name: str, description: str) -> int:
     """Creates a new giveaway and returns its ID."""
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with transaction() as conn, conn.cursor() as cursor:
         await cursor.execute(
             "INSERT INTO giveaways (guild_id, name, description) VALUES (?, ?, ?)",
             (guild_id, name, description)
         )
-        await conn.commit()
         return cursor.lastrowid
 
 async def update_giveaway_message_id(guild_id: int, giveaway_id: int, message_id: int):
     """Updates the message ID for a giveaway."""
-    conn = await get_db_connection()
-    await conn.execute("UPDATE giveaways SET message_id = ? WHERE guild_id = ? AND id = ?", (message_id, guild_id, giveaway_id))
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute("UPDATE giveaways SET message_id = ? WHERE guild_id = ? AND id = ?", (message_id, guild_id, giveaway_id))
 
 async def get_active_giveaway(guild_id: int):
     """Gets the currently active giveaway for a guild."""
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT * FROM giveaways WHERE guild_id = ? AND is_active = 1", (guild_id,))
         row = await cursor.fetchone()
         if not row: return None
@@ -816,8 +1486,7 @@ async def get_active_giveaway(guild_id: int):
 
 async def get_giveaway(guild_id: int, giveaway_id: int):
     """Gets a specific giveaway by ID."""
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT * FROM giveaways WHERE guild_id = ? AND id = ?", (guild_id, giveaway_id))
         row = await cursor.fetchone()
         if not row: return None
@@ -827,38 +1496,34 @@ async def get_giveaway(guild_id: int, giveaway_id: int):
 
 async def end_giveaway(guild_id: int, giveaway_id: int, winner_id: int | None):
     """Ends a giveaway and sets the winner."""
-    conn = await get_db_connection()
-    await conn.execute(
-        "UPDATE giveaways SET is_active = 0, end_time = CURRENT_TIMESTAMP, winner_id = ? WHERE guild_id = ? AND id = ?",
-        (winner_id, guild_id, giveaway_id)
-    )
-    await conn.commit()
+    async with transaction() as conn:
+        await conn.execute(
+            "UPDATE giveaways SET is_active = 0, end_time = CURRENT_TIMESTAMP, winner_id = ? WHERE guild_id = ? AND id = ?",
+            (winner_id, guild_id, giveaway_id)
+        )
 
 async def add_giveaway_entrant(guild_id: int, giveaway_id: int, user_id: int) -> bool:
     """Adds a user to the giveaway entrants. Returns False if they already entered."""
-    conn = await get_db_connection()
     try:
-        await conn.execute(
-            "INSERT INTO giveaway_entrants (guild_id, giveaway_id, user_id) VALUES (?, ?, ?)",
-            (guild_id, giveaway_id, user_id)
-        )
-        await conn.commit()
+        async with transaction() as conn:
+            await conn.execute(
+                "INSERT INTO giveaway_entrants (guild_id, giveaway_id, user_id) VALUES (?, ?, ?)",
+                (guild_id, giveaway_id, user_id)
+            )
         return True
     except aiosqlite.IntegrityError:
         return False # User has already entered
 
 async def get_giveaway_entrants(guild_id: int, giveaway_id: int) -> list[int]:
     """Gets a list of user IDs who have entered a giveaway."""
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute("SELECT user_id FROM giveaway_entrants WHERE guild_id = ? AND giveaway_id = ?", (guild_id, giveaway_id))
         rows = await cursor.fetchall()
         return [row[0] for row in rows]
 
 async def has_user_submitted_since(guild_id: int, user_id: int, timestamp: str) -> bool:
     """Checks if a user has submitted a track since a given timestamp."""
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute(
             "SELECT 1 FROM music_submissions WHERE guild_id = ? AND user_id = ? AND submitted_at > ?",
             (guild_id, user_id, timestamp)
@@ -867,10 +1532,142 @@ async def has_user_submitted_since(guild_id: int, user_id: int, timestamp: str)
 
 async def has_verified_google_account(guild_id: int, user_id: int) -> bool:
     """Checks if a user has a verified Google account."""
-    conn = await get_db_connection()
-    async with conn.cursor() as cursor:
+    async with read_connection() as conn, conn.cursor() as cursor:
         await cursor.execute(
             "SELECT 1 FROM verification_links WHERE guild_id = ? AND user_id = ? AND status = 'verified' AND verified_account IS NOT NULL",
             (guild_id, user_id)
         )
-        return await cursor.fetchone() is not None
\ No newline at end of file
+        return await cursor.fetchone() is not None
+# --- USER PROFILE STORE ---
+# Last known name and avatar per user, so the web pages can show users the gateway cache doesn't have.
+# A row with a NULL name records a user Discord reported as unknown.
+async def upsert_user_profiles(profiles: list[tuple[int, Optional[str], Optional[str]]]):
+    """Stores (user_id, name, avatar_url) rows, stamped with the current time."""
+    if not profiles:
+        return
+    now = int(time.time())
+    async with transaction() as conn:
+        await conn.executemany("""
+            INSERT INTO user_profiles (user_id, name, avatar_url, fetched_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+            name = excluded.name, avatar_url = excluded.avatar_url, fetched_at = excluded.fetched_at
+        """, [(user_id, name, avatar_url, now) for user_id, name, avatar_url in profiles])
+
+async def get_user_profiles(user_ids) -> dict[int, dict]:
+    """Gets stored profiles for the given users, keyed by user_id. Users with no row are left out."""
+    user_ids = list(user_ids)
+    profiles = {}
+    async with read_connection() as conn, conn.cursor() as cursor:
+        # Chunked to stay under SQLite's bound-parameter limit.
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            placeholders = ','.join('?' for _ in chunk)
+            await cursor.execute(f"SELECT user_id, name, avatar_url, fetched_at FROM user_profiles WHERE user_id IN ({placeholders})", chunk)
+            for user_id, name, avatar_url, fetched_at in await cursor.fetchall():
+                profiles[user_id] = {"name": name, "avatar_url": avatar_url, "fetched_at": fetched_at}
+    return profiles
+
+async def get_stale_user_profile_ids(max_age_seconds: int, limit: int) -> list[int]:
+    """Gets the users whose stored profile is oldest, if it is older than max_age_seconds."""
+    async with read_connection() as conn, conn.cursor() as cursor:
+        await cursor.execute(
+            "SELECT user_id FROM user_profiles WHERE fetched_at < ? ORDER BY fetched_at LIMIT ?",
+            (int(time.time()) - max_age_seconds, limit)
+        )
+        return [row[0] for row in await cursor.fetchall()]
+
+# --- QUERY PLAN CHECK ---
+# Functions whose queries are expected to read a whole table.
+FULL_SCAN_ALLOWED: set[str] = {
+    "load_rank_index", "load_all_settings", "get_all_bad_words", "compact_activity_buckets",
+    "reconcile_user_activity_totals", "_migration_user_activity_totals",
+}
+# Stand-ins for variables interpolated into SQL as column names, so those queries can be explained.
+# Any other interpolation is a placeholder list and becomes a single parameter.
+QUERY_PLAN_IDENTIFIERS: dict[str, str] = {"cosmetic_type": "leaderboard_emoji"}
+
+def _sql_part(part) -> str:
+    if isinstance(part, ast.Constant):
+        return part.value
+    if isinstance(part.value, ast.Name) and part.value.id in QUERY_PLAN_IDENTIFIERS:
+        return QUERY_PLAN_IDENTIFIERS[part.value.id]
+    return "?"
+
+def _collect_module_queries() -> list[tuple[str, str]]:
+    """Finds every SQL statement this module passes to execute()/executemany(), with its function name."""
+    tree = ast.parse(inspect.getsource(sys.modules[__name__]))
+    queries = []
+    for func in ast.walk(tree):
+        if not isinstance(func, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for node in ast.walk(func):
+            if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                    and node.func.attr in ("execute", "executemany") and node.args):
+                continue
+            arg = node.args[0]
+            if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                sql = arg.value
+            elif isinstance(arg, ast.JoinedStr):
+                # f-strings only interpolate placeholder lists or column names.
+                sql = "".join(_sql_part(part) for part in arg.values)
+            else:
+                continue
+            sql = " ".join(sql.split())
+            if sql.split(" ", 1)[0].upper() in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+                queries.append((func.name, sql))
+    return queries
+
+def _is_full_scan(step: str) -> bool:
+    """Whether an EXPLAIN QUERY PLAN step reads a whole table: "SCAN x" on SQLite 3.36+, "SCAN TABLE x [AS y]" before."""
+    return re.fullmatch(r"SCAN (?:TABLE )?\w+(?: AS \w+)?", step) is not None
+
+async def check_query_plans() -> tuple[list[dict], list[dict]]:
+    """Runs EXPLAIN QUERY PLAN on every query in this module.
+
+    Returns (full_scans, failures): queries that fall back to a full table scan, and queries
+    that fail to prepare (a missing table or column, or an interpolation with no stand-in).
+    Both fail the check.
+    """
+    conn = await get_db_connection()
+    full_scans, failures = [], []
+    for func_name, sql in _collect_module_queries():
+        try:
+            async with conn.execute(f"EXPLAIN QUERY PLAN {sql}", [None] * sql.count("?")) as cursor:
+                plan = [row[3] for row in await cursor.fetchall()]
+        except Exception as e:
+            failures.append({"function": func_name, "query": sql, "error": str(e)})
+            continue
+        scans = [step for step in plan if _is_full_scan(step)]
+        if scans and func_name not in FULL_SCAN_ALLOWED:
+            full_scans.append({"function": func_name, "query": sql, "plan": plan})
+    return full_scans, failures
+
+async def _print_pending_migrations():
+    if not await initialize_database(dry_run=True):
+        print("No pending migrations.")
+    await close_database()
+
+async def _run_query_plan_check() -> int:
+    await initialize_database()
+    full_scans, failures = await check_query_plans()
+    for item in failures:
+        print(f"FAILED  {item['function']}: {item['error']}\n    {item['query']}")
+    for item in full_scans:
+        print(f"FULL SCAN  {item['function']}: {' | '.join(item['plan'])}\n    {item['query']}")
+    print(f"{len(full_scans)} full table scan(s), {len(failures)} failed to prepare.")
+    await close_database()
+    return 1 if full_scans or failures else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database maintenance commands.")
+    parser.add_argument("--db", default=DB_FILE, help="Path to the SQLite database file.")
+    parser.add_argument("--dry-run", action="store_true", help="Print the pending schema migrations without applying them.")
+    parser.add_argument("--check-plans", action="store_true", help="Fail if any query in database.py does a full table scan or fails to prepare.")
+    args = parser.parse_args()
+    DB_FILE = args.db
+    if args.dry_run:
+        asyncio.run(_print_pending_migrations())
+    elif args.check_plans:
+        sys.exit(asyncio.run(_run_query_plan_check()))
+    else:
+        parser.print_help()
@@ -0,0 +1,131 @@
+import asyncio
+import importlib.util
+import logging
+import random
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import httpx
+
+import config
+
+log = logging.getLogger(__name__)
+
+# httpx only negotiates HTTP/2 when the h2 package from the httpx[http2] extra is installed.
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Errors raised before the request could have reached the server. Only these are safe to retry for POSTs,
+# since OAuth code exchanges are single-use.
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+class UpstreamClient:
+    """One keep-alive httpx client shared by every outbound call the web server makes.
+
+    Requests to the same host are capped by a semaphore, failed requests are retried with
+    jittered backoff, and per-host latency and concurrency are recorded for get_stats().
+    """
+    def __init__(self):
+        self.client: httpx.AsyncClient | None = None
+        self.host_limits: dict[str, asyncio.Semaphore] = {}
+        self.stats = defaultdict(lambda: {
+            "requests": 0, "errors": 0, "retries": 0, "in_flight": 0, "max_in_flight": 0,
+            "waits": 0, "total_latency_seconds": 0.0, "max_latency_seconds": 0.0
+        })
+
+    async def start(self):
+        if self.client is not None:
+            return
+        cfg = config.BOT_CONFIG
+        self.client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(cfg["HTTP_TIMEOUT_SECONDS"], connect=cfg["HTTP_CONNECT_TIMEOUT_SECONDS"]),
+            limits=httpx.Limits(
+                max_connections=cfg["HTTP_MAX_CONNECTIONS"],
+                max_keepalive_connections=cfg["HTTP_MAX_CONNECTIONS"],
+                keepalive_expiry=cfg["HTTP_KEEPALIVE_SECONDS"]
+            )
+        )
+        if HTTP2_AVAILABLE:
+            log.info("Started shared HTTP client (HTTP/2 enabled).")
+        else:
+            log.warning("Started shared HTTP client without HTTP/2: the h2 package is missing, install httpx[http2].")
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def _host_limit(self, host: str) -> asyncio.Semaphore:
+        if host not in self.host_limits:
+            self.host_limits[host] = asyncio.Semaphore(config.BOT_CONFIG["HTTP_MAX_CONNECTIONS_PER_HOST"])
+        return self.host_limits[host]
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Sends a request through the shared pool, retrying transient failures."""
+        if self.client is None:
+            await self.start()
+        host = urlsplit(url).netloc
+        stats = self.stats[host]
+        limit = self._host_limit(host)
+        retries = config.BOT_CONFIG["HTTP_RETRIES"]
+        idempotent = method.upper() in ("GET", "HEAD", "OPTIONS")
+
+        for attempt in range(retries + 1):
+            if limit.locked():
+                stats["waits"] += 1
+            async with limit:
+                stats["requests"] += 1
+                stats["in_flight"] += 1
+                stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+                start = time.perf_counter()
+                try:
+                    response = await self.client.request(method, url, **kwargs)
+                except httpx.TransportError as e:
+                    stats["errors"] += 1
+                    retryable = isinstance(e, CONNECT_ERRORS) or (idempotent and isinstance(e, httpx.TimeoutException))
+                    if not retryable or attempt == retries:
+                        raise
+                    log.warning(f"{method} {host} failed ({e!r}), retrying.")
+                    response = None
+                finally:
+                    elapsed = time.perf_counter() - start
+                    stats["in_flight"] -= 1
+                    stats["total_latency_seconds"] += elapsed
+                    stats["max_latency_seconds"] = max(stats["max_latency_seconds"], elapsed)
+
+            if response is not None:
+                if not (idempotent and response.status_code in RETRYABLE_STATUS) or attempt == retries:
+                    return response
+                stats["errors"] += 1
+                log.warning(f"{method} {host} returned {response.status_code}, retrying.")
+            stats["retries"] += 1
+            await asyncio.sleep(random.uniform(0, config.BOT_CONFIG["HTTP_RETRY_BACKOFF_SECONDS"] * 2 ** attempt))
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    def get_stats(self) -> dict:
+        """Returns per-host request counts, latency and connection usage."""
+        hosts = {}
+        for host, stats in self.stats.items():
+            hosts[host] = {
+                "requests": stats["requests"],
+                "errors": stats["errors"],
+                "retries": stats["retries"],
+                "in_flight": stats["in_flight"],
+                "max_in_flight": stats["max_in_flight"],
+                "waits": stats["waits"],
+                "avg_latency_ms": (stats["total_latency_seconds"] / stats["requests"]) * 1000 if stats["requests"] else 0.0,
+                "max_latency_ms": stats["max_latency_seconds"] * 1000
+            }
+        return {
+            "http2": HTTP2_AVAILABLE,
+            "max_connections": config.BOT_CONFIG["HTTP_MAX_CONNECTIONS"],
+            "max_connections_per_host": config.BOT_CONFIG["HTTP_MAX_CONNECTIONS_PER_HOST"],
+            "hosts": hosts
+        }
@@ -0,0 +1,318 @@
+"""Local message bus between the bot process and its web worker processes.
+
+Messages are JSON objects sent as length-prefixed frames over a Unix socket. The bot runs the
+IPCServer and every web worker connects an IPCClient to it. Workers send requests that a handler
+in the bot answers, and either side can publish to a topic the other side has subscribed to.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import struct
+import time
+from collections import defaultdict
+
+import config
+
+log = logging.getLogger(__name__)
+
+HEADER = struct.Struct(">I")
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+
+class IPCError(Exception):
+    """A request failed in the bot, timed out, or the bus is not connected."""
+
+def encode_frame(message: dict) -> bytes:
+    payload = json.dumps(message, separators=(",", ":")).encode()
+    return HEADER.pack(len(payload)) + payload
+
+async def read_frame(reader: asyncio.StreamReader) -> dict:
+    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if length > MAX_FRAME_BYTES:
+        raise IPCError(f"Frame of {length} bytes is over the limit")
+    return json.loads(await reader.readexactly(length))
+
+class Peer:
+    """One end of a bus connection. Frames are queued without waiting and written by the peer's own task."""
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=config.BOT_CONFIG["IPC_SEND_QUEUE_SIZE"])
+        self.topics: set[str] = set()
+        self.write_task = asyncio.create_task(self._write())
+
+    def send_frame(self, frame: bytes) -> bool:
+        """Queues an encoded frame. Returns False if the peer has fallen too far behind to take it."""
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def send(self, message: dict) -> bool:
+        return self.send_frame(encode_frame(message))
+
+    async def _write(self):
+        try:
+            while True:
+                self.writer.write(await self.queue.get())
+                await self.writer.drain()
+        except (ConnectionError, OSError):
+            # The read loop sees the connection go too, and cleans up.
+            self.writer.close()
+
+    async def close(self):
+        self.write_task.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+class IPCServer:
+    """The bot's end of the bus: answers worker requests and routes published messages between processes."""
+    def __init__(self, path: str):
+        self.path = path
+        self.server: asyncio.AbstractServer | None = None
+        self.handlers: dict[str, callable] = {}
+        self.listeners: defaultdict[str, list] = defaultdict(list)
+        self.peers: set[Peer] = set()
+        self.subscribers: defaultdict[str, set[Peer]] = defaultdict(set)
+        self.requests: set[asyncio.Task] = set()
+        self.stats = {"requests": 0, "request_errors": 0, "published": 0, "delivered": 0, "received": 0, "dropped_peers": 0}
+
+    def add_handler(self, method: str, handler):
+        """Answers requests for `method` with `await handler(**params)`. The result must be JSON-serializable."""
+        self.handlers[method] = handler
+
+    def add_listener(self, topic: str, callback):
+        """Calls callback(data) in the bot for every message a worker publishes to `topic`."""
+        self.listeners[topic].append(callback)
+
+    def has_subscribers(self, topic: str) -> bool:
+        return bool(self.subscribers.get(topic))
+
+    async def start(self):
+        if os.path.exists(self.path):
+            # Left behind by a bot that didn't shut down cleanly.
+            os.remove(self.path)
+        self.server = await asyncio.start_unix_server(self._serve_peer, path=self.path)
+        os.chmod(self.path, 0o600)
+        log.info(f"IPC server listening on {self.path}.")
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+        for peer in list(self.peers):
+            await peer.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def publish(self, topic: str, data, exclude: Peer | None = None):
+        """Sends a message to every worker subscribed to the topic, encoding it once for all of them."""
+        peers = self.subscribers.get(topic)
+        if not peers:
+            return
+        frame = encode_frame({"op": "pub", "topic": topic, "data": data})
+        self.stats["published"] += 1
+        for peer in list(peers):
+            if peer is exclude:
+                continue
+            if peer.send_frame(frame):
+                self.stats["delivered"] += 1
+            else:
+                # A worker that can't keep up is cut off; it reconnects and its widgets resync.
+                log.warning("Dropping IPC peer that fell too far behind.")
+                self.stats["dropped_peers"] += 1
+                self._drop_peer(peer)
+                asyncio.create_task(peer.close())
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = Peer(reader, writer)
+        self.peers.add(peer)
+        try:
+            while True:
+                self._dispatch(peer, await read_frame(reader))
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        except Exception as e:
+            log.error(f"Closing IPC peer after a bad frame: {e}")
+        finally:
+            self._drop_peer(peer)
+            await peer.close()
+
+    def _drop_peer(self, peer: Peer):
+        self.peers.discard(peer)
+        for topic in peer.topics:
+            if peers := self.subscribers.get(topic):
+                peers.discard(peer)
+                if not peers:
+                    del self.subscribers[topic]
+        peer.topics.clear()
+
+    def _dispatch(self, peer: Peer, message: dict):
+        op = message.get("op")
+        if op == "req":
+            # Requests are answered concurrently, so one slow lookup doesn't hold up the rest.
+            task = asyncio.create_task(self._answer(peer, message))
+            self.requests.add(task)
+            task.add_done_callback(self.requests.discard)
+        elif op == "pub":
+            self.stats["received"] += 1
+            self._deliver(message["topic"], message.get("data"), peer)
+        elif op == "sub":
+            peer.topics.add(message["topic"])
+            self.subscribers[message["topic"]].add(peer)
+        elif op == "unsub":
+            peer.topics.discard(message["topic"])
+            if peers := self.subscribers.get(message["topic"]):
+                peers.discard(peer)
+                if not peers:
+                    del self.subscribers[message["topic"]]
+
+    async def _answer(self, peer: Peer, message: dict):
+        self.stats["requests"] += 1
+        reply = {"op": "rep", "id": message["id"]}
+        handler = self.handlers.get(message.get("method"))
+        try:
+            if handler is None:
+                raise IPCError(f"Unknown method {message.get('method')!r}")
+            reply["result"] = await handler(**message.get("params", {}))
+        except Exception as e:
+            self.stats["request_errors"] += 1
+            log.error(f"IPC request {message.get('method')!r} failed: {e}", exc_info=not isinstance(e, IPCError))
+            reply["error"] = f"{type(e).__name__}: {e}"
+        peer.send(reply)
+
+    def _deliver(self, topic: str, data, origin: Peer):
+        for callback in self.listeners.get(topic, ()):
+            try:
+                callback(data)
+            except Exception as e:
+                log.error(f"IPC listener {callback!r} failed for {topic}: {e}")
+        self.publish(topic, data, exclude=origin)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "peers": len(self.peers), "topics": len(self.subscribers), "in_flight": len(self.requests)}
+
+class IPCClient:
+    """A web worker's end of the bus. Reconnects on its own, and subscriptions survive the reconnect."""
+    def __init__(self, path: str):
+        self.path = path
+        self.timeout = config.BOT_CONFIG["IPC_REQUEST_TIMEOUT_SECONDS"]
+        self.peer: Peer | None = None
+        self.connected = asyncio.Event()
+        self.ids = itertools.count(1)
+        self.pending: dict[int, asyncio.Future] = {}
+        self.subscriptions: dict[str, callable] = {}
+        self.task: asyncio.Task | None = None
+        self.stats = {"requests": 0, "request_errors": 0, "request_seconds": 0.0, "published": 0, "not_connected": 0, "received": 0, "connects": 0}
+
+    async def start(self):
+        """Starts the connection loop and waits for the first connection."""
+        self.task = asyncio.create_task(self._run())
+        await self.connected.wait()
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        if self.peer is not None:
+            await self.peer.close()
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except (ConnectionError, FileNotFoundError, OSError):
+                # The bot isn't listening yet, or is restarting.
+                await asyncio.sleep(0.5)
+                continue
+            self.peer = Peer(reader, writer)
+            for topic in self.subscriptions:
+                self.peer.send({"op": "sub", "topic": topic})
+            self.stats["connects"] += 1
+            self.connected.set()
+            try:
+                while True:
+                    self._dispatch(await read_frame(reader))
+            except (asyncio.IncompleteReadError, ConnectionError, OSError):
+                log.warning("Lost the IPC connection to the bot; reconnecting.")
+            finally:
+                self.connected.clear()
+                await self.peer.close()
+                self.peer = None
+                for future in self.pending.values():
+                    if not future.done():
+                        future.set_exception(IPCError("Disconnected from the bot"))
+                self.pending.clear()
+
+    def _dispatch(self, message: dict):
+        op = message.get("op")
+        if op == "rep":
+            future = self.pending.pop(message["id"], None)
+            if future is None or future.done():
+                return
+            if "error" in message:
+                future.set_exception(IPCError(message["error"]))
+            else:
+                future.set_result(message.get("result"))
+        elif op == "pub":
+            self.stats["received"] += 1
+            callback = self.subscriptions.get(message["topic"])
+            if callback is None:
+                return
+            try:
+                callback(message.get("data"))
+            except Exception as e:
+                log.error(f"IPC subscriber failed for {message['topic']}: {e}")
+
+    async def request(self, method: str, **params):
+        """Calls a handler in the bot and returns its result. Raises IPCError if it fails or takes too long."""
+        started = time.perf_counter()
+        self.stats["requests"] += 1
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            await asyncio.wait_for(self.connected.wait(), self.timeout)
+            if not self.peer.send({"op": "req", "id": request_id, "method": method, "params": params}):
+                raise IPCError("IPC send queue is full")
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.stats["request_errors"] += 1
+            raise IPCError(f"IPC request {method!r} timed out") from None
+        except IPCError:
+            self.stats["request_errors"] += 1
+            raise
+        finally:
+            self.pending.pop(request_id, None)
+            self.stats["request_seconds"] += time.perf_counter() - started
+
+    def publish(self, topic: str, data) -> bool:
+        """Sends a message to the bot and any other subscribed worker. Returns False if it couldn't be sent."""
+        if self.peer is None or not self.connected.is_set() or not self.peer.send({"op": "pub", "topic": topic, "data": data}):
+            self.stats["not_connected"] += 1
+            return False
+        self.stats["published"] += 1
+        return True
+
+    def subscribe(self, topic: str, callback):
+        """Calls callback(data) for every message published to the topic. One callback per topic."""
+        self.subscriptions[topic] = callback
+        if self.connected.is_set():
+            self.peer.send({"op": "sub", "topic": topic})
+
+    def unsubscribe(self, topic: str):
+        if self.subscriptions.pop(topic, None) is not None and self.connected.is_set():
+            self.peer.send({"op": "unsub", "topic": topic})
+
+    def get_stats(self) -> dict:
+        requests = self.stats["requests"]
+        return {
+            **self.stats,
+            "connected": self.connected.is_set(),
+            "in_flight": len(self.pending),
+            "subscriptions": len(self.subscriptions),
+            "avg_request_ms": self.stats["request_seconds"] * 1000 / requests if requests else 0.0
+        }
@@ -4,11 +4,14 @@ import os
 import logging
 from dotenv import load_dotenv
 import asyncio
+import sys
 
 # --- Bot Components ---
 import database
 import config
 from web_server import app
+from ipc import IPCServer
+from bot_gateway import LocalBotGateway, WidgetBusPublisher, serve_gateway
 from cogs.verification import VerificationButton
 from cogs.reporting import ReportTriggerView
 # --- ADD THIS ---
@@ -31,16 +34,26 @@ class MyBot(commands.Bot):
     def __init__(self, *, intents: discord.Intents):
         super().__init__(command_prefix="!", intents=intents)
         self.action_queue = asyncio.Queue()
+        self.ipc_server = None
+        self.web_workers: list[asyncio.Task] = []
 
     async def setup_hook(self):
 
-        app.bot_instance = self
+        app.gateway = LocalBotGateway(self)
+        self.app = app
 
-        port = int(os.getenv("SERVER_PORT", os.getenv("PORT", 8080)))
-        self.loop.create_task(app.run_task(host='0.0.0.0', port=port))
-        log.info(f"Started background web server task on port {port}.")
-        
         await database.initialize_database()
+        await database.load_rank_index()
+        await database.load_all_settings()
+
+        # Started once the schema is current, since web workers' database requests are answered straight away.
+        port = int(os.getenv("SERVER_PORT", os.getenv("PORT", 8080)))
+        web_workers = int(os.getenv("WEB_WORKERS", config.BOT_CONFIG["WEB_WORKERS"]))
+        if web_workers > 0:
+            await self.start_web_workers(web_workers, port)
+        else:
+            self.loop.create_task(app.run_task(host='0.0.0.0', port=port))
+            log.info(f"Started background web server task on port {port}.")
         
         self.add_view(ReportTriggerView(bot=self))
         self.add_view(VerificationButton(bot=self))
@@ -58,7 +71,8 @@ class MyBot(commands.Bot):
             "cogs.verification", "cogs.reaction_roles", "cogs.reporting",
             "cogs.temp_vc", "cogs.submissions", "cogs.tasks", "cogs.ranking",
             "cogs.shop", "cogs.utility", "cogs.inventory", "cogs.customize",
-            "cogs.tier_system", "cogs.panel_handler", "cogs.giveaway"
+            "cogs.tier_system", "cogs.panel_handler", "cogs.giveaway", "cogs.profiles",
+            "cogs.member_index"
         ]
         for cog in cogs_to_load:
             try:
@@ -71,6 +85,44 @@ class MyBot(commands.Bot):
         synced = await self.tree.sync()
         log.info(f"Synced {len(synced)} commands globally.")
         
+    async def start_web_workers(self, count: int, port: int):
+        """Serves the web app from `count` worker processes sharing the port, answering them over the IPC bus."""
+        self.ipc_server = IPCServer(config.BOT_CONFIG["IPC_SOCKET_PATH"])
+        serve_gateway(self.ipc_server, app.gateway)
+        await self.ipc_server.start()
+        # Widget state stays in the bot; its updates go out over the bus to whichever workers hold the connections.
+        app.widget_updates.publisher = WidgetBusPublisher(self.ipc_server)
+        for worker_id in range(count):
+            self.web_workers.append(asyncio.create_task(self._run_web_worker(worker_id, port)))
+        log.info(f"Started {count} web worker processes on port {port}.")
+
+    async def _run_web_worker(self, worker_id: int, port: int):
+        """Keeps one web worker process running, restarting it if it exits."""
+        worker_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "web_worker.py")
+        while True:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, worker_script, "--port", str(port), "--worker-id", str(worker_id)
+            )
+            try:
+                returncode = await process.wait()
+            except asyncio.CancelledError:
+                process.terminate()
+                await process.wait()
+                raise
+            log.warning(f"Web worker {worker_id} exited with code {returncode}; restarting it.")
+            await asyncio.sleep(1)
+
+    async def close(self):
+        # Write out any buffered activity before the connection goes away.
+        await database.flush_channel_activity()
+        for task in self.web_workers:
+            task.cancel()
+        await asyncio.gather(*self.web_workers, return_exceptions=True)
+        if self.ipc_server is not None:
+            await self.ipc_server.close()
+        await super().close()
+        await database.close_database()
+
     async def on_ready(self):
         log.info(f"Logged in as {self.user} (ID: {self.user.id})")
         log.info("Bot is ready! 🚀")
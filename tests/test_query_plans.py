@@ -0,0 +1,37 @@
+"""Runs database.check_query_plans against a freshly migrated database.
+
+Run from the repository root:  python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import database
+
+class QueryPlanTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(setattr, database, "DB_FILE", database.DB_FILE)
+        database.DB_FILE = os.path.join(directory.name, "bot_database.db")
+        await database.initialize_database()
+
+    async def asyncTearDown(self):
+        await database.close_database()
+
+    async def test_queries_prepare_and_use_indexes(self):
+        full_scans, failures = await database.check_query_plans()
+        self.assertEqual(failures, [], "queries that fail to prepare")
+        self.assertEqual(full_scans, [], "queries that scan a whole table outside FULL_SCAN_ALLOWED")
+
+    async def test_unpreparable_query_fails_the_check(self):
+        queries = database._collect_module_queries() + [("broken", "SELECT * FROM no_such_table WHERE id = ?")]
+        with mock.patch.object(database, "_collect_module_queries", return_value=queries):
+            full_scans, failures = await database.check_query_plans()
+        self.assertEqual([failure["function"] for failure in failures], ["broken"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,21 +1,21 @@
 from quart import Quart, request, render_template, abort, websocket, flash, redirect, url_for, jsonify, make_response, session
-import discord
 import os
-import httpx
-import aiosqlite
 from dotenv import load_dotenv
 import asyncio
 import logging
 import json
 import secrets
-import utils
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from urllib.parse import urlencode
 import time
+import hashlib
+import base64
+from werkzeug.http import http_date, parse_date
 import config
 
 import database
 from cogs.ranking import get_rank_info
+from http_client import UpstreamClient
 
 load_dotenv()
 
@@ -23,15 +23,12 @@ app = Quart(__name__, static_folder='static', static_url_path='/static')
 log = logging.getLogger(__name__)
 
 app.secret_key = os.getenv("QUART_SECRET_KEY")
-
-user_cache = {}
-cache_lock = asyncio.Lock()
-CACHE_DURATION_SECONDS = 300 # Cache users for 5 minutes
-
-# --- Caching Setup ---
-web_cache = {}
-CACHE_EXPIRATION = 120  # 2 minutes
-# ---------------------
+# How routes reach the bot: a bot_gateway.LocalBotGateway in the bot's process, or a RemoteBotGateway in a
+# web worker. Set by main.py or web_worker.py before serving.
+app.gateway = None
+# How routes reach the database: this module in the bot's process, or a bot_gateway.RemoteDatabase in a web
+# worker, which has the bot run each call so that only the bot ever opens the database file.
+app.db = database
 
 # --- CONFIGURATION & GLOBALS ---
 APP_BASE_URL = os.getenv("APP_BASE_URL", "http://127.0.0.1:5000")
@@ -39,17 +36,35 @@ TWITCH_CLIENT_ID = os.getenv("TWITCH_CLIENT_ID")
 TWITCH_CLIENT_SECRET = os.getenv("TWITCH_CLIENT_SECRET")
 YOUTUBE_CLIENT_ID = os.getenv("YOUTUBE_CLIENT_ID")
 YOUTUBE_CLIENT_SECRET = os.getenv("YOUTUBE_CLIENT_SECRET")
-DB_FILE = "bot_database.db"
 
 # --- NEW: Discord OAuth2 Credentials ---
 DISCORD_CLIENT_ID = os.getenv("DISCORD_CLIENT_ID")
 DISCORD_CLIENT_SECRET = os.getenv("DISCORD_CLIENT_SECRET")
 DISCORD_REDIRECT_URI = f"{APP_BASE_URL}/callback"
-DISCORD_API_BASE_URL = "https://discord.com/api"
+DISCORD_API_BASE_URL = os.getenv("DISCORD_API_BASE_URL", "https://discord.com/api")
 
 TWITCH_REDIRECT_URI = f"{APP_BASE_URL}/callback/twitch"
 YOUTUBE_REDIRECT_URI = f"{APP_BASE_URL}/callback/youtube"
 
+# Upstream OAuth endpoints. Overridable so the callbacks can be pointed at a local stub server.
+TWITCH_OAUTH_BASE_URL = os.getenv("TWITCH_OAUTH_BASE_URL", "https://id.twitch.tv/oauth2")
+TWITCH_API_BASE_URL = os.getenv("TWITCH_API_BASE_URL", "https://api.twitch.tv/helix")
+GOOGLE_OAUTH_BASE_URL = os.getenv("GOOGLE_OAUTH_BASE_URL", "https://oauth2.googleapis.com")
+GOOGLE_API_BASE_URL = os.getenv("GOOGLE_API_BASE_URL", "https://www.googleapis.com/oauth2/v2")
+
+# Bearer token for /api/v1/metrics. The endpoint is disabled unless this is set.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+upstream = UpstreamClient()
+
+@app.before_serving
+async def start_upstream_client():
+    await upstream.start()
+
+@app.after_serving
+async def close_upstream_client():
+    await upstream.close()
+
 from functools import wraps
 
 def login_required(f):
@@ -66,95 +81,572 @@ def login_required(f):
     return decorated_function
 
 # --- WebSocket Connection Manager ---
+WS_CLOSE_SLOW_CONSUMER = 1013  # "Try Again Later": the widget reconnects and starts over from a fresh snapshot.
+
+class WebSocketConnection:
+    """One widget connection: a bounded queue of serialized messages, drained by its own writer task."""
+    def __init__(self, manager: "WebSocketManager", guild_id: int, ws_conn):
+        self.manager = manager
+        self.guild_id = guild_id
+        self.ws_conn = ws_conn
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=config.BOT_CONFIG["WS_SEND_QUEUE_SIZE"])
+        self.writer = asyncio.create_task(self._write())
+
+    def enqueue(self, message_json: str) -> bool:
+        """Queues a message without waiting. Returns False if the queue is full."""
+        try:
+            self.queue.put_nowait(message_json)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _write(self):
+        send_timeout = config.BOT_CONFIG["WS_SEND_TIMEOUT_SECONDS"]
+        while True:
+            message_json = await self.queue.get()
+            try:
+                await asyncio.wait_for(self.ws_conn.send(message_json), send_timeout)
+            except asyncio.TimeoutError:
+                self.manager.evict(self, "send timed out")
+                return
+            except Exception as e:
+                log.info(f"WebSocket send failed for Guild ID: {self.guild_id}: {e}")
+                self.manager.stats["send_errors"] += 1
+                self.manager.discard(self)
+                return
+            self.manager.stats["sent"] += 1
+
+    async def close(self, code: int, reason: str):
+        if self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        try:
+            await asyncio.wait_for(self.ws_conn.close(code, reason), config.BOT_CONFIG["WS_SEND_TIMEOUT_SECONDS"])
+        except Exception:
+            pass
+
 class WebSocketManager:
     def __init__(self):
-        self.active_connections: dict[int, set] = defaultdict(set)
+        self.active_connections: dict[int, set[WebSocketConnection]] = defaultdict(set)
+        self.closing: set[asyncio.Task] = set()
+        self.stats = {"broadcasts": 0, "enqueued": 0, "sent": 0, "send_errors": 0, "evicted": 0}
         log.info("WebSocketManager initialized.")
 
-    async def register(self, guild_id: int, ws_conn):
-        self.active_connections[guild_id].add(ws_conn)
+    async def register(self, guild_id: int, ws_conn) -> WebSocketConnection:
+        connection = WebSocketConnection(self, guild_id, ws_conn)
+        if not self.active_connections.get(guild_id):
+            # In a web worker this is what has the bot send the guild's widget messages here.
+            app.gateway.watch_widget(guild_id, lambda message: self.broadcast_nowait(guild_id, message))
+        self.active_connections[guild_id].add(connection)
         log.info(f"New WebSocket connection registered for Guild ID: {guild_id}. Total: {len(self.active_connections[guild_id])}")
+        return connection
 
-    async def unregister(self, guild_id: int, ws_conn):
-        if ws_conn in self.active_connections[guild_id]:
-            self.active_connections[guild_id].remove(ws_conn)
+    async def unregister(self, guild_id: int, connection: WebSocketConnection):
+        connection.writer.cancel()
+        if connection in self.active_connections[guild_id]:
+            self.discard(connection)
             log.info(f"WebSocket connection unregistered for Guild ID: {guild_id}. Remaining: {len(self.active_connections[guild_id])}")
 
+    def discard(self, connection: WebSocketConnection):
+        connections = self.active_connections.get(connection.guild_id)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self.active_connections[connection.guild_id]
+                app.gateway.unwatch_widget(connection.guild_id)
+
+    def evict(self, connection: WebSocketConnection, reason: str):
+        """Drops a connection that can't keep up and closes it in the background."""
+        self.discard(connection)
+        self.stats["evicted"] += 1
+        log.warning(f"Evicting slow WebSocket consumer for Guild ID: {connection.guild_id}: {reason}")
+        task = asyncio.create_task(connection.close(WS_CLOSE_SLOW_CONSUMER, "Too far behind"))
+        self.closing.add(task)
+        task.add_done_callback(self.closing.discard)
+
+    def has_listeners(self, guild_id: int) -> bool:
+        return bool(self.active_connections.get(guild_id))
+
     async def broadcast(self, guild_id: int, message: dict):
-        if guild_id in self.active_connections:
-            message_json = json.dumps(message)
-            connections = list(self.active_connections[guild_id])
-            for ws_conn in connections:
-                try:
-                    await ws_conn.send(message_json)
-                except Exception:
-                    pass
-    
+        self.broadcast_nowait(guild_id, message)
+
+    def broadcast_nowait(self, guild_id: int, message: dict):
+        """Serializes the message once and queues it on every connection of the guild, without waiting on any of them."""
+        connections = self.active_connections.get(guild_id)
+        if not connections:
+            return
+        message_json = json.dumps(message)
+        self.stats["broadcasts"] += 1
+        for connection in list(connections):
+            if connection.enqueue(message_json):
+                self.stats["enqueued"] += 1
+            else:
+                self.evict(connection, "send queue full")
+
+    def get_stats(self) -> dict:
+        depths = [connection.queue.qsize() for connections in self.active_connections.values() for connection in connections]
+        return {
+            **self.stats,
+            "guilds": len(self.active_connections),
+            "connections": len(depths),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0)
+        }
+
 ws_manager = WebSocketManager()
 app.ws_manager = ws_manager
 
+def _escape_pointer(key) -> str:
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+def diff_documents(old, new, path: str = "") -> list[dict]:
+    """JSON-patch-style operations (add, remove, replace) that turn `old` into `new`.
+
+    Objects are compared key by key and lists of equal length item by item; anything else that
+    differs is replaced whole.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = [{"op": "remove", "path": f"{path}/{_escape_pointer(key)}"} for key in sorted(old.keys() - new.keys(), key=str)]
+        for key, value in new.items():
+            child_path = f"{path}/{_escape_pointer(key)}"
+            if key in old:
+                ops.extend(diff_documents(old[key], value, child_path))
+            else:
+                ops.append({"op": "add", "path": child_path, "value": value})
+        return ops
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        ops = []
+        for index, (old_item, new_item) in enumerate(zip(old, new)):
+            ops.extend(diff_documents(old_item, new_item, f"{path}/{index}"))
+        return ops
+    if type(old) is type(new) and old == new:
+        return []
+    return [{"op": "replace", "path": path, "value": new}]
+
+class WidgetState:
+    """The last widget document sent for a guild, with a version that goes up by one on every change."""
+    def __init__(self):
+        self.version = 0
+        self.document: dict = {}
+        # The change generation the document was built at and when; see WidgetUpdateCoalescer.get_snapshot.
+        self.generation = -1
+        self.built_at = 0.0
+        self._snapshot_json: str | None = None
+
+    def update(self, document: dict) -> dict | None:
+        """Moves to a new document. Returns the delta message for connected widgets, or None if nothing changed."""
+        ops = diff_documents(self.document, document)
+        if not ops:
+            return None
+        self.document = document
+        self.version += 1
+        self._snapshot_json = None
+        return {"type": "delta", "base": self.version - 1, "version": self.version, "ops": ops}
+
+    def snapshot(self) -> dict:
+        return {"type": "full_update", "version": self.version, **self.document}
+
+    def snapshot_json(self) -> str:
+        """The serialized snapshot, built once per version and shared by every connection."""
+        if self._snapshot_json is None:
+            self._snapshot_json = json.dumps(self.snapshot())
+        return self._snapshot_json
+
+class WidgetUpdateCoalescer:
+    """Rebuilds a guild's widget state at most once per window, however often it changes, and sends widgets the delta.
+
+    The first change is sent straight away. Changes that arrive while an update is being built, or
+    within the window after it, mark the guild dirty, and one more update follows once the window is
+    over, so the last change is always sent.
+
+    The publisher is the WebSocket manager, or a bot_gateway.WidgetBusPublisher when the connections
+    live in web workers. Workers have no publisher: the bot owns the widget state and builds every update.
+    """
+    def __init__(self, window: float, publisher):
+        self.window = window
+        self.publisher = publisher
+        self.dirty: set[int] = set()
+        self.tasks: dict[int, asyncio.Task] = {}
+        self.states: dict[int, WidgetState] = defaultdict(WidgetState)
+        # Bumped on every change, so a rebuild knows whether it saw the latest one.
+        self.generations: defaultdict[int, int] = defaultdict(int)
+        self.refreshing: dict[int, tuple[int, asyncio.Task]] = {}
+        self.stats = {
+            "changes": 0, "coalesced": 0, "updates": 0, "unchanged": 0, "skipped": 0, "errors": 0,
+            "snapshot_hits": 0, "snapshot_misses": 0, "refreshes_shared": 0
+        }
+
+    def mark_dirty(self, guild_id: int):
+        if self.publisher is None:
+            return
+        self.stats["changes"] += 1
+        self.generations[guild_id] += 1
+        if guild_id in self.tasks:
+            self.dirty.add(guild_id)
+            self.stats["coalesced"] += 1
+            return
+        self.tasks[guild_id] = asyncio.create_task(self._run(guild_id))
+
+    async def _run(self, guild_id: int):
+        try:
+            while True:
+                self.dirty.discard(guild_id)
+                await self._flush(guild_id)
+                await asyncio.sleep(self.window)
+                if guild_id not in self.dirty:
+                    return
+        finally:
+            del self.tasks[guild_id]
+
+    async def _flush(self, guild_id: int):
+        if not self.publisher.has_listeners(guild_id):
+            # Nobody is watching; the next connection rebuilds the state for its snapshot anyway.
+            self.stats["skipped"] += 1
+            return
+        try:
+            await self.refresh(guild_id)
+        except Exception as e:
+            self.stats["errors"] += 1
+            log.error(f"Failed to build widget update for Guild ID: {guild_id}: {e}", exc_info=True)
+
+    async def get_snapshot(self, guild_id: int) -> str:
+        """The serialized snapshot for a new connection, rebuilt only if a change was signalled since or it expired."""
+        state = self.states.get(guild_id)
+        if (state is not None and state.generation == self.generations[guild_id]
+                and time.monotonic() - state.built_at < config.BOT_CONFIG["WIDGET_SNAPSHOT_TTL_SECONDS"]):
+            self.stats["snapshot_hits"] += 1
+            return state.snapshot_json()
+        self.stats["snapshot_misses"] += 1
+        state = await self.refresh(guild_id)
+        return state.snapshot_json()
+
+    async def refresh(self, guild_id: int) -> WidgetState:
+        """Rebuilds the guild's widget document and broadcasts the delta, if any, to its widgets.
+
+        Concurrent callers share one rebuild, unless it started before the latest change, in which case
+        they wait for it and start another. Rebuilds of a guild therefore never overlap or go backwards.
+        """
+        generation = self.generations[guild_id]
+        while True:
+            if guild_id not in self.refreshing:
+                task = asyncio.create_task(self._refresh(guild_id, generation))
+                self.refreshing[guild_id] = (generation, task)
+            else:
+                self.stats["refreshes_shared"] += 1
+            started_at, task = self.refreshing[guild_id]
+            # Shielded so a caller that disconnects doesn't cancel the rebuild for everyone else.
+            state = await asyncio.shield(task)
+            if started_at >= generation:
+                return state
+
+    async def _refresh(self, guild_id: int, generation: int) -> WidgetState:
+        try:
+            full_data = await get_full_widget_data(guild_id)
+            full_data.pop("type", None)
+            state = self.states[guild_id]
+            if delta := state.update(full_data):
+                self.stats["updates"] += 1
+                await self.publisher.broadcast(guild_id, delta)
+            else:
+                self.stats["unchanged"] += 1
+            state.generation = generation
+            state.built_at = time.monotonic()
+            return state
+        finally:
+            del self.refreshing[guild_id]
+
+    async def send_event(self, guild_id: int, message: dict):
+        """Sends a one-off message, such as a new submission, to the guild's widgets wherever they are connected."""
+        await self.publisher.broadcast(guild_id, message)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "pending": len(self.tasks), "refreshing": len(self.refreshing), "guilds": len(self.states)}
+
+widget_updates = WidgetUpdateCoalescer(config.BOT_CONFIG["WIDGET_BROADCAST_WINDOW_SECONDS"], ws_manager)
+app.widget_updates = widget_updates
+
+# --- User Profile Cache ---
+class UserProfileCache:
+    """Size-bounded LRU of Discord user profiles, each entry expiring after a TTL.
+
+    Lookups never await, so they need no lock. Concurrent misses for the same user share one
+    in-flight fetch, and users Discord doesn't know are cached as None for a shorter TTL.
+    """
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries: OrderedDict[int, tuple[float, dict | None]] = OrderedDict()
+        self.in_flight: dict[int, asyncio.Task] = {}
+        self.stats = {"hits": 0, "negative_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, user_id: int) -> tuple[bool, dict | None]:
+        """Returns (found, profile). A found profile of None means the user is known not to exist."""
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return False, None
+        expires_at, profile = entry
+        if expires_at <= time.monotonic():
+            del self.entries[user_id]
+            self.stats["expirations"] += 1
+            return False, None
+        self.entries.move_to_end(user_id)
+        self.stats["hits" if profile is not None else "negative_hits"] += 1
+        return True, profile
+
+    def peek(self, user_id: int) -> bool:
+        """Whether an unexpired entry exists, without touching the LRU order or counters."""
+        entry = self.entries.get(user_id)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def put(self, user_id: int, profile: dict | None):
+        ttl = self.ttl if profile is not None else self.negative_ttl
+        self.entries[user_id] = (time.monotonic() + ttl, profile)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    async def get_or_fetch(self, user_id: int, fetch) -> dict | None:
+        """Returns the cached profile, or awaits fetch(user_id) once no matter how many callers miss."""
+        found, profile = self.get(user_id)
+        if found:
+            return profile
+        task = self.in_flight.get(user_id)
+        if task is None:
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(self._load(user_id, fetch))
+            self.in_flight[user_id] = task
+        else:
+            self.stats["coalesced"] += 1
+        # Shielded so one caller going away doesn't cancel the fetch for everyone else waiting on it.
+        return await asyncio.shield(task)
+
+    async def _load(self, user_id: int, fetch) -> dict | None:
+        try:
+            profile = await fetch(user_id)
+            self.put(user_id, profile)
+            return profile
+        finally:
+            self.in_flight.pop(user_id, None)
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["negative_hits"] + self.stats["misses"] + self.stats["coalesced"]
+        return {
+            **self.stats,
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "in_flight": len(self.in_flight),
+            "hit_rate": (self.stats["hits"] + self.stats["negative_hits"]) / lookups if lookups else 0.0
+        }
+
+user_profile_cache = UserProfileCache(
+    config.BOT_CONFIG["USER_CACHE_MAX_SIZE"],
+    config.BOT_CONFIG["USER_CACHE_TTL_SECONDS"],
+    config.BOT_CONFIG["USER_CACHE_NEGATIVE_TTL_SECONDS"]
+)
+UNKNOWN_USER = {"name": "Unknown User", "avatar_url": "https://cdn.discordapp.com/embed/avatars/0.png"}
+
+# --- Rendered Page Cache ---
+class CachedPage:
+    def __init__(self, body: str, etag: str, last_modified: float, generation: int):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.generated_at = time.monotonic()
+        # The key's invalidation count when the render started; the page is stale once the count moves on.
+        self.generation = generation
+
+class ResponseCache:
+    """Size-bounded LRU of rendered pages served stale-while-revalidate.
+
+    A page older than the TTL, or invalidated by a data change, is still served while one
+    background task renders its replacement. Only a missing page, or one past the max stale age,
+    makes the request wait, and concurrent waiters share one render.
+    """
+    def __init__(self, max_entries: int, ttl: float, max_stale: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.pages: OrderedDict[str, CachedPage] = OrderedDict()
+        self.renders: dict[str, asyncio.Task] = {}
+        # Invalidations per key, counted even with no page cached so a first render that is already running
+        # is stored as stale. Keys are per guild and page type, so this stays small.
+        self.generations: dict[str, int] = {}
+        self.stats = {"fresh_hits": 0, "stale_hits": 0, "misses": 0, "renders": 0, "render_errors": 0, "not_modified": 0, "evictions": 0}
+
+    def invalidate(self, key: str):
+        self.generations[key] = self.generations.get(key, 0) + 1
+
+    async def get(self, key: str, render) -> CachedPage:
+        """Returns the page for key, calling render() to build it when needed."""
+        page = self.pages.get(key)
+        if page is not None:
+            self.pages.move_to_end(key)
+            age = time.monotonic() - page.generated_at
+            if age < self.ttl and page.generation == self.generations.get(key, 0):
+                self.stats["fresh_hits"] += 1
+                return page
+            if age < self.max_stale:
+                self.stats["stale_hits"] += 1
+                self._start_render(key, render)
+                return page
+        self.stats["misses"] += 1
+        return await asyncio.shield(self._start_render(key, render))
+
+    def _start_render(self, key: str, render) -> asyncio.Task:
+        task = self.renders.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._render(key, render))
+            task.add_done_callback(lambda task: self._log_render_failure(key, task))
+            self.renders[key] = task
+        return task
+
+    def _log_render_failure(self, key: str, task: asyncio.Task):
+        # Retrieves the exception even when only a background revalidation was waiting on the render.
+        if not task.cancelled() and (error := task.exception()) is not None:
+            self.stats["render_errors"] += 1
+            log.error(f"Failed to render cached page {key}: {error}", exc_info=error)
+
+    async def _render(self, key: str, render) -> CachedPage:
+        try:
+            # Taken before rendering: a change during the render leaves the new page already stale, and a
+            # failed render leaves the old page as stale as it was.
+            generation = self.generations.get(key, 0)
+            self.stats["renders"] += 1
+            async with app.app_context():
+                body = await render()
+            etag = hashlib.blake2b(body.encode(), digest_size=16).hexdigest()
+            previous = self.pages.get(key)
+            # Last-Modified only moves when the rendered content actually changed.
+            last_modified = previous.last_modified if previous and previous.etag == etag else time.time()
+            page = CachedPage(body, etag, last_modified, generation)
+            self.pages[key] = page
+            self.pages.move_to_end(key)
+            while len(self.pages) > self.max_entries:
+                self.pages.popitem(last=False)
+                self.stats["evictions"] += 1
+            return page
+        finally:
+            self.renders.pop(key, None)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "size": len(self.pages), "max_entries": self.max_entries, "rendering": len(self.renders)}
+
+response_cache = ResponseCache(
+    config.BOT_CONFIG["RESPONSE_CACHE_MAX_ENTRIES"],
+    config.BOT_CONFIG["RESPONSE_CACHE_TTL_SECONDS"],
+    config.BOT_CONFIG["RESPONSE_CACHE_MAX_STALE_SECONDS"]
+)
+
+def _invalidate_cached_pages(topic: str, guild_id: int):
+    if topic in ("xp", "cosmetics"):
+        response_cache.invalidate(f"leaderboard:{guild_id}")
+    if topic in ("koth", "cosmetics"):
+        response_cache.invalidate(f"koth:{guild_id}")
+
+database.add_change_listener(_invalidate_cached_pages)
+
+def _mark_widget_dirty(topic: str, guild_id: int):
+    # The widget shows the KOTH leaderboard, which also changes outside the submissions cog.
+    if topic == "koth":
+        widget_updates.mark_dirty(guild_id)
+
+database.add_change_listener(_mark_widget_dirty)
+
+async def cached_page_response(key: str, render):
+    """Serves a page from the response cache, answering 304 when the client's copy is current."""
+    page = await response_cache.get(key, render)
+    headers = {
+        "ETag": f'"{page.etag}"',
+        "Last-Modified": http_date(page.last_modified),
+        "Cache-Control": "no-cache"
+    }
+    if_none_match = request.headers.get("If-None-Match")
+    if_modified_since = parse_date(request.headers.get("If-Modified-Since"))
+    if if_none_match:
+        not_modified = f'"{page.etag}"' in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    else:
+        not_modified = if_modified_since is not None and int(page.last_modified) <= if_modified_since.timestamp()
+    if not_modified:
+        response_cache.stats["not_modified"] += 1
+        return "", 304, headers
+    return page.body, 200, headers
+
 # --- HELPER FUNCTIONS ---
 async def get_verification_data(state: str):
     try:
-        async with aiosqlite.connect(DB_FILE) as conn:
-            async with conn.execute("SELECT server_name, bot_avatar_url FROM verification_links WHERE state = ?", (state,)) as cursor:
-                data = await cursor.fetchone()
-                if data: return {"server_name": data[0], "bot_avatar_url": data[1]}
+        if link := await app.db.get_verification_link(state):
+            return {"server_name": link["server_name"], "bot_avatar_url": link["bot_avatar_url"]}
     except Exception as e:
         print(f"Error fetching verification data: {e}")
     return {"server_name": "your Discord server", "bot_avatar_url": ""}
 
-async def fetch_user_data(user_id: int):
-    """Fetches user data from Discord API with caching."""
-    async with cache_lock:
-        current_time = asyncio.get_event_loop().time()
-        if user_id in user_cache and (current_time - user_cache[user_id]['timestamp']) < CACHE_DURATION_SECONDS:
-            return user_cache[user_id]['data']
+def _profile_from_store(user_id: int, stored: dict | None) -> dict | None:
+    max_age = config.BOT_CONFIG["PROFILE_MAX_AGE_SECONDS"]
+    if stored is None or stored["fetched_at"] < time.time() - max_age:
+        app.gateway.request_profile_refresh(user_id)
+    if stored is None or stored["name"] is None:
+        return None
+    return {"name": stored["name"], "avatar_url": stored["avatar_url"]}
+
+async def _fetch_user_profile(user_id: int) -> dict | None:
+    # The gateway cache first, then the profile store. Never a REST call: users in neither are
+    # queued for the background refresher and shown as unknown until it has stored them.
+    (profile,) = await app.gateway.get_user_profiles([user_id])
+    if profile:
+        return profile
+    stored = await app.db.get_user_profiles([user_id])
+    return _profile_from_store(user_id, stored.get(user_id))
+
+async def fetch_users_data(user_ids) -> list[dict]:
+    """fetch_user_data for many users, loading every store miss with a single query."""
+    user_ids = list(user_ids)
+    unseen = [user_id for user_id in user_ids if not user_profile_cache.peek(user_id)]
+    missing = []
+    if unseen:
+        for user_id, profile in zip(unseen, await app.gateway.get_user_profiles(unseen)):
+            if profile:
+                user_profile_cache.put(user_id, profile)
+            else:
+                missing.append(user_id)
+    if missing:
+        stored = await app.db.get_user_profiles(missing)
+        for user_id in missing:
+            user_profile_cache.put(user_id, _profile_from_store(user_id, stored.get(user_id)))
+    return await asyncio.gather(*[fetch_user_data(user_id) for user_id in user_ids])
 
-    bot = app.bot_instance
+async def fetch_user_data(user_id: int):
+    """Fetches a user's name and avatar from the gateway cache or the profile store, with caching."""
     try:
-        user = bot.get_user(user_id) or await bot.fetch_user(user_id)
-        if user:
-            data = {"name": user.display_name, "avatar_url": user.display_avatar.url}
-            async with cache_lock:
-                user_cache[user_id] = {
-                    'data': data,
-                    'timestamp': asyncio.get_event_loop().time()
-                }
-            return data
+        if profile := await user_profile_cache.get_or_fetch(user_id, _fetch_user_profile):
+            return profile
     except Exception as e:
         log.warning(f"Could not fetch user data for {user_id}: {e}")
-
-    return {"name": "Unknown User", "avatar_url": "https://cdn.discordapp.com/embed/avatars/0.png"}
+    return UNKNOWN_USER
     
 async def is_valid_staff(guild_id, approver_name):
     return approver_name is not None and approver_name != ""
 
 async def get_full_widget_data(guild_id: int) -> dict:
-    bot = app.bot_instance
-    guild = bot.get_guild(guild_id)
+    guild = await app.gateway.get_guild(guild_id)
     if not guild: return {}
 
-    status = await database.get_setting(guild_id, 'submission_status')
-    regular_queue_count = await database.get_submission_queue_count(guild_id, 'regular')
-    koth_queue_count = await database.get_submission_queue_count(guild_id, 'koth')
-    reviewing_user_id = await database.get_current_review(guild_id, 'regular')
-    king_id = await database.get_setting(guild_id, 'koth_king_id')
+    status = await app.db.get_setting(guild_id, 'submission_status')
+    regular_queue_count = await app.db.get_submission_queue_count(guild_id, 'regular')
+    koth_queue_count = await app.db.get_submission_queue_count(guild_id, 'koth')
+    reviewing_user_id = await app.db.get_current_review(guild_id, 'regular')
+    king_id = await app.db.get_setting(guild_id, 'koth_king_id')
 
     raw_koth_lb_data = []
     koth_leaderboard_title = "Leaderboard (All-Time)"
     
     if status == 'koth_open':
-        cog = bot.get_cog("Submissions")
-        if cog:
-            session_stats = cog.current_koth_session.get(guild_id, {})
-            if session_stats:
-                koth_leaderboard_title = "Leaderboard (Current Battle)"
-                sorted_session = sorted(session_stats.items(), key=lambda item: item[1]['points'], reverse=True)
-                raw_koth_lb_data = [(uid, stats['points']) for uid, stats in sorted_session]
+        if session_points := await app.gateway.get_koth_session(guild_id):
+            koth_leaderboard_title = "Leaderboard (Current Battle)"
+            raw_koth_lb_data = [(uid, points) for uid, points in session_points]
 
     if not raw_koth_lb_data:
-        all_time_data = await database.get_koth_leaderboard(guild_id)
+        all_time_data = await app.db.get_koth_leaderboard(guild_id)
         raw_koth_lb_data = [(uid, pts) for uid, pts, _, _, _ in all_time_data]
 
     user_ids_to_fetch = set()
@@ -163,8 +655,7 @@ async def get_full_widget_data(guild_id: int) -> dict:
     for user_id, _ in raw_koth_lb_data[:5]:
         user_ids_to_fetch.add(user_id)
 
-    user_fetch_tasks = [fetch_user_data(uid) for uid in user_ids_to_fetch]
-    fetched_users_list = await asyncio.gather(*user_fetch_tasks)
+    fetched_users_list = await fetch_users_data(user_ids_to_fetch)
     
     user_data_map = {uid: data for uid, data in zip(user_ids_to_fetch, fetched_users_list)}
     default_user = {"name": "None", "avatar_url": ""}
@@ -191,6 +682,10 @@ async def get_full_widget_data(guild_id: int) -> dict:
         }
     }
 
+# The bot's cogs reach these through bot.app.
+app.get_full_widget_data = get_full_widget_data
+app.fetch_user_data = fetch_user_data
+
 # --- WEB ROUTES ---
 
 # --- Staff Panel Authentication Routes ---
@@ -198,60 +693,47 @@ async def get_full_widget_data(guild_id: int) -> dict:
 @app.route('/panel/login/<int:guild_id>')
 async def panel_login_page(guild_id: int):
     """Renders the login page for a specific guild."""
-    guild = app.bot_instance.get_guild(guild_id)
+    guild = await app.gateway.get_guild(guild_id)
     if not guild: return "<h1>Guild not found.</h1>", 404
     return await render_template(
         "panel_login.html",
-        guild_name=guild.name,
-        guild_icon_url=guild.icon.url if guild.icon else None
+        guild_name=guild["name"],
+        guild_icon_url=guild["icon_url"]
     )
 
-async def get_user_access_level(guild: discord.Guild, user_id: int) -> str:
+async def get_user_access_level(guild: dict, user_id: int) -> str:
     """Checks if a user is an Admin or a Mod."""
-    member = guild.get_member(user_id)
-    if not member:
-        return "Unknown"
-    
-    if await utils.has_admin_role(member):
-        return "Admin"
-    if await utils.has_mod_role(member):
-        return "Moderator"
-    return "Member"
+    return await app.gateway.get_access_level(guild["id"], user_id)
 
 @app.route('/panel/<int:guild_id>')
 @login_required
 async def panel_home(guild_id: int):
     """Renders the main dashboard page."""
-    guild = app.bot_instance.get_guild(guild_id)
+    guild = await app.gateway.get_guild(guild_id)
     user_info = await fetch_user_data(int(session.get('user_id')))
     access_level = await get_user_access_level(guild, int(session.get('user_id')))
 
     # Fetch data for dashboard cards
-    xp_leaderboard_raw = await database.get_leaderboard(guild.id, limit=5)
+    xp_leaderboard_raw = await app.db.get_leaderboard(guild_id, limit=5)
     xp_leaderboard_users = []
     for user_id_xp, xp in xp_leaderboard_raw:
         user_data = await fetch_user_data(user_id_xp)
         xp_leaderboard_users.append({"name": user_data['name'], "score": xp})
 
-    koth_leaderboard_raw = await database.get_koth_leaderboard(guild.id)
+    koth_leaderboard_raw = await app.db.get_koth_leaderboard(guild_id)
     koth_leaderboard_users = []
     for user_id_koth, points, w, l, s in koth_leaderboard_raw[:5]:
         user_data = await fetch_user_data(user_id_koth)
         koth_leaderboard_users.append({"name": user_data['name'], "score": points})
 
-    last_member_joined = sorted(guild.members, key=lambda m: m.joined_at, reverse=True)[0]
-    online_members = sum(1 for m in guild.members if m.status != discord.Status.offline)
-    
-    excluded_ids = set(config.BOT_CONFIG.get("MILESTONE_EXCLUDED_IDS", []))
-    total_bots = sum(1 for m in guild.members if m.bot)
-    true_member_count = guild.member_count - total_bots - len(excluded_ids)
+    member_stats = await app.gateway.get_member_stats(guild_id)
     
     return await render_template(
         "panel_dashboard.html",
-        guild_id=guild_id, guild_name=guild.name, guild_icon_url=guild.icon.url if guild.icon else None,
+        guild_id=guild_id, guild_name=guild["name"], guild_icon_url=guild["icon_url"],
         user_name=user_info['name'], user_avatar_url=user_info['avatar_url'],
         xp_leaderboard=xp_leaderboard_users, koth_leaderboard=koth_leaderboard_users,
-        last_member=last_member_joined.display_name, online_count=online_members, member_count=true_member_count,
+        last_member=member_stats["last_member"] or "N/A", online_count=member_stats["online_count"], member_count=member_stats["member_count"],
         access_level=access_level
     )
 
@@ -259,17 +741,17 @@ async def panel_home(guild_id: int):
 @login_required
 async def panel_statistics(guild_id: int):
     """Renders the statistics page."""
-    guild = app.bot_instance.get_guild(guild_id)
+    guild = await app.gateway.get_guild(guild_id)
     user_info = await fetch_user_data(int(session.get('user_id')))
     access_level = await get_user_access_level(guild, int(session.get('user_id')))
-    top_voice_raw = await database.get_top_voice_channels(guild_id, limit=5)
+    top_voice_raw = await app.db.get_top_voice_channels(guild_id, limit=5)
 
     # Fetch data for stats cards
-    top_users_raw = await database.get_top_users_overall(guild_id, limit=10)
-    top_text_raw = await database.get_top_text_channels(guild_id, limit=5)
-    top_voice_raw = await database.get_top_voice_channels(guild_id, limit=5)
+    top_users_raw = await app.db.get_top_users_overall(guild_id, limit=10)
+    top_text_raw = await app.db.get_top_text_channels(guild_id, limit=5)
+    top_voice_raw = await app.db.get_top_voice_channels(guild_id, limit=5)
 
-    top_today_raw = await database.get_top_users_today(guild_id, limit=5)
+    top_today_raw = await app.db.get_top_users_today(guild_id, limit=5)
     top_today = []
     for user_id_today, msg_count_today, vc_sec_today in top_today_raw:
         user_info_today = await fetch_user_data(user_id_today)
@@ -281,22 +763,20 @@ async def panel_statistics(guild_id: int):
         top_users.append({'name': user_info_db['name'], 'message_count': msg_count, 'voice_seconds': vc_sec})
 
     # --- Start of new/modified code ---
+    text_names = await app.gateway.get_channel_names(guild_id, [channel_id for channel_id, _ in top_text_raw])
     top_text = []
-    for channel_id, count in top_text_raw:
-        channel = guild.get_channel(channel_id)
-        channel_name = channel.name if channel else "Deleted Channel"
-        top_text.append({'name': channel_name, 'message_count': count})
+    for (channel_id, count), channel_name in zip(top_text_raw, text_names):
+        top_text.append({'name': channel_name or "Deleted Channel", 'message_count': count})
 
+    voice_names = await app.gateway.get_channel_names(guild_id, [channel_id for channel_id, _ in top_voice_raw])
     top_voice = []
-    for channel_id, secs in top_voice_raw:
-        channel = guild.get_channel(channel_id)
-        channel_name = channel.name if channel else "Deleted Channel"
-        top_voice.append({'name': channel_name, 'voice_seconds': secs})
+    for (channel_id, secs), channel_name in zip(top_voice_raw, voice_names):
+        top_voice.append({'name': channel_name or "Deleted Channel", 'voice_seconds': secs})
     # --- End of new/modified code ---
 
     return await render_template(
         "panel_statistics.html",
-        guild_id=guild_id, guild_name=guild.name, guild_icon_url=guild.icon.url if guild.icon else None,
+        guild_id=guild_id, guild_name=guild["name"], guild_icon_url=guild["icon_url"],
         user_name=user_info['name'], user_avatar_url=user_info['avatar_url'],
         top_users=top_users, top_text_channels=top_text, top_voice_channels=top_voice,
         top_active_today=top_today,
@@ -307,17 +787,17 @@ async def panel_statistics(guild_id: int):
 @login_required
 async def panel_widgets(guild_id: int):
     """Renders the widgets page."""
-    guild = app.bot_instance.get_guild(guild_id)
+    guild = await app.gateway.get_guild(guild_id)
     user_info = await fetch_user_data(int(session.get('user_id')))
     access_level = await get_user_access_level(guild, int(session.get('user_id')))
 
     # Get the unique token for the guild's widgets
-    token = await database.get_or_create_widget_token(guild_id)
+    token = await app.db.get_or_create_widget_token(guild_id)
     widget_url_base = f"{APP_BASE_URL}/widget/view/{token}"
 
     return await render_template(
         "panel_widgets.html",
-        guild_id=guild_id, guild_name=guild.name, guild_icon_url=guild.icon.url if guild.icon else None,
+        guild_id=guild_id, guild_name=guild["name"], guild_icon_url=guild["icon_url"],
         user_name=user_info['name'], user_avatar_url=user_info['avatar_url'],
         regular_widget_url=f"{widget_url_base}?type=regular",
         koth_widget_url=f"{widget_url_base}?type=koth",
@@ -328,41 +808,30 @@ async def panel_widgets(guild_id: int):
 @login_required
 async def panel_mod_menu(guild_id: int):
     """Renders the moderation menu page."""
-    guild = app.bot_instance.get_guild(guild_id)
+    guild = await app.gateway.get_guild(guild_id)
     user_info = await fetch_user_data(int(session.get('user_id')))
     access_level = await get_user_access_level(guild, int(session.get('user_id')))
 
-    admin_role_ids = await utils.get_admin_roles(guild_id)
-    mod_role_ids = await utils.get_mod_roles(guild_id)
-
-    admin_members = []
-    mod_members = []
-    for member in guild.members:
-        if member.bot: continue
-        member_role_ids = {role.id for role in member.roles}
-        if any(role_id in member_role_ids for role_id in admin_role_ids):
-            admin_members.append({"name": member.display_name, "avatar_url": member.display_avatar.url})
-        elif any(role_id in member_role_ids for role_id in mod_role_ids):
-            mod_members.append({"name": member.display_name, "avatar_url": member.display_avatar.url})
+    staff = await app.gateway.get_staff_members(guild_id)
 
     return await render_template(
         "panel_mod_menu.html",
-        guild_id=guild_id, guild_name=guild.name, guild_icon_url=guild.icon.url if guild.icon else None,
+        guild_id=guild_id, guild_name=guild["name"], guild_icon_url=guild["icon_url"],
         user_name=user_info['name'], user_avatar_url=user_info['avatar_url'],
         access_level=access_level,
-        admin_members=admin_members,
-        mod_members=mod_members
+        admin_members=staff["admins"],
+        mod_members=staff["mods"]
     )
 
 @app.route('/panel/<int:guild_id>/tiers')
 @login_required
 async def panel_tiers(guild_id: int):
     """Renders the tier management page."""
-    guild = app.bot_instance.get_guild(guild_id)
+    guild = await app.gateway.get_guild(guild_id)
     user_info = await fetch_user_data(int(session.get('user_id')))
     access_level = await get_user_access_level(guild, int(session.get('user_id')))
 
-    pending_requests_raw = await database.get_all_pending_tier_requests(guild_id)
+    pending_requests_raw = await app.db.get_all_pending_tier_requests(guild_id)
     
     pending_requests = []
     for req in pending_requests_raw:
@@ -377,7 +846,7 @@ async def panel_tiers(guild_id: int):
 
     return await render_template(
         "panel_tiers.html",
-        guild_id=guild_id, guild_name=guild.name, guild_icon_url=guild.icon.url if guild.icon else None,
+        guild_id=guild_id, guild_name=guild["name"], guild_icon_url=guild["icon_url"],
         user_name=user_info['name'], user_avatar_url=user_info['avatar_url'],
         access_level=access_level,
         requests=pending_requests
@@ -387,20 +856,19 @@ async def panel_tiers(guild_id: int):
 @login_required
 async def panel_giveaway(guild_id: int):
     """Renders the giveaway management page."""
-    guild = app.bot_instance.get_guild(guild_id)
+    guild = await app.gateway.get_guild(guild_id)
     user_info = await fetch_user_data(int(session.get('user_id')))
     access_level = await get_user_access_level(guild, int(session.get('user_id')))
 
-    giveaway = await database.get_active_giveaway(guild_id)
+    giveaway = await app.db.get_active_giveaway(guild_id)
     entrants = []
     if giveaway:
-        entrant_ids = await database.get_giveaway_entrants(guild_id, giveaway['id'])
-        for user_id in entrant_ids:
-            entrants.append(await fetch_user_data(user_id))
+        entrant_ids = await app.db.get_giveaway_entrants(guild_id, giveaway['id'])
+        entrants = await fetch_users_data(entrant_ids)
 
     return await render_template(
         "panel_giveaway.html",
-        guild_id=guild_id, guild_name=guild.name, guild_icon_url=guild.icon.url if guild.icon else None,
+        guild_id=guild_id, guild_name=guild["name"], guild_icon_url=guild["icon_url"],
         user_name=user_info['name'], user_avatar_url=user_info['avatar_url'],
         access_level=access_level,
         giveaway=giveaway,
@@ -427,7 +895,7 @@ async def api_moderate_user(guild_id: int):
 
     try:
         # Put the task into the bot's queue
-        app.bot_instance.action_queue.put_nowait(task)
+        app.gateway.submit_action(task)
         return jsonify({"message": f"Action '{task['mod_action'].capitalize()}' has been successfully queued."}), 200
     except Exception as e:
         log.error(f"Failed to queue moderation action: {e}")
@@ -465,34 +933,30 @@ async def callback():
     }
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
     
-    async with httpx.AsyncClient() as client:
-        token_response = await client.post(f"{DISCORD_API_BASE_URL}/oauth2/token", data=data, headers=headers)
-    
+    token_response = await upstream.post(f"{DISCORD_API_BASE_URL}/oauth2/token", data=data, headers=headers)
     token_data = token_response.json()
     access_token = token_data.get("access_token")
 
     headers = {"Authorization": f"Bearer {access_token}"}
-    async with httpx.AsyncClient() as client:
-        user_response = await client.get(f"{DISCORD_API_BASE_URL}/users/@me", headers=headers)
-    
+    user_response = await upstream.get(f"{DISCORD_API_BASE_URL}/users/@me", headers=headers)
     user_data = user_response.json()
     user_id = int(user_data['id'])
 
     # --- Start of Authorization Check ---
-    guild = app.bot_instance.get_guild(guild_id_to_check)
+    guild = await app.gateway.get_guild(guild_id_to_check)
     if not guild:
         return "<h1>Error: The bot is not in the guild you're trying to access.</h1>", 403
 
-    member = guild.get_member(user_id)
-    if not member:
+    access_level = await app.gateway.get_access_level(guild_id_to_check, user_id)
+    if access_level == "Unknown":
         # The user is in the guild, but the bot's member cache might be incomplete.
         # It's safer to deny access than to grant it incorrectly.
-        return await render_template("access_denied.html", guild_name=guild.name)
+        return await render_template("access_denied.html", guild_name=guild["name"])
 
-    is_staff = await utils.has_mod_role(member)
+    is_staff = access_level in ("Admin", "Moderator")
 
     if not is_staff:
-        return await render_template("access_denied.html", guild_name=guild.name)
+        return await render_template("access_denied.html", guild_name=guild["name"])
     # --- End of Authorization Check ---
 
     # Store user info and authorization status in the session
@@ -508,89 +972,152 @@ async def callback():
 async def home():
     return "Web server for LeClark Bot is active."
 
+@app.route('/api/v1/metrics')
+async def metrics():
+    """Internal counters for the database pools and upstream HTTP calls. Requires the METRICS_TOKEN bearer token."""
+    # Not gated on the peer address: behind a reverse proxy every request arrives from loopback.
+    authorization = request.headers.get("Authorization", "")
+    if not METRICS_TOKEN or not secrets.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        abort(404)
+    return jsonify({
+        **await app.gateway.get_database_stats(),
+        "user_profile_cache": user_profile_cache.get_stats(),
+        "response_cache": response_cache.get_stats(),
+        "websockets": ws_manager.get_stats(),
+        "widget_updates": widget_updates.get_stats(),
+        "gateway": app.gateway.get_stats(),
+        "upstream_http": upstream.get_stats()
+    })
+
+def encode_leaderboard_cursor(score: int, user_id: int) -> str:
+    """Encodes the (score, user_id) of the last entry on a page as an opaque cursor."""
+    return base64.urlsafe_b64encode(f"{score}:{user_id}".encode()).decode().rstrip("=")
+
+def decode_leaderboard_cursor(cursor: str) -> tuple[int, int]:
+    """Decodes a cursor from encode_leaderboard_cursor. Raises ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        score, user_id = raw.split(":")
+        return int(score), int(user_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+async def build_leaderboard_entries(guild_id: int, rows: list[tuple[int, int, str]]) -> list[dict]:
+    """Turns (user_id, score, details) rows into leaderboard entries, resolving profiles for just these users."""
+    user_ids = [user_id for user_id, score, details in rows]
+    if not user_ids:
+        return []
+    cosmetics, fetched_users = await asyncio.gather(
+        app.db.get_all_user_cosmetics(guild_id, user_ids),
+        fetch_users_data(user_ids)
+    )
+    return [{
+        "id": user_id,
+        "name": user_info['name'],
+        "avatar_url": user_info['avatar_url'],
+        "score": score,
+        "details": details,
+        "emoji": cosmetics.get(user_id)
+    } for (user_id, score, details), user_info in zip(rows, fetched_users)]
+
+async def get_xp_leaderboard_page(guild_id: int, limit: int, after: tuple[int, int] | None = None) -> tuple[list[dict], str | None]:
+    """Returns one page of XP leaderboard entries and the cursor for the next page, or None on the last page."""
+    raw_leaderboard = await app.db.get_leaderboard_page(guild_id, limit + 1, after)
+    rows = [(user_id, xp, f"Level: {get_rank_info(xp)[0]}") for user_id, xp in raw_leaderboard[:limit]]
+    next_cursor = encode_leaderboard_cursor(rows[-1][1], rows[-1][0]) if len(raw_leaderboard) > limit else None
+    return await build_leaderboard_entries(guild_id, rows), next_cursor
+
+async def get_koth_leaderboard_page(guild_id: int, limit: int, after: tuple[int, int] | None = None) -> tuple[list[dict], str | None]:
+    """Returns one page of KOTH leaderboard entries and the cursor for the next page, or None on the last page."""
+    raw_leaderboard = await app.db.get_koth_leaderboard_page(guild_id, limit + 1, after)
+    rows = [
+        (user_id, points, f"W/L: {wins}/{losses} | Streak: {streak}")
+        for user_id, points, wins, losses, streak in raw_leaderboard[:limit]
+    ]
+    next_cursor = encode_leaderboard_cursor(rows[-1][1], rows[-1][0]) if len(raw_leaderboard) > limit else None
+    return await build_leaderboard_entries(guild_id, rows), next_cursor
+
+LEADERBOARD_PAGES = {"xp": get_xp_leaderboard_page, "koth": get_koth_leaderboard_page}
+
+@app.route('/api/v1/leaderboard/<board>/<int:guild_id>')
+async def api_leaderboard_page(board: str, guild_id: int):
+    """One page of the XP or KOTH leaderboard. Pass the previous response's `next` as ?cursor= for the page after it."""
+    get_page = LEADERBOARD_PAGES.get(board)
+    if get_page is None:
+        abort(404)
+    if not await app.gateway.get_guild(guild_id):
+        return jsonify({"error": "Guild not found."}), 404
+
+    try:
+        limit = int(request.args.get('limit', config.BOT_CONFIG["LEADERBOARD_PAGE_SIZE"]))
+        cursor = request.args.get('cursor')
+        after = decode_leaderboard_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"error": "Invalid cursor or limit."}), 400
+    limit = max(1, min(limit, config.BOT_CONFIG["LEADERBOARD_MAX_PAGE_SIZE"]))
+
+    entries, next_cursor = await get_page(guild_id, limit, after)
+    return jsonify({
+        "entries": [{
+            "id": str(entry["id"]),
+            "name": entry["name"],
+            "avatar": entry["avatar_url"],
+            "score": entry["score"],
+            "details": entry["details"],
+            "emoji": entry["emoji"]
+        } for entry in entries],
+        "next": next_cursor
+    })
+
 @app.route('/leaderboard/<int:guild_id>')
 async def xp_leaderboard(guild_id: int):
-    cache_key = f"leaderboard_{guild_id}"
-    current_time = time.time()
-    if cache_key in web_cache and (current_time - web_cache[cache_key]['timestamp']) < CACHE_EXPIRATION:
-        return web_cache[cache_key]['data']
-        
-    bot = app.bot_instance
-    guild = bot.get_guild(guild_id)
+    guild = await app.gateway.get_guild(guild_id)
     if not guild: 
         return await render_template("leaderboard.html", title="Error", guild_name="Unknown Server", users=[])
+    return await cached_page_response(f"leaderboard:{guild_id}", lambda: render_xp_leaderboard(guild))
 
-    raw_leaderboard = await database.get_leaderboard(guild_id, limit=100)
-    
-    # --- FIX STARTS HERE ---
-    
-    users = [] # Initialize the list first
-    if raw_leaderboard: # Only proceed if there's data
-        user_ids = [user_id for user_id, xp in raw_leaderboard]
-        cosmetics_task = database.get_all_user_cosmetics(guild_id, user_ids)
-        user_data_task = asyncio.gather(*[fetch_user_data(uid) for uid in user_ids])
-        cosmetics, fetched_users = await asyncio.gather(cosmetics_task, user_data_task)
-        
-        for i, (user_id, xp) in enumerate(raw_leaderboard):
-            user_info = fetched_users[i]
-            rank_name, _, _ = get_rank_info(xp)
-            users.append({
-                "name": user_info['name'],
-                "avatar_url": user_info['avatar_url'],
-                "score": xp,
-                "details": f"Level: {rank_name}",
-                "emoji": cosmetics.get(user_id)
-            })
-
-    # Now, we can safely render the template
-    rendered_template = await render_template(
+async def render_xp_leaderboard(guild: dict) -> str:
+    # Only the first page is rendered here; the page fetches the rest from the API as it is scrolled.
+    users, next_cursor = await get_xp_leaderboard_page(guild["id"], config.BOT_CONFIG["LEADERBOARD_PAGE_SIZE"])
+    return await render_template(
         "leaderboard.html", 
-        title=f"XP Leaderboard - {guild.name}", 
-        guild_name=guild.name, 
-        guild_icon_url=guild.icon.url if guild.icon else None, 
+        title=f"XP Leaderboard - {guild['name']}", 
+        guild_name=guild["name"], 
+        guild_icon_url=guild["icon_url"], 
         users=users, 
-        score_name="XP"
+        score_name="XP",
+        next_cursor=next_cursor,
+        api_url=url_for('api_leaderboard_page', board="xp", guild_id=guild["id"])
     )
 
-    web_cache[cache_key] = {
-        'data': rendered_template,
-        'timestamp': current_time
-    }
-    
-    return rendered_template
-    # --- FIX ENDS HERE ---
-
 @app.route('/koth/<int:guild_id>')
 async def koth_leaderboard(guild_id: int):
-    bot = app.bot_instance; guild = bot.get_guild(guild_id)
+    guild = await app.gateway.get_guild(guild_id)
     if not guild: return await render_template("leaderboard.html", title="Error", guild_name="Unknown Server", users=[])
-    raw_leaderboard = await database.get_koth_leaderboard(guild_id)
-    user_ids = [user_id for user_id, points, w, l, s in raw_leaderboard]
-    cosmetics_task = database.get_all_user_cosmetics(guild_id, user_ids)
-    user_data_task = asyncio.gather(*[fetch_user_data(uid) for uid in user_ids])
-    cosmetics, fetched_users = await asyncio.gather(cosmetics_task, user_data_task)
-    
-    users = []
-    for i, (user_id, points, wins, losses, streak) in enumerate(raw_leaderboard):
-        user_info = fetched_users[i]
-        users.append({
-            "name": user_info['name'],
-            "avatar_url": user_info['avatar_url'],
-            "score": points,
-            "details": f"W/L: {wins}/{losses} | Streak: {streak}",
-            "emoji": cosmetics.get(user_id)
-        })
-    return await render_template("leaderboard.html", title=f"KOTH Leaderboard - {guild.name}", guild_name=guild.name, guild_icon_url=guild.icon.url if guild.icon else None, users=users, score_name="Points")
+    return await cached_page_response(f"koth:{guild_id}", lambda: render_koth_leaderboard(guild))
+
+async def render_koth_leaderboard(guild: dict) -> str:
+    users, next_cursor = await get_koth_leaderboard_page(guild["id"], config.BOT_CONFIG["LEADERBOARD_PAGE_SIZE"])
+    return await render_template(
+        "leaderboard.html",
+        title=f"KOTH Leaderboard - {guild['name']}",
+        guild_name=guild["name"],
+        guild_icon_url=guild["icon_url"],
+        users=users,
+        score_name="Points",
+        next_cursor=next_cursor,
+        api_url=url_for('api_leaderboard_page', board="koth", guild_id=guild["id"])
+    )
 
 @app.route('/widget/<int:guild_id>')
 async def widget_link_page(guild_id: int):
-    token = await database.get_or_create_widget_token(guild_id)
+    token = await app.db.get_or_create_widget_token(guild_id)
     widget_url_base = f"{APP_BASE_URL}/widget/view/{token}"
     return await render_template("widget_link.html", widget_url_base=widget_url_base, guild_id=guild_id)
 
 @app.route('/widget/view/<token>')
 async def view_widget(token: str):
-    guild_id = await database.get_guild_from_token(token)
+    guild_id = await app.db.get_guild_from_token(token)
     if not guild_id:
         return "<h1>Invalid or expired token. Please regenerate your link.</h1>", 403
     return await render_template("widget.html", token=token)
@@ -602,42 +1129,49 @@ async def websocket_endpoint():
     if not token:
         await ws_conn.close(1008, "Token is required"); return
 
-    guild_id = await database.get_guild_from_token(token)
+    guild_id = await app.db.get_guild_from_token(token)
     if not guild_id:
         await ws_conn.close(1008, "Invalid token"); return
 
-    await ws_manager.register(guild_id, ws_conn)
+    # Register only once the state is current, so the snapshot is the first message and every later delta builds on it.
+    # In a web worker a delta can still slip in between; the widget sees the version gap and resyncs.
+    snapshot_json = await app.gateway.get_widget_snapshot(guild_id)
+    connection = await ws_manager.register(guild_id, ws_conn)
     try:
-        initial_data = await get_full_widget_data(guild_id)
-        await ws_conn.send(json.dumps(initial_data))
+        connection.enqueue(snapshot_json)
         while True:
-            await ws_conn.receive()
+            message = await ws_conn.receive()
+            # A widget that missed a delta asks for the current snapshot instead of waiting for the next change.
+            try:
+                is_resync = json.loads(message).get("type") == "resync"
+            except (ValueError, AttributeError):
+                is_resync = False
+            if is_resync:
+                connection.enqueue(await app.gateway.get_widget_snapshot(guild_id))
     except asyncio.CancelledError:
         log.info(f"WebSocket task for guild {guild_id} cancelled.")
     finally:
-        await ws_manager.unregister(guild_id, ws_conn)
+        await ws_manager.unregister(guild_id, connection)
 
 @app.route('/callback/twitch')
 async def callback_twitch():
     auth_code, state = request.args.get('code'), request.args.get('state')
     if not auth_code or not state: return "Error: Missing authorization code or state.", 400
-    token_url = "https://id.twitch.tv/oauth2/token"
+    token_url = f"{TWITCH_OAUTH_BASE_URL}/token"
     token_params = {"client_id": TWITCH_CLIENT_ID, "client_secret": TWITCH_CLIENT_SECRET, "code": auth_code, "grant_type": "authorization_code", "redirect_uri": TWITCH_REDIRECT_URI}
-    async with httpx.AsyncClient() as client: response = await client.post(token_url, params=token_params)
+    response = await upstream.post(token_url, params=token_params)
     token_data = response.json()
     if 'access_token' not in token_data: return "Error: Could not retrieve access token from Twitch.", 400
     access_token = token_data['access_token']
-    user_url = "https://api.twitch.tv/helix/users"
+    user_url = f"{TWITCH_API_BASE_URL}/users"
     headers = {"Authorization": f"Bearer {access_token}", "Client-Id": TWITCH_CLIENT_ID}
-    async with httpx.AsyncClient() as client: user_response = await client.get(user_url, headers=headers)
+    user_response = await upstream.get(user_url, headers=headers)
     user_data = user_response.json()
     if not user_data.get('data'): return "Error: Could not retrieve user data from Twitch.", 400
     account_name = user_data['data'][0]['login']
     try:
         template_data = await get_verification_data(state)
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.execute("UPDATE verification_links SET status = 'verified', verified_account = ? WHERE state = ? AND status = 'pending'", (account_name, state))
-            await conn.commit()
+        await app.db.complete_verification_if_pending(state, account_name)
         return await render_template("success.html", account_name=account_name, **template_data)
     except Exception as e:
         print(f"Database error during Twitch callback: {e}"); return "An internal server error occurred.", 500
@@ -646,23 +1180,21 @@ async def callback_twitch():
 async def callback_youtube():
     auth_code, state = request.args.get('code'), request.args.get('state')
     if not auth_code or not state: return "Error: Missing authorization code or state.", 400
-    token_url = "https://oauth2.googleapis.com/token"
+    token_url = f"{GOOGLE_OAUTH_BASE_URL}/token"
     token_params = {"client_id": YOUTUBE_CLIENT_ID, "client_secret": YOUTUBE_CLIENT_SECRET, "code": auth_code, "grant_type": "authorization_code", "redirect_uri": YOUTUBE_REDIRECT_URI}
-    async with httpx.AsyncClient() as client: response = await client.post(token_url, data=token_params)
+    response = await upstream.post(token_url, data=token_params)
     token_data = response.json()
     if 'access_token' not in token_data: return "Error: Could not retrieve access token from Google.", 400
     access_token = token_data['access_token']
-    user_url = "https://www.googleapis.com/oauth2/v2/userinfo"
+    user_url = f"{GOOGLE_API_BASE_URL}/userinfo"
     headers = {"Authorization": f"Bearer {access_token}"}
-    async with httpx.AsyncClient() as client: user_response = await client.get(user_url, headers=headers)
+    user_response = await upstream.get(user_url, headers=headers)
     user_data = user_response.json()
     if 'name' not in user_data: return "Error: Could not retrieve user data from Google.", 400
     account_name = user_data['name']
     try:
         template_data = await get_verification_data(state)
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.execute("UPDATE verification_links SET status = 'verified', verified_account = ? WHERE state = ? AND status = 'pending'", (account_name, state))
-            await conn.commit()
+        await app.db.complete_verification_if_pending(state, account_name)
         return await render_template("success.html", account_name=account_name, **template_data)
     except Exception as e:
         print(f"Database error during YouTube callback: {e}"); return "An internal server error occurred.", 500
@@ -672,13 +1204,13 @@ async def user_activity_page(guild_id: int, user_id: int):
     token = request.args.get('token')
     approver_name = "Staff Member"
     
-    request_data = await database.get_tier_request_by_token(token)
+    request_data = await app.db.get_tier_request_by_token(token)
     if not request_data or request_data['guild_id'] != guild_id or request_data['user_id'] != user_id:
         return "<h1>Invalid or expired link.</h1>", 403
 
     user_data = await fetch_user_data(user_id)
-    activity_data = await database.get_user_activity(guild_id, user_id)
-    requirements = (await database.get_all_tier_requirements(guild_id)).get(request_data['next_tier'], {})
+    activity_data = await app.db.get_user_activity(guild_id, user_id)
+    requirements = (await app.db.get_all_tier_requirements(guild_id)).get(request_data['next_tier'], {})
 
     return await render_template(
         "user_activity.html",
@@ -696,7 +1228,7 @@ async def approve_tier_up():
     token = form.get('token')
     approver_name = form.get('approver_name')
 
-    request_data = await database.get_tier_request_by_token(token)
+    request_data = await app.db.get_tier_request_by_token(token)
     if not request_data:
         return "<h1>Invalid or expired request.</h1>", 403
 
@@ -707,37 +1239,38 @@ async def approve_tier_up():
         "message_id": request_data['message_id'],
         "approver_name": approver_name
     }
-    app.bot_instance.tier_approval_queue.put_nowait(approval_details)
+    app.gateway.submit_tier_approval(approval_details)
 
-    await database.delete_tier_request(token)
+    await app.db.delete_tier_request(token)
 
     template_data = await get_verification_data(token)
     return await render_template("success.html", account_name=f"User has been approved for Tier {request_data['next_tier']}", **template_data)
 
 @app.route('/dashboard/<int:guild_id>')
 async def activity_dashboard(guild_id: int):
-    bot = app.bot_instance
-    guild = bot.get_guild(guild_id)
+    guild = await app.gateway.get_guild(guild_id)
     if not guild:
         return "<h1>Guild not found.</h1>", 404
 
-    top_users_raw = await database.get_top_users_overall(guild_id)
-    top_text_raw = await database.get_top_text_channels(guild_id)
-    top_voice_raw = await database.get_top_voice_channels(guild_id)
+    top_users_raw = await app.db.get_top_users_overall(guild_id)
+    top_text_raw = await app.db.get_top_text_channels(guild_id)
+    top_voice_raw = await app.db.get_top_voice_channels(guild_id)
 
     top_users = []
-    for user_id, msg_count, vc_sec in top_users_raw:
-        user_info = await fetch_user_data(user_id)
+    user_infos = await fetch_users_data(user_id for user_id, _, _ in top_users_raw)
+    for (user_id, msg_count, vc_sec), user_info in zip(top_users_raw, user_infos):
         top_users.append({'name': user_info['name'], 'message_count': msg_count, 'voice_seconds': vc_sec})
 
-    top_text = [{'name': (guild.get_channel(cid) or "Unknown Channel").name, 'message_count': count} for cid, count in top_text_raw]
-    top_voice = [{'name': (guild.get_channel(cid) or "Unknown Channel").name, 'voice_seconds': secs} for cid, secs in top_voice_raw]
+    text_names = await app.gateway.get_channel_names(guild_id, [cid for cid, _ in top_text_raw])
+    voice_names = await app.gateway.get_channel_names(guild_id, [cid for cid, _ in top_voice_raw])
+    top_text = [{'name': name or "Unknown Channel", 'message_count': count} for (cid, count), name in zip(top_text_raw, text_names)]
+    top_voice = [{'name': name or "Unknown Channel", 'voice_seconds': secs} for (cid, secs), name in zip(top_voice_raw, voice_names)]
 
     rendered_template = await render_template(
         "dashboard.html",
         guild_id=guild_id,
-        guild_name=guild.name,
-        guild_icon_url=guild.icon.url if guild.icon else None,
+        guild_name=guild["name"],
+        guild_icon_url=guild["icon_url"],
         top_users=top_users,
         top_text_channels=top_text,
         top_voice_channels=top_voice
@@ -749,6 +1282,22 @@ async def activity_dashboard(guild_id: int):
     response.headers['Expires'] = '0'
     return response
 
+def member_search_limit() -> int | None:
+    """The request's `limit` argument clamped to MEMBER_SUGGEST_MAX_LIMIT, or None if it is not a number."""
+    try:
+        limit = int(request.args.get('limit', config.BOT_CONFIG["MEMBER_SUGGEST_LIMIT"]))
+    except ValueError:
+        return None
+    return max(1, min(limit, config.BOT_CONFIG["MEMBER_SUGGEST_MAX_LIMIT"]))
+
+def member_search_result(member: dict) -> dict:
+    return {
+        "id": str(member["id"]),
+        "name": member["name"],
+        "username": member["username"],
+        "avatar": member["avatar_url"]
+    }
+
 @app.route('/api/user_search/<int:guild_id>')
 async def api_user_search(guild_id: int):
     query = request.args.get('query', '').lower()
@@ -758,60 +1307,67 @@ async def api_user_search(guild_id: int):
         response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
         return response
 
-    bot = app.bot_instance
-    guild = bot.get_guild(guild_id)
-    if not guild:
+    if not await app.gateway.get_guild(guild_id):
         response = jsonify({"error": "Guild not found."})
         response.status_code = 404
         response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
         return response
 
-    found_member = None
-    # --- MODIFICATION: Exclude bots from the search ---
-    if query.isdigit():
-        member = guild.get_member(int(query))
-        if member and not member.bot:
-            found_member = member
-    else:
-        if '#' in query:
-            name, discrim = query.split('#')
-            member = discord.utils.get(guild.members, name=name, discriminator=discrim)
-            if member and not member.bot:
-                found_member = member
-        if not found_member:
-            # This lambda now checks `not m.bot`
-            found_member = discord.utils.find(lambda m: query in m.display_name.lower() and not m.bot, guild.members)
-
-    if not found_member:
+    limit = member_search_limit()
+    if limit is None:
+        response = jsonify({"error": "Invalid limit."})
+        response.status_code = 400
+        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+        return response
+
+    # Bots are excluded from the search. The report is for the best match; the rest are listed so the user can pick one.
+    matches = await app.gateway.find_members(guild_id, query, limit)
+
+    if not matches:
         response = jsonify({"error": "User not found in this server."})
         response.status_code = 404
         response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
         return response
+    found_member = matches[0]
 
     # Fetch all the user's data
-    activity = await database.get_user_activity(guild_id, found_member.id)
-    channel_activity_raw = await database.get_user_channel_activity(guild_id, found_member.id)
-    tier = await database.get_user_tier(guild_id, found_member.id)
+    activity = await app.db.get_user_activity(guild_id, found_member["id"])
+    channel_activity_raw = await app.db.get_user_channel_activity(guild_id, found_member["id"])
+    tier = await app.db.get_user_tier(guild_id, found_member["id"])
 
+    channel_names = await app.gateway.get_channel_names(guild_id, [cid for cid, _, _ in channel_activity_raw])
     channel_activity = {}
-    for cid, msgs, secs in channel_activity_raw:
-        channel = guild.get_channel(cid)
-        if channel:
-            channel_activity[channel.name] = {'messages': msgs, 'voice_seconds': secs}
+    for (cid, msgs, secs), channel_name in zip(channel_activity_raw, channel_names):
+        if channel_name:
+            channel_activity[channel_name] = {'messages': msgs, 'voice_seconds': secs}
 
     final_response = jsonify({
-        "name": found_member.display_name,
-        "avatar_url": found_member.display_avatar.url,
+        "name": found_member["name"],
+        "avatar_url": found_member["avatar_url"],
         "tier": tier or 1,
         "total_messages": activity.get('message_count', 0) if activity else 0,
         "total_voice_seconds": activity.get('voice_seconds', 0) if activity else 0,
-        "channel_activity": channel_activity
+        "channel_activity": channel_activity,
+        "matches": [member_search_result(member) for member in matches]
     })
     final_response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     final_response.headers['Pragma'] = 'no-cache'
     final_response.headers['Expires'] = '0'
     return final_response
 
+@app.route('/api/v1/members/suggest/<int:guild_id>')
+@login_required
+async def api_member_suggest(guild_id: int):
+    """Typeahead for the user search box: the best matching members for a partial name."""
+    if not await app.gateway.get_guild(guild_id):
+        return jsonify({"error": "Guild not found."}), 404
+    limit = member_search_limit()
+    if limit is None:
+        return jsonify({"error": "Invalid limit."}), 400
+
+    members = await app.gateway.search_members(guild_id, request.args.get('q', ''), limit)
+    return jsonify({"results": [member_search_result(member) for member in members]})
+
 # In web_server.py, add these routes after the existing API routes
 
 @app.route('/api/v1/actions/run-setup/<int:guild_id>', methods=['POST'])
@@ -829,7 +1385,7 @@ async def api_run_setup(guild_id: int):
         "moderator_id": int(session.get('user_id')),
         "setup_type": setup_type
     }
-    app.bot_instance.action_queue.put_nowait(task)
+    app.gateway.submit_action(task)
     return jsonify({"message": f"Setup command for '{setup_type}' queued successfully."}), 200
 
 @app.route('/api/v1/actions/send-message/<int:guild_id>', methods=['POST'])
@@ -847,26 +1403,18 @@ async def api_send_message(guild_id: int):
     if not task['channel_id'] or not task['content']:
         return jsonify({"error": "Channel ID and Content are required."}), 400
 
-    app.bot_instance.action_queue.put_nowait(task)
+    app.gateway.submit_action(task)
     return jsonify({"message": "Message queued successfully."}), 200
 
 @app.route('/api/v1/audit-log/<int:guild_id>')
 @login_required
 async def api_get_audit_log(guild_id: int):
     """API endpoint to fetch the audit log."""
-    guild = app.bot_instance.get_guild(guild_id)
-    logs = []
     try:
-        async for entry in guild.audit_logs(limit=25):
-            logs.append({
-                "user": str(entry.user),
-                "action": entry.action.name.replace('_', ' ').title(),
-                "target": str(entry.target) if entry.target else "N/A",
-                "reason": str(entry.reason) if entry.reason else "No reason provided."
-            })
+        logs = await app.gateway.get_audit_log(guild_id, 25)
+        if logs is None:
+            return jsonify({"error": "Bot lacks permission to view audit logs."}), 403
         return jsonify(logs)
-    except discord.Forbidden:
-        return jsonify({"error": "Bot lacks permission to view audit logs."}), 403
     except Exception as e:
         log.error(f"Failed to fetch audit log for guild {guild_id}: {e}")
         return jsonify({"error": "An internal error occurred."}), 500
@@ -877,9 +1425,7 @@ async def api_manage_staff(guild_id: int):
     """API endpoint to add or remove a staff role from a user."""
     form = await request.form
     # Ensure the user making the request is an Admin
-    guild = app.bot_instance.get_guild(guild_id)
-    moderator = guild.get_member(int(session.get('user_id')))
-    if not await utils.has_admin_role(moderator):
+    if await app.gateway.get_access_level(guild_id, int(session.get('user_id'))) != "Admin":
         return jsonify({"error": "You must be a Bot Admin to perform this action."}), 403
 
     task = {
@@ -894,5 +1440,5 @@ async def api_manage_staff(guild_id: int):
     if not all(k in task for k in ['target_id', 'role_type', 'role_action']):
         return jsonify({"error": "Missing required fields."}), 400
 
-    app.bot_instance.action_queue.put_nowait(task)
+    app.gateway.submit_action(task)
     return jsonify({"message": f"Staff role {task['role_action']} action queued successfully."}), 200
\ No newline at end of file
@@ -0,0 +1,87 @@
+"""One web server worker process, started by the bot when WEB_WORKERS is above zero.
+
+Every worker listens on the same port with SO_REUSEPORT, so the kernel spreads connections across
+them, and reaches the bot over the IPC bus instead of sharing its event loop.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+
+import config
+from bot_gateway import RemoteDatabase, connect_gateway
+from ipc import IPCClient
+from web_server import app, widget_updates
+
+log = logging.getLogger(__name__)
+
+def bind_shared_socket(port: int) -> socket.socket:
+    """A listening socket on the web port that the other workers can bind as well."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(("0.0.0.0", port))
+    sock.listen(1024)
+    sock.setblocking(False)
+    return sock
+
+async def watch_bot(client: IPCClient, parent_pid: int, shutdown: asyncio.Event):
+    """Stops the worker when the bot's process exits or the bus has been down too long, so none are orphaned."""
+    exit_after = config.BOT_CONFIG["IPC_DISCONNECT_EXIT_SECONDS"]
+    disconnected_since = None
+    while not shutdown.is_set():
+        await asyncio.sleep(1)
+        if os.getppid() != parent_pid:
+            log.warning("The bot's process has exited; shutting down.")
+            break
+        if client.connected.is_set():
+            disconnected_since = None
+        elif disconnected_since is None:
+            disconnected_since = time.monotonic()
+        elif time.monotonic() - disconnected_since > exit_after:
+            log.warning(f"Could not reach the bot for {exit_after}s; shutting down.")
+            break
+    shutdown.set()
+
+async def run_worker(port: int, worker_id: int):
+    parent_pid = os.getppid()
+    client = IPCClient(config.BOT_CONFIG["IPC_SOCKET_PATH"])
+    try:
+        await asyncio.wait_for(client.start(), config.BOT_CONFIG["IPC_DISCONNECT_EXIT_SECONDS"])
+    except asyncio.TimeoutError:
+        log.error(f"Could not reach the bot over IPC within {config.BOT_CONFIG['IPC_DISCONNECT_EXIT_SECONDS']}s; exiting.")
+        await client.close()
+        return
+    app.gateway = connect_gateway(client)
+    # Every database call goes to the bot; a worker never opens the database file itself.
+    app.db = RemoteDatabase(client)
+    # The bot builds every widget update and sends it here over the bus.
+    widget_updates.publisher = None
+
+    sock = bind_shared_socket(port)
+    hypercorn_config = Config()
+    hypercorn_config.bind = [f"fd://{sock.fileno()}"]
+
+    shutdown = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, shutdown.set)
+    watchdog = asyncio.create_task(watch_bot(client, parent_pid, shutdown))
+    log.info(f"Web worker {worker_id} serving on port {port}.")
+    try:
+        await serve(app, hypercorn_config, shutdown_trigger=shutdown.wait)
+    finally:
+        watchdog.cancel()
+        await client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--worker-id", type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format=f"[%(asctime)s] [%(levelname)-8s] web-{args.worker_id} %(name)-12s: %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    asyncio.run(run_worker(args.port, args.worker_id))